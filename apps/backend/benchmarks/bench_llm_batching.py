@@ -0,0 +1,69 @@
+"""
+Сравнение пропускной способности (отзывов/сек) одиночного и пакетного анализа.
+
+Работает с настоящим LLM-сервером из LLM_API_URL / MODEL_NAME.
+
+    cd apps/backend
+    PYTHONPATH=src LLM_API_URL=http://localhost:11434/api/generate \\
+        python benchmarks/bench_llm_batching.py --file src/backend/api/text.csv --limit 64 --batch-sizes 1,4,8
+"""
+
+import argparse
+import asyncio
+import csv
+import time
+
+from backend.config import get_settings
+from backend.core.llm_client import close_llm_client
+from backend.services.analysis import analyze_reviews_batch
+
+
+def load_texts(path: str, limit: int) -> list[str]:
+    texts = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                texts.append(row[0].strip())
+            if len(texts) >= limit:
+                break
+    return texts
+
+
+async def run(texts: list[str], batch_size: int, concurrency: int) -> tuple[float, int]:
+    chunks = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(chunk: list[str]) -> list[dict]:
+        async with semaphore:
+            return await analyze_reviews_batch(chunk)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(c) for c in chunks))
+    elapsed = time.perf_counter() - started
+    parsed = sum(1 for chunk in results for r in chunk if r.get("review_analysis"))
+    return elapsed, parsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", required=True)
+    parser.add_argument("--limit", type=int, default=64)
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument(
+        "--concurrency", type=int, default=get_settings().llm_concurrency * max(1, len(get_settings().llm_api_urls))
+    )
+    args = parser.parse_args()
+
+    texts = load_texts(args.file, args.limit)
+    print(f"{len(texts)} reviews, concurrency={args.concurrency}, model={get_settings().llm_model_name}")
+    print(f"{'batch':>6} {'seconds':>9} {'reviews/s':>10} {'parsed':>7}")
+    try:
+        for batch_size in (int(x) for x in args.batch_sizes.split(",")):
+            elapsed, parsed = await run(texts, batch_size, args.concurrency)
+            print(f"{batch_size:>6} {elapsed:>9.2f} {len(texts) / elapsed:>10.2f} {parsed:>7}")
+    finally:
+        await close_llm_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,19 +5,19 @@ from fastapi import APIRouter, HTTPException, Query, Depends
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..services.analysis_state import get_is_analyzing
-from ..services.dashboard_metrics import ThemeCount, DayCount
-
-from ..core.db import get_db_session
+from ..config import get_settings
+from ..models.import_models import AnalysisProgressResponse
 from ..services.dashboard_metrics import (
-    get_total_reviews,
-    get_sentiment_distribution,
-    get_avg_sentiment_score,
-    get_total_themes,
-    get_non_positive_themes,
-    get_top_themes,
-    get_all_daily_counts,
+    ThemeCount,
+    DayCount,
+    get_dashboard_review_summary,
+    get_dashboard_theme_summary,
 )
+from ..services.import_progress import get_active_progress
+from ..services.metrics_executor import gather_metrics
+from ..services.response_cache import cached_response
+
+from ..core.db import get_db_session
 
 router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
 
@@ -40,9 +40,6 @@ async def dashboard_summary(
     product_id: int = Query(...),
     db: AsyncSession = Depends(get_db_session),
 ):
-    # Проверка, не выполняется ли в данный момент анализ
-    if get_is_analyzing():
-        raise HTTPException(status_code=409, detail="Data analysis is in progress. Please try again later.")
     # Валидация дат
     try:
         sd = datetime.strptime(start_date, "%Y-%m-%d")
@@ -55,27 +52,26 @@ async def dashboard_summary(
     start_ts = sd
     end_excl = ed + timedelta(days=1)
 
-    total_reviews = await get_total_reviews(db, start_ts, end_excl)
-    sentiment_distribution = await get_sentiment_distribution(db, start_ts, end_excl)
-    avg_sentiment_score = await get_avg_sentiment_score(db, start_ts, end_excl)
-    total_themes = await get_total_themes(db, start_ts, end_excl)
-    non_positive_themes = await get_non_positive_themes(db, start_ts, end_excl)
-    top_negative_themes = await get_top_themes(db, start_ts, end_excl, sentiment="отрицательная")
-    top_positive_themes = await get_top_themes(db, start_ts, end_excl, sentiment="положительная")
-    daily_counts = await get_all_daily_counts(db, start_ts, end_excl)
+    async def compute() -> dict:
+        # Два независимых запроса сводки выполняются параллельно на разных соединениях
+        reviews_part, themes_part = await gather_metrics(
+            lambda s: get_dashboard_review_summary(s, start_ts, end_excl),
+            lambda s: get_dashboard_theme_summary(s, start_ts, end_excl),
+        )
+        return {**reviews_part, **themes_part}
 
-    return DashboardSummaryResponse(
-        total_reviews=total_reviews,
-        sentiment_distribution=sentiment_distribution,
-        avg_sentiment_score=avg_sentiment_score,
-        total_themes=total_themes,
-        non_positive_themes=non_positive_themes,
-        top_negative_themes=top_negative_themes,
-        top_positive_themes=top_positive_themes,
-        daily_counts=daily_counts,
+    # Сводка кэшируется до следующего коммита отзывов
+    summary = await cached_response(
+        db,
+        "dashboard_summary",
+        {"start": sd.date().isoformat(), "end": ed.date().isoformat()},
+        compute,
     )
+    return DashboardSummaryResponse(**summary)
 
-@router.get("/is-analyzing")
-async def is_analyzing_endpoint():
-    from ..services.analysis_state import get_is_analyzing
-    return {"is_analyzing": get_is_analyzing()}
+@router.get("/is-analyzing", response_model=AnalysisProgressResponse)
+async def is_analyzing_endpoint(db: AsyncSession = Depends(get_db_session)):
+    # Дешёвый эндпоинт прогресса: только активные пакеты импорта, общие для всех процессов.
+    # Дашборды во время импорта продолжают отдавать уже закоммиченные данные.
+    batches = await get_active_progress(db, get_settings().import_progress_stale_seconds)
+    return AnalysisProgressResponse(is_analyzing=bool(batches), batches=batches)
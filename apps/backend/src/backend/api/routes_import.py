@@ -1,19 +1,42 @@
-import csv
-import io
 import json
-from typing import Optional
-from pathlib import Path
+from collections import Counter
+from typing import Dict, Iterable, Optional
 
-from fastapi import APIRouter, UploadFile, File, Form
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi import BackgroundTasks
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..core.db import get_db_session
-from ..models.db_models import ImportBatch, Review, ReviewTheme
-from ..models.import_models import ImportRequest
-from ..services.analysis import analyze_review
-from ..services.analysis_state import set_analysis_state, set_is_analyzing
+from ..config import get_settings
+from ..core.db import get_db_session, get_session
+from ..models.db_models import ImportBatch
+from ..models.import_models import BatchProgress, ImportRequest
+from ..services.dedup import DedupStats, dedup_texts
+from ..services.prefilter import PrefilterStats, prefilter_texts
+from ..services.import_progress import create_batch_progress, get_batch_progress, report_batch_progress
+from ..services.ingest import (
+    ImportFormatError,
+    ImportRow,
+    ReadProgress,
+    detect_import_format,
+    file_read_progress,
+    format_source_type,
+    iter_import_texts,
+    parse_column_mapping,
+    remove_spooled_file,
+    spool_upload,
+)
+from ..services.job_queue import enqueue_import_job
+from ..services.pipeline import (
+    BatchThroughput,
+    analysis_concurrency,
+    analyze_in_order,
+    get_batch_throughput,
+    register_batch_throughput,
+)
+from ..services.response_cache import bump_data_generation_after_write
+from ..services.review_writer import ReviewBulkWriter, analysis_model, parse_review_analysis
+from ..services.tiered_analysis import TierStats, analyze_row, make_tiered_analyzer
 
 router = APIRouter(prefix="/api/reviews", tags=["import"])
 
@@ -31,105 +54,230 @@ async def import_csv(
         delete_spam: bool = Form(False),
         normalize_text: bool = Form(False),
         language: Optional[str] = Form(None),
+        column_mapping: Optional[str] = Form(None),
         db: AsyncSession = Depends(get_db_session)
 ):
-
+    # Формат файла: по расширению (.csv, .xlsx, .jsonl/.ndjson), иначе по source (excel, api — JSON Lines).
+    # column_mapping — JSON {"text": ..., "date": ..., "language": ...} с именами или номерами колонок;
+    # language — язык отзывов, для которых он не задан колонкой
+    fmt = detect_import_format(source, file.filename)
+    try:
+        columns = parse_column_mapping(column_mapping)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # Собираем модель метаданных из полей формы
     req = ImportRequest(
-        source=source,
+        source=format_source_type(fmt),
         batch_id=batch_id,
-        filename=None,
+        filename=file.filename,
         delimiter=delimiter,
         encoding=encoding,
         metadata=json.loads(metadata) if metadata else None,
     )
 
+    # Параметры обработки пакета; в режиме очереди хранятся в задании
+    options = {
+        "delete_duplicates": delete_dublicates,
+        "delete_spam": delete_spam,
+        "normalize_text": normalize_text,
+        "format": fmt,
+        "columns": columns,
+        "language": language or None,
+    }
+
+    # Файл копируется на диск кусками и дальше читается потоково
+    settings = get_settings()
+    spooled_path = await spool_upload(file, settings.import_spool_dir, suffix=f".{fmt}")
+
     try:
-        content = await file.read()
+        new_batch = ImportBatch(source_type=req.source, source_name=req.filename, meta_info=req.metadata)
+        db.add(new_batch)
+
+        await db.commit()
+        await db.refresh(new_batch)
+
+        await create_batch_progress(db, new_batch.id)
+
+        if settings.import_queue_enabled:
+            # Анализ выполнят воркеры; задание переживает рестарт API
+            await enqueue_import_job(
+                db,
+                new_batch.id,
+                spooled_path,
+                delimiter,
+                encoding,
+                chunk_size=settings.import_chunk_size,
+                options=options,
+            )
     except Exception:
-        file.file.seek(0)
-        content = file.file.read()
+        remove_spooled_file(spooled_path)
+        raise
+
+    if not settings.import_queue_enabled:
+        background_tasks.add_task(process_import_file, new_batch.id, spooled_path, delimiter, encoding, options)
+
+    # Количество строк заранее не считается (это лишний проход по файлу);
+    # прогресс доступен по /api/reviews/import/{batch_id}/progress
+    return {"status": "ok", "imported_count": None, "batch_id": new_batch.id or "generated"}
 
+
+async def process_import_file(
+    batch_id: int,
+    path: str,
+    delimiter: str = ',',
+    encoding: str = 'utf-8',
+    options: Optional[dict] = None,
+):
+    options = options or {}
+    read_progress = file_read_progress(path)
+    texts = iter_import_texts(
+        path,
+        options.get("format", "csv"),
+        delimiter,
+        encoding,
+        read_progress,
+        columns=options.get("columns"),
+        default_language=options.get("language"),
+    )
     try:
-        decoded = content.decode(encoding or 'utf-8')
-    except Exception:
-        decoded = content.decode('utf-8', errors='replace')
+        return await process_batch_data(batch_id, texts, read_progress, options)
+    finally:
+        remove_spooled_file(path)
+
 
-    set_is_analyzing(True)
-    stream = io.StringIO(decoded)
-    reader = csv.reader(stream, delimiter=',')
-    total_rows = sum(1 for row in reader)
-    stream.seek(0)
-    reader = csv.reader(stream, delimiter=',')
+async def process_batch_data(
+    batch_id: int,
+    rows: Iterable[ImportRow],
+    read_progress: Optional[ReadProgress] = None,
+    options: Optional[dict] = None,
+):
+    options = options or {}
+    stats = register_batch_throughput(BatchThroughput(batch_id))
+    settings = get_settings()
+    session_maker = get_session()
+    prefilter_stats = PrefilterStats()
+    dedup_stats = DedupStats()
+    reported_skipped: Counter = Counter()
+    tier_stats = TierStats()
+    reported_tiers: Counter = Counter()
+    reported_warnings: Counter = Counter()
+
+    def skipped_delta() -> Dict[str, int]:
+        # отброшенные строки по причинам с прошлого отчёта о прогрессе
+        read_skipped = read_progress.reasons() if read_progress else {}
+        delta = Counter({**read_skipped, **prefilter_stats.reasons(), **dedup_stats.reasons()}) - reported_skipped
+        reported_skipped.update(delta)
+        return dict(delta)
 
-    new_batch = ImportBatch(source_type=source, source_name=req.filename, meta_info=req.metadata)
-    db.add(new_batch)
+    def tiers_delta() -> Dict[str, int]:
+        delta = Counter(tier_stats.counts()) - reported_tiers
+        reported_tiers.update(delta)
+        return dict(delta)
 
-    await db.commit()
-    await db.refresh(new_batch)
+    def warnings_delta() -> Dict[str, int]:
+        # строки с нераспознанной датой сохраняются с датой импорта — об этом видно в прогрессе
+        delta = Counter(read_progress.warnings() if read_progress else {}) - reported_warnings
+        reported_warnings.update(delta)
+        return dict(delta)
 
-    await set_analysis_state(db, is_analyzed=False, result_text=None)
-    background_tasks.add_task(process_batch_data, new_batch.id, decoded, delimiter)
+    async def on_flush(written: int, failed: int) -> None:
+        # прогресс пишется в БД после каждого чанка, чтобы его видели все процессы
+        await report_batch_progress(
+            session_maker,
+            batch_id,
+            processed_delta=written,
+            failed_delta=failed,
+            skipped=skipped_delta(),
+            tiers=tiers_delta(),
+            warnings=warnings_delta(),
+            total_rows=read_progress.estimated_total_rows() if read_progress else None,
+            total_is_estimate=not read_progress.finished if read_progress else None,
+        )
 
-    return {"status": "ok", "imported_count": total_rows, "batch_id": new_batch.id or "generated"}
+    # мусор и дубликаты отбрасываются до обращения к LLM
+    source = rows
+    if options.get("delete_spam") or options.get("normalize_text"):
+        source = prefilter_texts(
+            source, prefilter_stats, drop_spam=options.get("delete_spam"), normalize=options.get("normalize_text")
+        )
+    if options.get("delete_duplicates"):
+        source = dedup_texts(source, dedup_stats)
 
+    # уверенные предсказания локальной модели не доходят до LLM
+    analyze = analyze_row
+    tiered = make_tiered_analyzer(tier_stats)
+    if tiered is not None:
+        source = tiered.stream(source)
+        analyze = tiered
 
-async def process_batch_data(batch_id: int, decoded_text: str, delimiter: str = ','):
-    agen = get_db_session()
-    session = await agen.__anext__()
+    writer = ReviewBulkWriter(
+        session_maker, batch_id, chunk_size=settings.db_write_chunk_size, on_flush=on_flush
+    )
+    status = "failed"
+    error = None
     try:
-        imported_count = 0
-        stream = io.StringIO(decoded_text)
-        reader = csv.reader(stream, delimiter=delimiter)
-
-        for row in reader:
-            if not row:
-                continue
-            text = row[0].strip()
-            if not text:
-                continue
-
-            print(text)
-            analysis = await analyze_review(text)
-            if isinstance(analysis, str):
-                try:
-                    parsed = json.loads(analysis)
-                except Exception:
-                    parsed = {}
-            else:
-                parsed = analysis or {}
-
-
-            print(f"Parsed analysis: {parsed}")
-            ra = parsed.get("review_analysis", {}) if isinstance(parsed, dict) else {}
-            overall = ra.get("overall_sentiment")
-            themes = ra.get("key_themes", []) or []
-
-            # сохраняем Review
-            review = Review(batch_id=batch_id, raw_text=text, overall_sentiment=overall)
-            session.add(review)
-            print("Saving review...")
-            await session.flush()  # чтобы получить review.id
-
-            # сохраняем темы
-            for t in themes:
-                theme_name = t.get("theme")
-                sentiment = t.get("sentiment")
-                theme_obj = ReviewTheme(review_id=review.id, theme=theme_name, sentiment=sentiment)
-                session.add(theme_obj)
-                print("Saving theme...")
-                await session.flush()
-            imported_count += 1
-
-        await session.commit()
-        return imported_count
+        await report_batch_progress(session_maker, batch_id, status="running")
+        # Несколько отзывов одновременно анализируются LLM, результаты приходят по порядку.
+        # Уже анализировавшиеся тексты берутся из кэша без обращения к LLM.
+        async for row, analysis in analyze_in_order(
+            source,
+            analyze,
+            # в пакетном режиме одновременно нужно держать несколько полных пакетов,
+            # при нескольких серверах LLM — загрузить каждый
+            concurrency=analysis_concurrency(),
+            stats=stats,
+        ):
+            overall, themes = parse_review_analysis(analysis)
+
+            # отзыв и его темы пишутся в БД чанками
+            await writer.add(row, overall, themes, analysis_model(analysis))
+
+        await writer.flush()
+        if writer.failed:
+            print(f"⚠️ Не удалось сохранить {writer.failed} отзывов пакета {batch_id}")
+        if prefilter_stats.dropped or dedup_stats.skipped:
+            print(f"Пропущено строк пакета {batch_id}: {prefilter_stats.as_dict()}, {dedup_stats.as_dict()}")
+        if tiered is not None:
+            print(f"Уровни анализа пакета {batch_id}: {tier_stats.as_dict()}")
+        status = "done"
+        return writer.written
+    except ImportFormatError as e:
+        # файл не разбирается: причина сохраняется в прогрессе, как у задания очереди (_fail_job)
+        error = str(e)
+        print(f"⚠️ Пакет {batch_id} не импортирован: {error}")
+        return writer.written
     finally:
-        set_is_analyzing(False)
-        try :
-            await agen.close()
-        except Exception:
-            pass
+        if writer.written:
+            # чанки увеличивают поколение не чаще интервала — в конце пакета обязательно
+            await bump_data_generation_after_write(session_maker, force=True)
+        await report_batch_progress(
+            session_maker,
+            batch_id,
+            status=status,
+            error=error,
+            skipped=skipped_delta(),
+            tiers=tiers_delta(),
+            warnings=warnings_delta(),
+            total_rows=writer.written + writer.failed + sum(reported_skipped.values()) if status == "done" else None,
+            total_is_estimate=False if status == "done" else None,
+        )
+
+
+@router.get("/import/{batch_id}/progress", response_model=BatchProgress)
+async def get_import_progress(batch_id: int, db: AsyncSession = Depends(get_db_session)):
+    progress = await get_batch_progress(db, batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return progress
+
+
+@router.get("/import/{batch_id}/throughput")
+async def get_import_throughput(batch_id: int):
+    stats = get_batch_throughput(batch_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No throughput data for this batch in this process")
+    return stats.as_dict()
 
 
 @router.get("/last_imports")
@@ -0,0 +1,48 @@
+from fastapi import APIRouter
+
+from ..core.llm_client import get_llm_call_stats, get_llm_client
+from ..services.analysis import get_analysis_limiter
+from ..services.analysis_cache import get_analysis_cache
+from ..services.response_cache import get_response_cache
+from ..services.tiered_analysis import get_tier_totals
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("/analysis-cache")
+async def analysis_cache_metrics():
+    # Счётчики попаданий/промахов кэша анализа в текущем процессе
+    return get_analysis_cache().stats()
+
+
+@router.get("/response-cache")
+async def response_cache_metrics():
+    # Попадания в кэш ответов дашборда/брифа по уровням и эндпоинтам (текущий процесс)
+    return get_response_cache().stats()
+
+
+@router.get("/analysis-tiers")
+async def analysis_tier_metrics():
+    # Сколько отзывов разобрала локальная модель и сколько ушло в LLM (текущий процесс),
+    # плюс гистограмма уверенности локальной модели — для подбора LOCAL_MODEL_THRESHOLD
+    return get_tier_totals().as_dict()
+
+
+@router.get("/llm")
+async def llm_call_metrics():
+    # Вызовы LLM по видам: попытки, повторы, таймауты, ранние остановки потока
+    # и гистограммы задержек (весь вызов, одна попытка, до первого токена) в текущем процессе
+    return {kind: stats.as_dict() for kind, stats in get_llm_call_stats().items()}
+
+
+@router.get("/llm-endpoints")
+async def llm_endpoint_metrics():
+    # Серверы пула LLM_API_URL: состояние размыкателя, незавершённые запросы, ошибки
+    return get_llm_client().router.stats()
+
+
+@router.get("/llm-limiter")
+async def llm_limiter_metrics():
+    # Адаптивный лимит запросов анализа: текущий лимит, занято, очередь ожидающих, задержки
+    limiter = get_analysis_limiter()
+    return limiter.stats() if limiter is not None else {"enabled": False}
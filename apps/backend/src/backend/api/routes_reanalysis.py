@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.db import get_db_session
+from ..models.reanalysis_models import ReanalysisJobStatus, ReanalysisStartResponse
+from ..services.reanalysis import (
+    cancel_reanalysis_job,
+    count_stale_reviews,
+    create_reanalysis_job,
+    get_reanalysis_job,
+)
+
+router = APIRouter(prefix="/api/reviews", tags=["reanalysis"])
+
+
+@router.post("/reanalyze", response_model=ReanalysisStartResponse)
+async def start_reanalysis(db: AsyncSession = Depends(get_db_session)):
+    """
+    Запустить повторный анализ отзывов, проанализированных не текущей моделью/промптом.
+    Задание выполняет воркер импорта в простое; данные меняются разом в конце.
+    """
+    job, created = await create_reanalysis_job(db)
+    stale = await count_stale_reviews(db)
+    return ReanalysisStartResponse(created=created, stale_reviews=stale, job=ReanalysisJobStatus(**job))
+
+
+@router.get("/reanalyze/{job_id}", response_model=ReanalysisJobStatus)
+async def get_reanalysis_status(job_id: int, db: AsyncSession = Depends(get_db_session)):
+    job = await get_reanalysis_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Reanalysis job {job_id} not found")
+    return ReanalysisJobStatus(**job)
+
+
+@router.post("/reanalyze/{job_id}/cancel", response_model=ReanalysisJobStatus)
+async def cancel_reanalysis(job_id: int, db: AsyncSession = Depends(get_db_session)):
+    if not await cancel_reanalysis_job(db, job_id):
+        raise HTTPException(status_code=409, detail=f"Reanalysis job {job_id} is not active")
+    return ReanalysisJobStatus(**await get_reanalysis_job(db, job_id))
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель одновременных вызовов LLM по схеме AIMD.
+
+    - Успешный вызов с обычной задержкой при полностью занятом лимите увеличивает
+      лимит на 1/limit, т.е. примерно на единицу за «окно» из limit вызовов.
+    - Ошибка/таймаут или задержка выше `tolerance` × базовой уменьшает лимит
+      в `backoff` раз, не чаще раза за одну текущую задержку (одна перегрузка —
+      одно снижение, а не по снижению на каждый из упавших параллельных вызовов).
+
+    Базовая задержка — медленное скользящее среднее, текущая — быстрое.
+    Вызовы сверх лимита ждут в очереди (FIFO).
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float = 0.8,
+        tolerance: float = 2.0,
+        warmup: int = 10,
+    ) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.warmup = warmup
+        self.in_flight = 0
+        self._waiters: collections.deque = collections.deque()
+        self.samples = 0
+        self.short_latency = 0.0
+        self.long_latency = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.errors = 0
+        self._last_decrease = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # место уже выдано — возвращаем его следующему
+                self.in_flight -= 1
+                self._wake()
+            elif future in self._waiters:
+                self._waiters.remove(future)
+            raise
+
+    def release(self, latency: float, ok: bool) -> None:
+        self.in_flight -= 1
+        self._update(latency, ok)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _update(self, latency: float, ok: bool) -> None:
+        self.samples += 1
+        if self.samples == 1:
+            self.short_latency = self.long_latency = latency
+        else:
+            self.short_latency += 0.3 * (latency - self.short_latency)
+            self.long_latency += 0.02 * (latency - self.long_latency)
+
+        if not ok:
+            self.errors += 1
+        overloaded = not ok or (
+            self.samples > self.warmup and self.short_latency > self.long_latency * self.tolerance
+        )
+        now = time.monotonic()
+        if overloaded:
+            if now - self._last_decrease >= self.short_latency:
+                self._last_decrease = now
+                new_limit = max(self.min_limit, self.limit * self.backoff)
+                if new_limit < self.limit:
+                    self.decreases += 1
+                    logger.info("LLM concurrency limit %.1f -> %.1f", self.limit, new_limit)
+                self.limit = new_limit
+        elif self.in_flight + 1 >= int(self.limit) and self.limit < self.max_limit:
+            # лимит растёт, только когда он действительно был исчерпан
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        Занять место на время вызова; исход вызова сообщается через `outcome["ok"]`.
+        Отменённый снаружи вызов (остановка импорта) на лимит не влияет.
+        """
+        await self.acquire()
+        started = time.monotonic()
+        outcome = {"ok": False}
+        try:
+            yield outcome
+        except asyncio.CancelledError:
+            self.in_flight -= 1
+            self._wake()
+            raise
+        except BaseException:
+            self.release(time.monotonic() - started, False)
+            raise
+        else:
+            self.release(time.monotonic() - started, outcome["ok"])
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "samples": self.samples,
+            "latency_short_sec": round(self.short_latency, 3),
+            "latency_baseline_sec": round(self.long_latency, 3),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "errors": self.errors,
+        }
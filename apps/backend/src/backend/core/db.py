@@ -5,16 +5,41 @@ from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+from ..config import get_settings
 from ..models.db_models import Base
+from .migrations import run_migrations
 
 _engine: AsyncEngine | None = None
 _SessionLocal: sessionmaker | None = None
 
 
-def get_engine(database_url: str) -> AsyncEngine:
+def get_engine(
+    database_url: str,
+    pool_size: int | None = None,
+    max_overflow: int | None = None,
+    pool_pre_ping: bool | None = None,
+    pool_timeout: float | None = None,
+) -> AsyncEngine:
+    """
+    Создаёт (один раз на процесс) движок и фабрику сессий.
+    Не переданные параметры пула берутся из настроек (DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING, DB_POOL_TIMEOUT).
+    """
     global _engine, _SessionLocal
     if _engine is None:
-        _engine = create_async_engine(database_url, future=True, echo=False)
+        settings = get_settings()
+        _engine = create_async_engine(
+            database_url,
+            future=True,
+            echo=False,
+            pool_size=settings.db_pool_size if pool_size is None else pool_size,
+            max_overflow=settings.db_max_overflow if max_overflow is None else max_overflow,
+            pool_pre_ping=settings.db_pool_pre_ping if pool_pre_ping is None else pool_pre_ping,
+            pool_timeout=settings.db_pool_timeout if pool_timeout is None else pool_timeout,
+            # сутки агрегатов (date_trunc) и границы окон дашборда считаются в UTC
+            # независимо от TimeZone сервера
+            connect_args={"server_settings": {"timezone": "UTC"}},
+        )
         _SessionLocal = sessionmaker(bind=_engine, class_=AsyncSession, expire_on_commit=False)
     return _engine
 
@@ -38,9 +63,10 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
 
 
 async def init_db(engine: AsyncEngine) -> None:
-    # Создаёт все таблицы, описанные в моделях
+    # Создаёт все таблицы, описанные в моделях, и применяет миграции уже существующих
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
 
 
 async def drop_db(engine: AsyncEngine) -> None:
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import json
+import logging
+import time
+
+import httpx
+
+from ..config import get_settings
+from .llm_router import LLMRouter, LLMServerError
+
+logger = logging.getLogger(__name__)
+
+_client: LLMClient | None = None
+
+# границы корзин гистограмм задержек, сек
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def as_dict(self) -> dict:
+        buckets = {f"le_{b:g}": n for b, n in zip(LATENCY_BUCKETS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.total,
+            "avg_sec": round(self.sum / self.total, 3) if self.total else 0.0,
+            "buckets": buckets,
+        }
+
+
+class LLMCallStats:
+    """Счётчики и гистограммы задержек вызовов одного вида (анализ отзыва, пакет, рекомендации)."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.early_stops = 0
+        # полное время вызова (с повторами), одной попытки и до первого токена (в потоковом режиме)
+        self.latency = LatencyHistogram()
+        self.attempt_latency = LatencyHistogram()
+        self.first_token = LatencyHistogram()
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "early_stops": self.early_stops,
+            "latency": self.latency.as_dict(),
+            "attempt_latency": self.attempt_latency.as_dict(),
+            "first_token": self.first_token.as_dict(),
+        }
+
+
+_call_stats: dict[str, LLMCallStats] = {}
+
+
+def get_llm_call_stats() -> dict[str, LLMCallStats]:
+    return _call_stats
+
+
+class JsonStreamParser:
+    """
+    Инкрементальный разбор JSON-объекта, приходящего по кускам.
+
+    Отслеживает вложенность скобок вне строк и сообщает, как только объект
+    верхнего уровня закрыт. Если задан `stop_key`, готовым считается и момент,
+    когда закрылось значение этого ключа верхнего уровня: остальное модель
+    может не догенерировать — объект дописывается закрывающей скобкой.
+    """
+
+    def __init__(self, stop_key: str | None = None) -> None:
+        self.stop_key = stop_key
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key: str | None = None
+        self._value_key: str | None = None
+        self.result: dict | None = None
+
+    def feed(self, chunk: str) -> dict | None:
+        """Добавить кусок; вернуть разобранный объект, если он уже полный."""
+        if self.result is not None:
+            return self.result
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            i, c = self._pos, text[self._pos]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start:i]
+                continue
+            if c == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif c == ":" and self._depth == 1:
+                self._value_key = self._last_key
+            elif c in "{[":
+                self._depth += 1
+                self._started = True
+            elif c in "}]":
+                self._depth -= 1
+                if self._started and self._depth == 0:
+                    return self._finish(text[:i + 1])
+                if (
+                    self.stop_key is not None
+                    and self._depth == 1
+                    and self._value_key == self.stop_key
+                ):
+                    return self._finish(text[:i + 1] + "}")
+        return None
+
+    def _finish(self, candidate: str) -> dict | None:
+        start = candidate.find("{")
+        try:
+            self.result = json.loads(candidate[start:])
+        except json.JSONDecodeError:
+            # не похоже на корректный JSON — дождёмся конца ответа
+            self.stop_key = None
+            return None
+        return self.result
+
+
+class LLMClient:
+    """
+    Асинхронный HTTP-клиент к LLM-серверам (Ollama-совместимый /api/generate).
+
+    Держит один пул keep-alive соединений на процесс, поэтому тысячи вызовов
+    переиспользуют несколько «тёплых» TCP-соединений вместо открытия нового на каждый отзыв.
+    Сервер для каждой попытки выбирает LLMRouter: при нескольких адресах в LLM_API_URL
+    нагрузка делится между ними, а упавший сервер исключается и повтор уходит на другой.
+    """
+
+    def __init__(
+        self,
+        router: LLMRouter,
+        timeout: httpx.Timeout,
+        limits: httpx.Limits,
+    ) -> None:
+        self.router = router
+        self._http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=limits,
+            headers={"Content-Type": "application/json"},
+        )
+
+    async def generate(self, url: str, payload: dict) -> dict:
+        """Отправляет payload серверу `url` и возвращает JSON ответа. Ошибки httpx пробрасываются наружу."""
+        response = await self._http.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def generate_stream(
+        self,
+        url: str,
+        payload: dict,
+        stop_key: str | None = None,
+        stats: LLMCallStats | None = None,
+    ) -> dict:
+        """
+        Потоковый вариант generate: токены разбираются по мере прихода, и как только
+        JSON-ответ полный, соединение закрывается — сервер прекращает генерацию.
+        Возвращает разобранный JSON из поля "response" (json.JSONDecodeError, если он не разобрался).
+        """
+        parser = JsonStreamParser(stop_key)
+        started = time.monotonic()
+        first_token = True
+        async with self._http.stream("POST", url, json={**payload, "stream": True}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise LLMServerError(f"LLM error: {data['error']}")
+                token = data.get("response", "")
+                if token and first_token:
+                    first_token = False
+                    if stats is not None:
+                        stats.first_token.observe(time.monotonic() - started)
+                if parser.feed(token) is not None:
+                    if not data.get("done") and stats is not None:
+                        stats.early_stops += 1
+                    return parser.result
+                if data.get("done"):
+                    break
+        return json.loads(parser.text.strip())
+
+    async def _attempt(self, payload: dict, stop_key: str | None, stats: LLMCallStats) -> dict:
+        """Одна попытка на выбранном роутером сервере со сроком LLM_CALL_DEADLINE."""
+        settings = get_settings()
+        endpoint = self.router.acquire()
+        try:
+            if settings.llm_stream:
+                call = self.generate_stream(endpoint.url, payload, stop_key, stats)
+            else:
+                call = self._generate_response_json(endpoint.url, payload)
+            result = await asyncio.wait_for(call, timeout=settings.llm_call_deadline)
+        except BaseException as e:
+            self.router.release(endpoint, e)
+            raise
+        self.router.release(endpoint)
+        return result
+
+    async def complete_json(self, payload: dict, kind: str, stop_key: str | None = None) -> dict:
+        """
+        JSON-ответ модели на payload со сроком на попытку (LLM_CALL_DEADLINE) и ограниченным
+        числом повторов (LLM_MAX_RETRIES) при таймаутах, сетевых ошибках, ответах 5xx
+        и кадре ошибки в потоке (LLMServerError).
+        В режиме LLM_STREAM ответ читается потоково и обрывается, как только JSON полный.
+        Задержки пишутся в гистограммы вида `kind`.
+        """
+        settings = get_settings()
+        stats = _call_stats.setdefault(kind, LLMCallStats())
+        stats.calls += 1
+        started = time.monotonic()
+        try:
+            for attempt in range(settings.llm_max_retries + 1):
+                if attempt:
+                    stats.retries += 1
+                    await asyncio.sleep(settings.llm_retry_backoff * 2 ** (attempt - 1))
+                stats.attempts += 1
+                attempt_started = time.monotonic()
+                try:
+                    return await self._attempt(payload, stop_key, stats)
+                except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+                    stats.timeouts += 1
+                    error = e
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code < 500:
+                        raise
+                    error = e
+                except (httpx.TransportError, LLMServerError) as e:
+                    error = e
+                finally:
+                    stats.attempt_latency.observe(time.monotonic() - attempt_started)
+                logger.warning("LLM %s call attempt %d failed: %r", kind, attempt + 1, error)
+            raise error
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latency.observe(time.monotonic() - started)
+
+    async def _generate_response_json(self, url: str, payload: dict) -> dict:
+        data = await self.generate(url, payload)
+        return json.loads(data.get("response", "").strip())
+
+    async def aclose(self) -> None:
+        await self.router.aclose()
+        await self._http.aclose()
+
+
+def get_llm_client() -> LLMClient:
+    """Вернуть общий клиент, создав его при первом обращении."""
+    global _client
+    if _client is None:
+        settings = get_settings()
+        endpoints = max(1, len(settings.llm_api_urls))
+        _client = LLMClient(
+            router=LLMRouter(
+                settings.llm_api_urls,
+                failure_threshold=settings.llm_circuit_failures,
+                cooldown=settings.llm_circuit_cooldown,
+                health_interval=settings.llm_health_interval,
+                health_path=settings.llm_health_path,
+            ),
+            timeout=httpx.Timeout(
+                settings.llm_timeout,
+                connect=settings.llm_connect_timeout,
+                pool=settings.llm_pool_timeout,
+            ),
+            # лимиты соединений заданы на один сервер, пул httpx — общий на все
+            limits=httpx.Limits(
+                max_connections=settings.llm_max_connections * endpoints,
+                max_keepalive_connections=settings.llm_max_keepalive_connections * endpoints,
+                keepalive_expiry=settings.llm_keepalive_expiry,
+            ),
+        )
+    return _client
+
+
+async def close_llm_client() -> None:
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urljoin
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class LLMServerError(httpx.HTTPError):
+    """Сервер LLM прервал ответ кадром {"error": ...} (например, модель не загрузилась или кончилась память)."""
+
+
+class LLMEndpoint:
+    """
+    Один сервер LLM и его автомат размыкания (circuit breaker):
+
+    - closed — запросы идут;
+    - open — после `failure_threshold` ошибок подряд сервер исключается на `cooldown` секунд;
+    - half_open — по истечении паузы пропускается один пробный запрос:
+      успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, url: str, health_url: str | None) -> None:
+        self.url = url
+        self.health_url = health_url
+        self.state = "closed"
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.last_error: str | None = None
+        self.healthy: bool | None = None
+
+    def available(self, now: float) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now >= self.opened_until:
+            self.state = "half_open"
+        # в полуоткрытом состоянии — только один пробный запрос
+        return self.state == "half_open" and self.outstanding == 0
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        if self.state != "closed":
+            logger.info("LLM endpoint %s is back", self.url)
+        self.state = "closed"
+
+    def record_failure(self, error: str, failure_threshold: int, cooldown: float) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.state == "half_open" or self.consecutive_failures >= failure_threshold:
+            if self.state != "open":
+                logger.warning("LLM endpoint %s is open for %.0fs: %s", self.url, cooldown, error)
+            self.state = "open"
+            self.opened_until = time.monotonic() + cooldown
+
+    def as_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+class LLMRouter:
+    """
+    Распределяет запросы между серверами LLM по наименьшему числу незавершённых
+    запросов (при равенстве — случайно), обходя разомкнутые серверы. Если разомкнуты
+    все, запрос идёт на тот, чья пауза кончается раньше: отказ без попытки хуже
+    (при одном сервере это вернуло бы ошибку на каждый отзыв до конца паузы).
+
+    Фоновая проверка здоровья раз в `health_interval` секунд запрашивает `health_path`
+    каждого сервера: недоступный размыкается сразу, ожившему — замыкается, не дожидаясь
+    пробного запроса с реальной нагрузкой.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        failure_threshold: int,
+        cooldown: float,
+        health_interval: float,
+        health_path: str | None,
+    ) -> None:
+        self.endpoints = [
+            LLMEndpoint(url, urljoin(url, health_path) if health_path else None) for url in urls
+        ]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self._health_task: asyncio.Task | None = None
+
+    def acquire(self) -> LLMEndpoint:
+        """Выбрать сервер для запроса; вызывающий обязан вызвать release."""
+        if not self.endpoints:
+            raise httpx.InvalidURL("LLM_API_URL is not configured")
+        self._ensure_health_checks()
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e.available(now)]
+        if not candidates:
+            candidates = [min(self.endpoints, key=lambda e: e.opened_until)]
+        least = min(e.outstanding for e in candidates)
+        endpoint = random.choice([e for e in candidates if e.outstanding == least])
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def release(self, endpoint: LLMEndpoint, error: BaseException | None = None) -> None:
+        """
+        Завершить запрос к серверу. Ошибкой сервера считаются сетевые ошибки, таймауты,
+        ответы 5xx, кадр ошибки в потоке и превышение срока вызова; 4xx и неразборчивый
+        ответ — нет (сервер жив).
+        Отменённый запрос (CancelledError и прочие не-Exception) не завершился и о сервере
+        ничего не говорит: цепь и счётчик ошибок не трогаются.
+        """
+        endpoint.outstanding -= 1
+        if error is not None and not isinstance(error, Exception):
+            return
+        if error is None or not _is_endpoint_failure(error):
+            endpoint.record_success()
+        else:
+            endpoint.record_failure(repr(error), self.failure_threshold, self.cooldown)
+
+    def _ensure_health_checks(self) -> None:
+        if self.health_interval <= 0 or self._health_task is not None:
+            return
+        if not any(e.health_url for e in self.endpoints):
+            return
+        try:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+        except RuntimeError:
+            pass
+
+    async def _health_loop(self) -> None:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(min(5.0, self.health_interval))) as http:
+            while True:
+                try:
+                    await asyncio.gather(*(self._check(http, e) for e in self.endpoints))
+                except Exception:
+                    # неожиданная ошибка одной проверки не должна останавливать их навсегда
+                    logger.exception("LLM health check failed")
+                await asyncio.sleep(self.health_interval)
+
+    async def _check(self, http: httpx.AsyncClient, endpoint: LLMEndpoint) -> None:
+        try:
+            response = await http.get(endpoint.health_url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            endpoint.healthy = False
+            if endpoint.state != "open":
+                logger.warning("LLM endpoint %s failed health check: %r", endpoint.url, e)
+            endpoint.state = "open"
+            endpoint.last_error = repr(e)
+            endpoint.opened_until = time.monotonic() + self.cooldown
+            return
+        endpoint.healthy = True
+        if endpoint.state == "open":
+            endpoint.record_success()
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> list[dict]:
+        return [e.as_dict() for e in self.endpoints]
+
+
+def _is_endpoint_failure(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(
+        error, (httpx.TransportError, httpx.TimeoutException, asyncio.TimeoutError, LLMServerError)
+    )
@@ -0,0 +1,383 @@
+"""
+Миграции схемы поверх create_all.
+
+create_all создаёт только отсутствующие таблицы (вместе с их индексами), поэтому
+изменения уже существующих таблиц описываются здесь: упорядоченный список
+идемпотентных шагов, применённые миграции записываются в schema_migrations.
+
+Шаги выполняются в autocommit, чтобы индексы строились CONCURRENTLY, не блокируя
+запись. Одновременный старт нескольких процессов (API, воркеры) сериализуется
+через pg_advisory_lock.
+"""
+
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import Index, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.schema import AddConstraint, Constraint, CreateIndex
+
+from ..models.db_models import Base
+from ..services.rollups import rebuild_rollups
+from ..services.text_utils import normalize_for_hash, review_hash
+
+logger = logging.getLogger(__name__)
+
+# произвольная константа для pg_advisory_lock
+_MIGRATIONS_LOCK_KEY = 727_001
+
+# строк за один UPDATE при переносе данных: каждая пачка коммитится отдельно
+_DATA_BATCH_ROWS = 50_000
+
+Step = Callable[[AsyncConnection], Awaitable[None]]
+
+
+class Migration:
+    def __init__(self, migration_id: str, description: str, steps: List[Step]) -> None:
+        self.id = migration_id
+        self.description = description
+        self.steps = steps
+
+
+def _model_index(name: str) -> Index:
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"Index {name} is not declared in db_models")
+
+
+def _model_constraint(name: str) -> Constraint:
+    for table in Base.metadata.tables.values():
+        for constraint in table.constraints:
+            if constraint.name == name:
+                return constraint
+    raise KeyError(f"Constraint {name} is not declared in db_models")
+
+
+async def _is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    res = await conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table})
+    return bool(res.scalar())
+
+
+async def _has_column(conn: AsyncConnection, table: str, column: str) -> bool:
+    res = await conn.execute(
+        text(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column
+            )
+            """
+        ),
+        {"table": table, "column": column},
+    )
+    return bool(res.scalar())
+
+
+def create_index(name: str, ddl: Optional[str] = None) -> Step:
+    """
+    Построить индекс из db_models CONCURRENTLY (невалидный остаток прошлой попытки пересоздаётся).
+    Для секционированной таблицы CONCURRENTLY не поддерживается — индекс строится обычным образом.
+    `ddl` фиксирует определение индекса на момент миграции, если в моделях оно позже изменилось.
+    """
+
+    async def step(conn: AsyncConnection) -> None:
+        res = await conn.execute(
+            text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"),
+            {"name": name},
+        )
+        valid = res.scalar()
+        if valid:
+            return
+        index = _model_index(name)
+        concurrently = "" if await _is_partitioned(conn, index.table.name) else "CONCURRENTLY "
+        if valid is False:
+            await conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+        statement = ddl or str(CreateIndex(index).compile(dialect=conn.dialect))
+        await conn.execute(text(statement.replace("CREATE INDEX ", f"CREATE INDEX {concurrently}IF NOT EXISTS ", 1)))
+
+    return step
+
+
+def add_constraint(name: str) -> Step:
+    """Добавить ограничение из db_models, если его ещё нет."""
+
+    async def step(conn: AsyncConnection) -> None:
+        constraint = _model_constraint(name)
+        res = await conn.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = :name AND conrelid = to_regclass(:table))"),
+            {"name": name, "table": constraint.table.name},
+        )
+        if not res.scalar():
+            await conn.execute(text(str(AddConstraint(constraint).compile(dialect=conn.dialect))))
+
+    return step
+
+
+def drop_index(name: str) -> Step:
+    async def step(conn: AsyncConnection) -> None:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    return step
+
+
+def execute(sql: str) -> Step:
+    async def step(conn: AsyncConnection) -> None:
+        await conn.execute(text(sql))
+
+    return step
+
+
+async def _intern_review_themes(conn: AsyncConnection) -> None:
+    """
+    Заменить review_themes.theme (текст) на theme_id из словаря themes.
+    Названия канонизируются так же, как при записи (services/themes.py); темы,
+    совпавшие у одного отзыва после канонизации, схлопываются в одну строку.
+    """
+    if not await _has_column(conn, "review_themes", "theme"):
+        return
+    res = await conn.execute(text("SELECT DISTINCT theme FROM review_themes WHERE theme_id IS NULL"))
+    raw_names = [row[0] for row in res.fetchall()]
+    canonical = {raw: normalize_for_hash(raw) for raw in raw_names}
+    names = sorted({name for name in canonical.values() if name})
+    if names:
+        await conn.execute(
+            text("INSERT INTO themes (name) SELECT unnest(CAST(:names AS text[])) ON CONFLICT (name) DO NOTHING"),
+            {"names": names},
+        )
+    res = await conn.execute(text("SELECT name, id FROM themes WHERE name = ANY(:names)"), {"names": names})
+    ids = dict(res.fetchall())
+
+    await conn.execute(text("CREATE TEMPORARY TABLE IF NOT EXISTS theme_map (raw TEXT PRIMARY KEY, theme_id INTEGER)"))
+    await conn.execute(text("TRUNCATE theme_map"))
+    mapping = [{"raw": raw, "theme_id": ids[name]} for raw, name in canonical.items() if name]
+    if mapping:
+        await conn.execute(text("INSERT INTO theme_map (raw, theme_id) VALUES (:raw, :theme_id)"), mapping)
+    # пустые после канонизации названия нарушили бы NOT NULL
+    await conn.execute(text("DELETE FROM review_themes WHERE theme_id IS NULL AND theme NOT IN (SELECT raw FROM theme_map)"))
+
+    res = await conn.execute(text("SELECT min(id), max(id) FROM review_themes WHERE theme_id IS NULL"))
+    lo, hi = res.fetchone()
+    while lo is not None and lo <= hi:
+        await conn.execute(
+            text(
+                """
+                UPDATE review_themes rt SET theme_id = m.theme_id
+                FROM theme_map m
+                WHERE rt.id >= :lo AND rt.id < :next AND rt.theme_id IS NULL AND m.raw = rt.theme
+                """
+            ),
+            {"lo": lo, "next": lo + _DATA_BATCH_ROWS},
+        )
+        lo += _DATA_BATCH_ROWS
+    await conn.execute(text("DROP TABLE theme_map"))
+
+    await conn.execute(
+        text(
+            """
+            DELETE FROM review_themes a USING review_themes b
+            WHERE a.review_id = b.review_id AND a.theme_id = b.theme_id AND a.id > b.id
+            """
+        )
+    )
+    await conn.execute(text("ALTER TABLE review_themes ALTER COLUMN theme_id SET NOT NULL"))
+    # вместе со столбцом удаляются старые индексы и UNIQUE по theme; новые строятся следующими шагами
+    await conn.execute(text("ALTER TABLE review_themes DROP COLUMN theme"))
+
+
+async def _rekey_theme_rollup(conn: AsyncConnection) -> None:
+    """
+    Перевести theme_daily_rollup на theme_id и пересчитать его из review_themes.
+    Каждый шаг идемпотентен: прерванная миграция продолжается со следующего запуска.
+    """
+    if await _has_column(conn, "theme_daily_rollup", "theme"):
+        await conn.execute(text("DELETE FROM theme_daily_rollup"))
+        await conn.execute(text("ALTER TABLE theme_daily_rollup DROP COLUMN theme"))
+    if not await _has_column(conn, "theme_daily_rollup", "theme_id"):
+        await conn.execute(text("ALTER TABLE theme_daily_rollup ADD COLUMN theme_id INTEGER NOT NULL"))
+    res = await conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass('theme_daily_rollup') AND contype = 'p')")
+    )
+    if not res.scalar():
+        await conn.execute(text("ALTER TABLE theme_daily_rollup ADD PRIMARY KEY (day, theme_id, sentiment)"))
+    res = await conn.execute(text("SELECT EXISTS (SELECT 1 FROM theme_daily_rollup)"))
+    if not res.scalar():
+        await conn.execute(
+            text(
+                """
+                INSERT INTO theme_daily_rollup (day, theme_id, sentiment, review_count)
+                SELECT (date_trunc('day', r.review_created_at))::date, rt.theme_id, rt.sentiment, COUNT(*)
+                FROM review_themes rt
+                JOIN reviews r ON r.id = rt.review_id
+                GROUP BY 1, 2, 3
+                """
+            )
+        )
+
+
+async def _backfill_review_hashes(conn: AsyncConnection) -> None:
+    """Занести в review_hashes уже сохранённые отзывы (пачками по диапазонам id)."""
+    res = await conn.execute(text("SELECT min(id), max(id) FROM reviews"))
+    lo, hi = res.fetchone()
+    while lo is not None and lo <= hi:
+        res = await conn.execute(
+            text("SELECT id, batch_id, raw_text FROM reviews WHERE id >= :lo AND id < :next"),
+            {"lo": lo, "next": lo + _DATA_BATCH_ROWS},
+        )
+        rows = {}
+        for review_id, batch_id, raw_text in res.fetchall():
+            rows.setdefault(review_hash(raw_text), {"review_id": review_id, "batch_id": batch_id})
+        if rows:
+            await conn.execute(
+                text(
+                    """
+                    INSERT INTO review_hashes (hash, review_id, batch_id)
+                    VALUES (:hash, :review_id, :batch_id)
+                    ON CONFLICT (hash) DO NOTHING
+                    """
+                ),
+                [{"hash": h, **row} for h, row in rows.items()],
+            )
+        lo += _DATA_BATCH_ROWS
+
+
+async def _rebuild_rollups(conn: AsyncConnection) -> None:
+    # LOCK TABLE в rebuild_rollups нужна транзакция, а шаги миграций идут в autocommit
+    async with AsyncSession(bind=conn.engine) as session:
+        async with session.begin():
+            await rebuild_rollups(session)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        "0001_dashboard_indexes",
+        "Covering indexes for the dashboard access pattern, drop redundant single-column ones",
+        [
+            create_index("idx_reviews_created_sentiment"),
+            create_index(
+                "idx_review_themes_review_cover",
+                "CREATE INDEX idx_review_themes_review_cover ON review_themes (review_id, sentiment, theme)",
+            ),
+            drop_index("idx_reviews_created_at"),
+            drop_index("idx_reviews_sentiment"),
+            drop_index("idx_review_themes_sentiment"),
+            execute("ANALYZE reviews"),
+            execute("ANALYZE review_themes"),
+        ],
+    ),
+    Migration(
+        "0002_review_themes_created_at",
+        "Copy of reviews.review_created_at on review_themes (partition key, filled on write)",
+        [
+            execute("ALTER TABLE review_themes ADD COLUMN IF NOT EXISTS review_created_at TIMESTAMP WITH TIME ZONE"),
+        ],
+    ),
+    Migration(
+        "0003_review_themes_denormalized",
+        "batch_id on review_themes and indexes for join-free theme metrics and the backfill",
+        [
+            execute("ALTER TABLE review_themes ADD COLUMN IF NOT EXISTS batch_id BIGINT"),
+            create_index(
+                "idx_review_themes_created_cover",
+                "CREATE INDEX idx_review_themes_created_cover ON review_themes (review_created_at, sentiment, theme)",
+            ),
+            create_index("idx_review_themes_backfill"),
+        ],
+    ),
+    Migration(
+        "0004_themes_dictionary",
+        "Replace review_themes.theme and theme_daily_rollup.theme with ids from the themes dictionary",
+        [
+            execute("ALTER TABLE review_themes ADD COLUMN IF NOT EXISTS theme_id INTEGER REFERENCES themes (id)"),
+            _intern_review_themes,
+            _rekey_theme_rollup,
+            add_constraint("uq_review_themes_review_theme"),
+            create_index("idx_review_themes_theme"),
+            create_index("idx_review_themes_review_cover"),
+            create_index("idx_review_themes_created_cover"),
+            # ответы в кэше содержат старые (неканонические) названия тем
+            execute(
+                """
+                INSERT INTO data_generation AS g (id, generation) VALUES (1, 1)
+                ON CONFLICT (id) DO UPDATE SET generation = g.generation + 1, updated_at = now()
+                """
+            ),
+            execute("ANALYZE review_themes"),
+        ],
+    ),
+    Migration(
+        "0005_import_dedup",
+        "Import options on jobs, skipped rows in progress, hash index of stored reviews",
+        [
+            execute("ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS options JSONB"),
+            execute("ALTER TABLE import_progress ADD COLUMN IF NOT EXISTS skipped_rows BIGINT NOT NULL DEFAULT 0"),
+            _backfill_review_hashes,
+        ],
+    ),
+    Migration(
+        "0006_import_skip_reasons",
+        "Per-reason counters of rows dropped before analysis",
+        [
+            execute("ALTER TABLE import_progress ADD COLUMN IF NOT EXISTS skip_reasons JSONB"),
+        ],
+    ),
+    Migration(
+        "0007_import_analysis_tiers",
+        "Per-tier counters of analyzed rows (local model vs LLM)",
+        [
+            execute("ALTER TABLE import_progress ADD COLUMN IF NOT EXISTS analysis_tiers JSONB"),
+        ],
+    ),
+    Migration(
+        "0008_review_analysis_version",
+        "Model and prompt version of each review analysis (for background re-analysis)",
+        [
+            execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS model_name TEXT"),
+            execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS prompt_version TEXT"),
+        ],
+    ),
+    Migration(
+        "0009_import_progress_warnings",
+        "Per-kind counters of stored rows with unparsed fields, failure reason of a batch",
+        [
+            execute("ALTER TABLE import_progress ADD COLUMN IF NOT EXISTS warnings JSONB"),
+            execute("ALTER TABLE import_progress ADD COLUMN IF NOT EXISTS error TEXT"),
+        ],
+    ),
+    Migration(
+        "0010_rollups_utc_days",
+        "Recount daily rollups in UTC days (sessions now pin timezone=UTC)",
+        [_rebuild_rollups],
+    ),
+    Migration(
+        "0011_feedback_report_retention",
+        "Index for deleting expired feedback reports, drop unused analysis_state",
+        [
+            create_index("idx_feedback_reports_created_at"),
+            execute("DROP TABLE IF EXISTS analysis_state"),
+        ],
+    ),
+]
+
+
+async def run_migrations(engine: AsyncEngine) -> None:
+    """Применить ещё не применённые миграции. Вызывается после create_all."""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _MIGRATIONS_LOCK_KEY})
+        try:
+            res = await conn.execute(text("SELECT id FROM schema_migrations"))
+            applied = {row[0] for row in res.fetchall()}
+            for migration in MIGRATIONS:
+                if migration.id in applied:
+                    continue
+                logger.info("Applying migration %s: %s", migration.id, migration.description)
+                for step in migration.steps:
+                    await step(conn)
+                await conn.execute(
+                    text("INSERT INTO schema_migrations (id) VALUES (:id) ON CONFLICT (id) DO NOTHING"),
+                    {"id": migration.id},
+                )
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATIONS_LOCK_KEY})
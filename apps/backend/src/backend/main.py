@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 
 from .config import get_settings
 from .core.logging import setup_logging
@@ -9,8 +10,15 @@ from .api import (
     routes_analyze,
     routes_recommendations,
     routes_dashboard,
+    routes_metrics,
+    routes_reanalysis,
 )
-from .core.db import get_engine, init_db
+from .core.db import get_engine, get_session, init_db
+from .core.llm_client import close_llm_client, get_llm_client
+from .services.analysis import close_review_batcher
+from .services.partitions import ensure_partitions
+from .services.rollups import ensure_rollups_backfilled
+from .services.theme_backfill import backfill_review_themes, refresh_denormalized_state
 
 setup_logging()
 settings = get_settings()
@@ -19,12 +27,26 @@ settings = get_settings()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup
+    backfill_task = None
     database_url = settings.database_url
     if database_url:
         engine = get_engine(database_url)
         await init_db(engine)
+        if settings.reviews_partitioned:
+            await ensure_partitions(engine)
+        # суточные агрегаты для уже загруженных отзывов (один раз, пока таблицы пусты)
+        await ensure_rollups_backfilled(engine)
+        # копии даты/пакета в старых строках review_themes заполняются в фоне
+        if not await refresh_denormalized_state(get_session()):
+            backfill_task = asyncio.create_task(backfill_review_themes(get_session()))
+    # общий пул соединений к LLM живёт столько же, сколько приложение
+    get_llm_client()
     yield
     # shutdown
+    if backfill_task is not None:
+        backfill_task.cancel()
+    await close_review_batcher()
+    await close_llm_client()
     try:
         engine = get_engine(settings.database_url)
         await engine.dispose()
@@ -54,3 +76,5 @@ app.include_router(routes_import.router)
 app.include_router(routes_analyze.router)
 app.include_router(routes_recommendations.router)
 app.include_router(routes_dashboard.router)
+app.include_router(routes_metrics.router)
+app.include_router(routes_reanalysis.router)
@@ -4,6 +4,7 @@ from sqlalchemy import (
     BigInteger,
     Column,
     ForeignKey,
+    ForeignKeyConstraint,
     Index,
     String,
     Text,
@@ -13,13 +14,22 @@ from sqlalchemy import (
     text,
     Integer,
     Boolean,
+    Date,
 )
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base, relationship
 
+from ..config import get_settings
+
 
 Base = declarative_base()
 
+# Секционирование reviews/review_themes по месяцам review_created_at (REVIEWS_PARTITIONED).
+# Применяется, когда таблицы создаются create_all; секции ведёт services/partitions.py.
+# Ключ секционирования обязан входить в PK и UNIQUE, а внешний ключ ссылается на (id, review_created_at).
+REVIEWS_PARTITIONED = get_settings().reviews_partitioned
+_PARTITION_BY = {"postgresql_partition_by": "RANGE (review_created_at)"}
+
 
 class ImportBatch(Base):
     __tablename__ = "import_batches"
@@ -40,15 +50,22 @@ class ImportBatch(Base):
 class Review(Base):
     __tablename__ = "reviews"
 
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     batch_id = Column(BigInteger, ForeignKey("import_batches.id", ondelete="CASCADE"), nullable=False)
     raw_text = Column(Text, nullable=False)
     language_code = Column(String(10), nullable=True)
     overall_sentiment = Column(Text, nullable=True)
-    review_created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    # чем получен анализ: модель (local:<версия> — локальная модель) и версия промпта;
+    # NULL — анализа нет (ошибка LLM) или он записан до появления версий
+    model_name = Column(Text, nullable=True)
+    prompt_version = Column(Text, nullable=True)
+    review_created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"), primary_key=REVIEWS_PARTITIONED
+    )
 
     __table_args__ = (
         CheckConstraint("overall_sentiment IN ('отрицательная','нейтральная','положительная')", name="ck_reviews_overall_sentiment"),
+        *([_PARTITION_BY] if REVIEWS_PARTITIONED else []),
     )
 
     batch = relationship("ImportBatch", back_populates="reviews")
@@ -56,52 +73,353 @@ class Review(Base):
 
 
 # индексы
+# Все метрики фильтруют по диапазону review_created_at и группируют по тональности:
+# покрывающий индекс даёт index-only scan; id нужен для соединения с review_themes.
+# Одиночные индексы по created_at (префикс этого) и по тональности (3 значения) не нужны.
 Index("idx_reviews_batch", Review.batch_id)
-Index("idx_reviews_sentiment", Review.overall_sentiment)
-Index("idx_reviews_created_at", Review.review_created_at)
+Index(
+    "idx_reviews_created_sentiment",
+    Review.review_created_at,
+    Review.overall_sentiment,
+    postgresql_include=["id"],
+)
+
+
+class Theme(Base):
+    """
+    Словарь тем. Название хранится в канонической форме (services/themes.py),
+    в review_themes и суточных агрегатах — только его небольшой целочисленный id.
+    """
+    __tablename__ = "themes"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+    __table_args__ = (
+        UniqueConstraint("name", name="uq_themes_name"),
+    )
 
 
 class ReviewTheme(Base):
     __tablename__ = "review_themes"
 
-    id = Column(BigInteger, primary_key=True)
-    review_id = Column(BigInteger, ForeignKey("reviews.id", ondelete="CASCADE"), nullable=False)
-    theme = Column(Text, nullable=False)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    review_id = Column(
+        BigInteger,
+        *([] if REVIEWS_PARTITIONED else [ForeignKey("reviews.id", ondelete="CASCADE")]),
+        nullable=False,
+    )
+    theme_id = Column(Integer, ForeignKey("themes.id"), nullable=False)
     sentiment = Column(Text, nullable=False)
+    # Копии полей отзыва, пишутся вместе с темой: метрики по темам читают одну таблицу без соединения
+    # с reviews, а по review_created_at секционируется таблица (темы лежат в том же месяце, что и отзыв).
+    # В старых строках NULL до окончания фонового заполнения (services/theme_backfill.py)
+    review_created_at = Column(
+        TIMESTAMP(timezone=True), nullable=not REVIEWS_PARTITIONED, primary_key=REVIEWS_PARTITIONED
+    )
+    batch_id = Column(BigInteger, nullable=True)
 
     # Примечание: в исходной схеме был UNIQUE (analysis_id, theme), но столбец analysis_id не определён.
-    # Логично предположить, что уникальность должна быть гарантирована по (review_id, theme).
+    # Логично предположить, что уникальность должна быть гарантирована по (review_id, theme_id).
     __table_args__ = (
         CheckConstraint("sentiment IN ('отрицательная','нейтральная','положительная')", name="ck_review_themes_sentiment"),
-        UniqueConstraint("review_id", "theme", name="uq_review_themes_review_theme"),
+        *(
+            [
+                UniqueConstraint("review_id", "theme_id", "review_created_at", name="uq_review_themes_review_theme"),
+                ForeignKeyConstraint(
+                    ["review_id", "review_created_at"],
+                    ["reviews.id", "reviews.review_created_at"],
+                    ondelete="CASCADE",
+                ),
+                _PARTITION_BY,
+            ]
+            if REVIEWS_PARTITIONED
+            else [UniqueConstraint("review_id", "theme_id", name="uq_review_themes_review_theme")]
+        ),
     )
 
     review = relationship("Review", back_populates="themes")
 
 
 # индексы
-Index("idx_review_themes_theme", ReviewTheme.theme)
-Index("idx_review_themes_sentiment", ReviewTheme.sentiment)
+Index("idx_review_themes_theme", ReviewTheme.theme_id)
+# Соединение reviews -> review_themes по review_id с чтением тональности и темы без обращения к таблице
+Index("idx_review_themes_review_cover", ReviewTheme.review_id, ReviewTheme.sentiment, ReviewTheme.theme_id)
+# Метрики по темам без соединения: диапазон по дате, тональность и тема из индекса
+Index(
+    "idx_review_themes_created_cover",
+    ReviewTheme.review_created_at,
+    ReviewTheme.sentiment,
+    ReviewTheme.theme_id,
+)
+# Строки, которые ещё предстоит заполнить; после заполнения индекс пуст
+Index("idx_review_themes_backfill", ReviewTheme.id, postgresql_where=ReviewTheme.batch_id.is_(None))
 
 
-# Новая таблица для глобального состояния анализа (singleton)
-class AnalysisState(Base):
+class AnalysisCacheEntry(Base):
     """
-    Таблица-одиночка для хранения флага того, был ли уже произведён глобальный анализ,
-    и текстового результата последнего анализа.
+    Кэш результатов LLM-анализа отзывов.
 
-    В таблице допускается только одна запись — с id = 1. Это принудительно задаётся
-    CHECK-констрейнтом (id = 1). Приложение должно обновлять/вставлять именно эту запись.
+    Ключ — sha256 от (нормализованный текст, модель, версия промпта), поэтому
+    смена модели или промпта автоматически даёт новые ключи.
     """
-    __tablename__ = "analysis_state"
+    __tablename__ = "analysis_cache"
 
-    id = Column(Integer, primary_key=True, server_default=text("1"))
-    is_analyzed = Column(Boolean, nullable=False, server_default=text("false"))
-    result_text = Column(Text, nullable=True)
+    key = Column(String(64), primary_key=True)
+    model_name = Column(Text, nullable=False)
+    prompt_version = Column(Text, nullable=False)
+    result = Column(JSONB, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class ImportJob(Base):
+    """
+    Задание на обработку одного пакета импорта в очереди на Postgres.
+
+    Жизненный цикл: pending -> splitting (файл режется на чанки) -> ready -> done/failed.
+    Воркеры захватывают задания и чанки через SELECT ... FOR UPDATE SKIP LOCKED,
+    а locked_until служит арендой: после падения воркера запись снова становится доступной.
+    """
+    __tablename__ = "import_jobs"
+
+    id = Column(BigInteger, primary_key=True)
+    batch_id = Column(BigInteger, ForeignKey("import_batches.id", ondelete="CASCADE"), nullable=False)
+    status = Column(Text, nullable=False, server_default=text("'pending'"))
+    source_path = Column(Text, nullable=True)
+    delimiter = Column(String(8), nullable=False, server_default=text("','"))
+    encoding = Column(String(32), nullable=False, server_default=text("'utf-8'"))
+    chunk_size = Column(Integer, nullable=False)
+    # параметры обработки из формы импорта (delete_dublicates и т.п.)
+    options = Column(JSONB, nullable=True)
+    total_chunks = Column(Integer, nullable=True)
+    worker_id = Column(Text, nullable=True)
+    locked_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+    __table_args__ = (
+        CheckConstraint("status IN ('pending','splitting','ready','done','failed')", name="ck_import_jobs_status"),
+        UniqueConstraint("batch_id", name="uq_import_jobs_batch"),
+    )
+
+
+class ImportJobChunk(Base):
+    """Чанк строк задания импорта; обрабатывается и фиксируется одной транзакцией."""
+    __tablename__ = "import_job_chunks"
+
+    id = Column(BigInteger, primary_key=True)
+    job_id = Column(BigInteger, ForeignKey("import_jobs.id", ondelete="CASCADE"), nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    texts = Column(JSONB, nullable=True)
+    status = Column(Text, nullable=False, server_default=text("'pending'"))
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    worker_id = Column(Text, nullable=True)
+    locked_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
 
     __table_args__ = (
-        CheckConstraint("id = 1", name="ck_analysis_state_single_row"),
+        CheckConstraint("status IN ('pending','running','done','failed')", name="ck_import_job_chunks_status"),
+        UniqueConstraint("job_id", "chunk_index", name="uq_import_job_chunks_job_index"),
     )
 
 
-__all__ = ["Base", "ImportBatch", "Review", "ReviewTheme", "AnalysisState"]
+class ReanalysisJob(Base):
+    """
+    Фоновый повторный анализ отзывов, проанализированных другой моделью или версией промпта.
+
+    Жизненный цикл: pending -> running -> done/failed/cancelled. Новые результаты копятся
+    в reanalysis_results (курсор — последний просмотренный id отзыва), а в reviews/review_themes
+    переносятся одной транзакцией в конце (services/reanalysis.py).
+    """
+    __tablename__ = "reanalysis_jobs"
+
+    id = Column(BigInteger, primary_key=True)
+    status = Column(Text, nullable=False, server_default=text("'pending'"))
+    # целевые версии: актуальными считаются результаты этой модели (или локальной модели) и промпта
+    model_name = Column(Text, nullable=False)
+    local_model_name = Column(Text, nullable=True)
+    prompt_version = Column(Text, nullable=False)
+    cursor_review_id = Column(BigInteger, nullable=False, server_default=text("0"))
+    staged_rows = Column(BigInteger, nullable=False, server_default=text("0"))
+    failed_rows = Column(BigInteger, nullable=False, server_default=text("0"))
+    applied_rows = Column(BigInteger, nullable=True)
+    worker_id = Column(Text, nullable=True)
+    locked_until = Column(TIMESTAMP(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('pending','running','done','failed','cancelled')", name="ck_reanalysis_jobs_status"
+        ),
+    )
+
+
+class ReanalysisResult(Base):
+    """Новый результат анализа отзыва, ожидающий переноса в reviews/review_themes."""
+    __tablename__ = "reanalysis_results"
+
+    job_id = Column(BigInteger, ForeignKey("reanalysis_jobs.id", ondelete="CASCADE"), primary_key=True)
+    review_id = Column(BigInteger, primary_key=True)
+    overall_sentiment = Column(Text, nullable=False)
+    # [{"theme_id": 3, "sentiment": "положительная"}, ...]
+    themes = Column(JSONB, nullable=False)
+    model_name = Column(Text, nullable=False)
+
+
+class ImportProgress(Base):
+    """
+    Прогресс обработки пакета импорта. Хранится в БД, поэтому его видят
+    все процессы API и воркеры. total_rows может быть оценкой, пока файл не прочитан целиком.
+    """
+    __tablename__ = "import_progress"
+
+    batch_id = Column(BigInteger, ForeignKey("import_batches.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(Text, nullable=False, server_default=text("'queued'"))
+    total_rows = Column(BigInteger, nullable=True)
+    total_is_estimate = Column(Boolean, nullable=False, server_default=text("false"))
+    processed_rows = Column(BigInteger, nullable=False, server_default=text("0"))
+    failed_rows = Column(BigInteger, nullable=False, server_default=text("0"))
+    # строки, отброшенные до анализа (дубликаты, мусор)
+    skipped_rows = Column(BigInteger, nullable=False, server_default=text("0"))
+    # те же строки по причинам: {"duplicate": 3, "no_letters": 5, ...}
+    skip_reasons = Column(JSONB, nullable=True)
+    # проанализированные строки по уровням анализа: {"local": 120, "llm": 30}
+    analysis_tiers = Column(JSONB, nullable=True)
+    # сохранённые, но неполно разобранные строки: {"unparsed_date": 7}
+    warnings = Column(JSONB, nullable=True)
+    # причина статуса failed (например, файл не разбирается)
+    error = Column(Text, nullable=True)
+    started_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("status IN ('queued','running','done','failed')", name="ck_import_progress_status"),
+    )
+
+
+class ReviewDailyRollup(Base):
+    """
+    Суточный агрегат отзывов по тональности. Поддерживается инкрементально
+    в той же транзакции, что и запись отзывов (services/rollups.py).
+    """
+    __tablename__ = "review_daily_rollup"
+
+    day = Column(Date, primary_key=True)
+    total_count = Column(BigInteger, nullable=False, server_default=text("0"))
+    positive_count = Column(BigInteger, nullable=False, server_default=text("0"))
+    neutral_count = Column(BigInteger, nullable=False, server_default=text("0"))
+    negative_count = Column(BigInteger, nullable=False, server_default=text("0"))
+
+
+class ThemeDailyRollup(Base):
+    """Суточный агрегат упоминаний тем по (id темы, тональность темы)."""
+    __tablename__ = "theme_daily_rollup"
+
+    day = Column(Date, primary_key=True)
+    theme_id = Column(Integer, primary_key=True)
+    sentiment = Column(Text, primary_key=True)
+    review_count = Column(BigInteger, nullable=False, server_default=text("0"))
+
+
+class DataGeneration(Base):
+    """Счётчик поколений данных: увеличивается при каждом коммите отзывов, сбрасывает кэш ответов."""
+    __tablename__ = "data_generation"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(BigInteger, nullable=False, server_default=text("0"))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class SchemaMigration(Base):
+    """Применённые миграции схемы (core/migrations.py)."""
+    __tablename__ = "schema_migrations"
+
+    id = Column(Text, primary_key=True)
+    applied_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class ResponseCacheEntry(Base):
+    """Общий (для всех процессов API) уровень кэша ответов дашборда. UNLOGGED: потеря при сбое не страшна."""
+    __tablename__ = "response_cache"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    key = Column(Text, primary_key=True)
+    generation = Column(BigInteger, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+
+class ReviewHash(Base):
+    """
+    Индекс уже сохранённых текстов отзывов для поиска дубликатов при импорте.
+    hash — sha256 нормализованного текста (services/dedup.py), пишется вместе с отзывом.
+    """
+    __tablename__ = "review_hashes"
+
+    hash = Column(String(64), primary_key=True)
+    review_id = Column(BigInteger, nullable=False)
+    batch_id = Column(BigInteger, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class FeedbackReport(Base):
+    """
+    Сохранённый LLM-отчёт по отзывам за окно. Ключ — (окно, поколение данных, модель, версия промпта);
+    inputs_hash — хэш входа LLM, чтобы переиспользовать ответ для окон с теми же данными.
+    """
+    __tablename__ = "feedback_reports"
+
+    id = Column(BigInteger, primary_key=True)
+    window_start = Column(TIMESTAMP(timezone=True), nullable=False)
+    window_end = Column(TIMESTAMP(timezone=True), nullable=False)
+    generation = Column(BigInteger, nullable=False)
+    model_name = Column(Text, nullable=False)
+    prompt_version = Column(Text, nullable=False)
+    inputs_hash = Column(Text, nullable=False)
+    result = Column(JSONB, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+    __table_args__ = (
+        UniqueConstraint(
+            "window_start", "window_end", "generation", "model_name", "prompt_version",
+            name="uq_feedback_reports_window",
+        ),
+    )
+
+
+# индексы
+Index("idx_import_jobs_status", ImportJob.status)
+Index("idx_import_progress_status", ImportProgress.status)
+Index("idx_feedback_reports_inputs", FeedbackReport.inputs_hash, FeedbackReport.model_name, FeedbackReport.prompt_version)
+Index("idx_feedback_reports_created_at", FeedbackReport.created_at)
+Index("idx_response_cache_expires_at", ResponseCacheEntry.expires_at)
+Index("idx_import_job_chunks_status", ImportJobChunk.status, ImportJobChunk.job_id, ImportJobChunk.chunk_index)
+
+
+__all__ = [
+    "Base",
+    "ImportBatch",
+    "Review",
+    "Theme",
+    "ReviewTheme",
+    "AnalysisCacheEntry",
+    "ImportJob",
+    "ImportJobChunk",
+    "ImportProgress",
+    "ReanalysisJob",
+    "ReanalysisResult",
+    "ReviewDailyRollup",
+    "ThemeDailyRollup",
+    "DataGeneration",
+    "ResponseCacheEntry",
+    "FeedbackReport",
+    "ReviewHash",
+    "SchemaMigration",
+]
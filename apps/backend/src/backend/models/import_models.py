@@ -1,4 +1,5 @@
-from typing import Literal, Optional, Dict, Any
+from datetime import datetime
+from typing import Literal, Optional, Dict, Any, List
 
 from pydantic import BaseModel, HttpUrl
 
@@ -15,10 +16,32 @@ class ImportRequest(BaseModel):
 
 class ImportResponse(BaseModel):
     status: str
-    imported_count: int
+    # файл разбирается в фоне, поэтому число строк при ответе неизвестно (None);
+    # ход импорта — GET /api/reviews/import/{batch_id}/progress
+    imported_count: Optional[int] = None
     batch_id: str
 
 
-
-
-
+class BatchProgress(BaseModel):
+    batch_id: int
+    status: str
+    total_rows: Optional[int] = None
+    total_is_estimate: bool = False
+    processed_rows: int = 0
+    failed_rows: int = 0
+    skipped_rows: int = 0
+    skip_reasons: Dict[str, int] = {}
+    analysis_tiers: Dict[str, int] = {}
+    warnings: Dict[str, int] = {}
+    error: Optional[str] = None
+    percent: Optional[float] = None
+    rows_per_second: float = 0.0
+    eta_seconds: Optional[float] = None
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class AnalysisProgressResponse(BaseModel):
+    is_analyzing: bool
+    batches: List[BatchProgress]
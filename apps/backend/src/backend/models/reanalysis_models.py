@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class ReanalysisJobStatus(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    id: int
+    status: str
+    model_name: str
+    local_model_name: Optional[str] = None
+    prompt_version: str
+    cursor_review_id: int = 0
+    staged_rows: int = 0
+    failed_rows: int = 0
+    applied_rows: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class ReanalysisStartResponse(BaseModel):
+    created: bool
+    stale_reviews: int
+    job: ReanalysisJobStatus
@@ -1,10 +1,18 @@
 import asyncio
-from typing import List, Dict
+import contextlib
+from typing import List, Dict, Optional
+import hashlib
+import logging
 import random
-import requests
 import json
+
+import httpx
+
 from ..config import get_settings
+from ..core.adaptive_limit import AdaptiveLimiter
+from ..core.llm_client import get_llm_client
 
+logger = logging.getLogger(__name__)
 
 def fake_sentiment() -> str:
     return random.choice(["positive", "neutral", "negative"])
@@ -28,67 +36,159 @@ def analyze_reviews_stub(review_ids: List[int]) -> List[Dict]:
     return result
 
 
-def _analyze_review_sync(review_text: str) -> dict:
-    """
-    Отправляет отзыв на анализ и возвращает JSON-объект результата.
-    """
-    url = get_settings().llm_api_url
-    model = get_settings().llm_model_name
-    payload = {
-        "model": model,
+# Фиксированный список тем, которым ограничена модель (он же — классы локальной модели)
+REVIEW_THEMES = (
+    "Качество товара",
+    "функциональность",
+    "дизайн",
+    "материалы",
+    "сборка",
+    "соответствие описанию",
+    "комплектация",
+    "размеры",
+    "простота использования",
+    "работа персонала",
+    "квалификация сотрудников",
+    "вежливость",
+    "скорость обслуживания",
+    "готовность помочь",
+    "скорость доставки",
+    "стоимость доставки",
+    "аккуратность доставки",
+    "работа курьера",
+    "сроки доставки",
+    "соотношение цена-качество",
+    "цены",
+    "скидки",
+    "общая стоимость",
+    "упаковка",
+    "гарантия",
+    "возврат",
+    "удобство сайта",
+    "функциональность сайта",
+    "скорость сайта",
+    "дизайн интерфейса",
+    "работа call-центра",
+    "онлайн-консультант",
+    "ответы на вопросы",
+    "время ответа",
+    "общая удовлетворенность",
+    "рекомендация другим",
+    "повторная покупка",
+    "соответствие ожиданиям",
+)
+
+REVIEW_ANALYSIS_SYSTEM_PROMPT = (
+    "Ты - профессиональный аналитик отзывов со стажем 10 лет. "
+    "Тебе будет отправлен текст отзыва. Вот твои задачи: "
+    "- выделить ключевые темы отзыва "
+    "- определить тональность отзыва (нейтральная, положительная, отрицательная) "
+    "- для каждой темы отзыва определить тональность темы (нейтральная, положительная, отрицательная). "
+    "Отвечай только корректным JSON. Без текста до или после. Без комментариев."
+    "Вот пример ответа для отзыва: \"Доставка была быстрой, но качество товара оставляет желать лучшего. Упаковка хорошая.\" "
+    "{\"review_analysis\":{\"overall_sentiment\":\"нейтральная\",\"key_themes\":[{\"theme\":\"доставка\",\"sentiment\":\"положительная\"},{\"theme\":\"качество товара\",\"sentiment\":\"отрицательная\"},{\"theme\":\"упаковка\",\"sentiment\":\"положительная\"}]}} "
+    "При выборе тем используй ТОЛЬКО следующие формулировки. "
+    "Должно использоваться что-то СТРОГО из этих критериев: "
+    "(" + ", ".join(REVIEW_THEMES) + ")"
+)
+
+# Версия промпта анализа — меняется автоматически при любой правке текста промпта
+REVIEW_ANALYSIS_PROMPT_VERSION = hashlib.sha256(REVIEW_ANALYSIS_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Дополнение к системному промпту для пакетного режима: несколько отзывов в одном запросе
+REVIEW_BATCH_INSTRUCTIONS = (
+    " Тебе будет отправлен JSON-массив отзывов вида [{\"id\":1,\"text\":\"...\"}, ...]. "
+    "Проанализируй КАЖДЫЙ отзыв отдельно по правилам выше и верни JSON-объект вида "
+    "{\"reviews\":[{\"id\":1,\"review_analysis\":{...}}, ...]} — ровно по одному элементу "
+    "на каждый отзыв, с тем же id, в том же порядке."
+)
+
+
+FEEDBACK_RECOMMENDATIONS_SYSTEM_PROMPT = (
+    "Ты - ИИ-аналитик в системе автоматизированной обработки отзывов. "
+    "Ты - ФИНАЛЬНОЕ звено в автоматизированной цепочке анализа. Твои выводы сразу идут руководству на исполнение."
+    "Твоя задача - проанализировать данные и вернуть ОТВЕТ ТОЛЬКО В ФОРМАТЕ JSON.\n\n"
+
+    "СТРУКТУРА ОТВЕТА:\n"
+    "{\n"
+    "  \"feedback_analysis\": [\n"
+    "    {\n"
+    "      \"prio\": \"высокий/средний/низкий\",\n"
+    "      \"problem\": \"название проблемы\",\n"
+    "      \"proposal_text\": \"конкретное предложение по улучшению\"\n"
+    "    }\n"
+    "  ],\n"
+    "  \"overall_proposals\": [\n"
+    "    \"инсайт 1\",\n"
+    "    \"инсайт 2\"\n"
+    "  ]\n"
+    "}\n\n"
+
+    "ПРАВИЛА:\n"
+    "1. ВСЕГДА включай оба поля: feedback_analysis И overall_proposals\n"
+    "2. overall_proposals должен содержать 3-5 стратегических предложений\n"
+    "3. Используй только русский язык\n"
+    "4. Никакого текста до или после JSON\n"
+    "5. Определяй приоритет (prio) на основе частоты упоминаний и серьезности проблемы\n"
+    "6. Формулируй предложения (proposal_text) конкретно и применимо к выявленным проблемам\n"
+    "7. НИКОГДА не предлагай проводить анализ отзывов - ты уже получил все необходимые данные\n"
+)
+
+FEEDBACK_RECOMMENDATIONS_PROMPT_VERSION = hashlib.sha256(
+    FEEDBACK_RECOMMENDATIONS_SYSTEM_PROMPT.encode("utf-8")
+).hexdigest()[:12]
+
+
+def _build_review_payload(review_text: str) -> dict:
+    return {
+        "model": get_settings().llm_model_name,
         "prompt": review_text,
         "context": [],
         "stream": False,
         "format": "json",
-        "system": (
-            "Ты - профессиональный аналитик отзывов со стажем 10 лет. "
-            "Тебе будет отправлен текст отзыва. Вот твои задачи: "
-            "- выделить ключевые темы отзыва "
-            "- определить тональность отзыва (нейтральная, положительная, отрицательная) "
-            "- для каждой темы отзыва определить тональность темы (нейтральная, положительная, отрицательная). "
-            "Отвечай только корректным JSON. Без текста до или после. Без комментариев."
-            "Вот пример ответа для отзыва: \"Доставка была быстрой, но качество товара оставляет желать лучшего. Упаковка хорошая.\" "
-            "{\"review_analysis\":{\"overall_sentiment\":\"нейтральная\",\"key_themes\":[{\"theme\":\"доставка\",\"sentiment\":\"положительная\"},{\"theme\":\"качество товара\",\"sentiment\":\"отрицательная\"},{\"theme\":\"упаковка\",\"sentiment\":\"положительная\"}]}} "
-            "При выборе тем используй ТОЛЬКО следующие формулировки. "
-            "Должно использоваться что-то СТРОГО из этих критериев: "
-            "(Качество товара, функциональность, дизайн, материалы, сборка, соответствие описанию, комплектация, размеры, простота использования, "
-            "работа персонала, квалификация сотрудников, вежливость, скорость обслуживания, готовность помочь, скорость доставки, стоимость доставки, "
-            "аккуратность доставки, работа курьера, сроки доставки, соотношение цена-качество, цены, скидки, общая стоимость, упаковка, гарантия, "
-            "возврат, удобство сайта, функциональность сайта, скорость сайта, дизайн интерфейса, работа call-центра, онлайн-консультант, ответы на вопросы, "
-            "время ответа, общая удовлетворенность, рекомендация другим, повторная покупка, соответствие ожиданиям)"
-        )
+        "system": REVIEW_ANALYSIS_SYSTEM_PROMPT,
     }
 
-    headers = {"Content-Type": "application/json"}
-
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        data = response.json()
-
-        print(data)
-
-        # Извлекаем и очищаем JSON из "response"
-        raw_json_str = data.get("response", "").strip()
-        cleaned_json = json.loads(raw_json_str)
-
-        return cleaned_json
-
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Ошибка запроса: {e}")
-    except json.JSONDecodeError:
-        print("❌ Не удалось распарсить JSON из поля 'response'.")
 
-    return {}
+def _build_review_batch_payload(review_texts: List[str]) -> dict:
+    reviews = [{"id": i, "text": text} for i, text in enumerate(review_texts, start=1)]
+    return {
+        "model": get_settings().llm_model_name,
+        "prompt": json.dumps(reviews, ensure_ascii=False),
+        "context": [],
+        "stream": False,
+        "format": "json",
+        "system": REVIEW_ANALYSIS_SYSTEM_PROMPT + REVIEW_BATCH_INSTRUCTIONS,
+    }
 
 
-def _generate_feedback_recommendations_sync(total_reviews: int, topics_dict: dict) -> dict:
+def _split_batch_response(data, expected: int) -> List[Optional[dict]]:
     """
-    Отправляет статистику негативных аспектов в LLM и получает рекомендации.
-    Возвращает JSON-ответ (словарь).
+    Раскладывает ответ пакетного запроса по отзывам.
+    Для отзывов, чей результат не удалось разобрать, возвращается None.
     """
-    url = get_settings().llm_api_url
-    model = get_settings().llm_model_name
+    results: List[Optional[dict]] = [None] * expected
+    items = data.get("reviews") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return results
+
+    for pos, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("review_analysis"), dict):
+            continue
+        idx = item.get("id")
+        if isinstance(idx, int) and 1 <= idx <= expected:
+            idx -= 1
+        elif len(items) == expected:
+            # id потерян, но количество совпадает — доверяем порядку
+            idx = pos
+        else:
+            continue
+        if results[idx] is None:
+            results[idx] = {"review_analysis": item["review_analysis"]}
+    return results
+
+
+def _build_feedback_recommendations_payload(total_reviews: int, topics_dict: dict) -> dict:
     # Формируем текст для prompt
     # Пример: "Количество отзывов 1247, темы с количеством упоминаний в скобках: Скорость доставки (234 упоминания) ..."
     topics_str = " ".join(
@@ -98,40 +198,12 @@ def _generate_feedback_recommendations_sync(total_reviews: int, topics_dict: dic
 
     print(prompt_text)
 
-    payload = {
-        "model": model,
+    return {
+        "model": get_settings().llm_model_name,
         "prompt": prompt_text,
         "stream": False,
         "format": "json",
-        "system": (
-            "Ты - ИИ-аналитик в системе автоматизированной обработки отзывов. "
-            "Ты - ФИНАЛЬНОЕ звено в автоматизированной цепочке анализа. Твои выводы сразу идут руководству на исполнение."
-            "Твоя задача - проанализировать данные и вернуть ОТВЕТ ТОЛЬКО В ФОРМАТЕ JSON.\n\n"
-
-            "СТРУКТУРА ОТВЕТА:\n"
-            "{\n"
-            "  \"feedback_analysis\": [\n"
-            "    {\n"
-            "      \"prio\": \"высокий/средний/низкий\",\n"
-            "      \"problem\": \"название проблемы\",\n"
-            "      \"proposal_text\": \"конкретное предложение по улучшению\"\n"
-            "    }\n"
-            "  ],\n"
-            "  \"overall_proposals\": [\n"
-            "    \"инсайт 1\",\n"
-            "    \"инсайт 2\"\n"
-            "  ]\n"
-            "}\n\n"
-
-            "ПРАВИЛА:\n"
-            "1. ВСЕГДА включай оба поля: feedback_analysis И overall_proposals\n"
-            "2. overall_proposals должен содержать 3-5 стратегических предложений\n"
-            "3. Используй только русский язык\n"
-            "4. Никакого текста до или после JSON\n"
-            "5. Определяй приоритет (prio) на основе частоты упоминаний и серьезности проблемы\n"
-            "6. Формулируй предложения (proposal_text) конкретно и применимо к выявленным проблемам\n"
-            "7. НИКОГДА не предлагай проводить анализ отзывов - ты уже получил все необходимые данные\n"
-        ),
+        "system": FEEDBACK_RECOMMENDATIONS_SYSTEM_PROMPT,
         "options": {
             "temperature": 0.7,
             "num_predict": 1200,
@@ -140,45 +212,195 @@ def _generate_feedback_recommendations_sync(total_reviews: int, topics_dict: dic
             "repeat_penalty": 1.1
         }
     }
-    headers = {"Content-Type": "application/json"}
 
-    print(payload)
 
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        data = response.json()
+_limiter: Optional[AdaptiveLimiter] = None
+
 
-        print(data)
+def get_analysis_limiter() -> Optional[AdaptiveLimiter]:
+    """
+    Общий для процесса адаптивный ограничитель запросов анализа отзывов
+    (None при LLM_ADAPTIVE_CONCURRENCY=false). Начальный лимит — LLM_CONCURRENCY
+    на каждый сервер пула, верхний — LLM_LIMIT_MAX (по умолчанию вчетверо больше).
+    """
+    global _limiter
+    settings = get_settings()
+    if _limiter is None and settings.llm_adaptive_concurrency:
+        initial = settings.llm_concurrency * max(1, len(settings.llm_api_urls))
+        _limiter = AdaptiveLimiter(
+            initial=initial,
+            min_limit=settings.llm_limit_min,
+            max_limit=settings.llm_limit_max or initial * 4,
+            backoff=settings.llm_limit_backoff,
+            tolerance=settings.llm_limit_latency_tolerance,
+        )
+    return _limiter
 
-        # Извлекаем JSON из поля "response"
-        raw_json_str = data.get("response", "").strip()
-        cleaned_json = json.loads(raw_json_str)
 
-        return cleaned_json
+async def _generate_json(
+    payload: dict,
+    kind: str,
+    stop_key: Optional[str] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+) -> dict:
+    """
+    Отправляет payload в LLM через общий пул соединений
+    и возвращает JSON, извлечённый из поля "response". При ошибке — пустой словарь.
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Ошибка запроса: {e}")
-    except json.JSONDecodeError:
-        print("❌ Не удалось распарсить JSON из поля 'response'.")
+    Срок на попытку, повторы и потоковый режим — в LLMClient.complete_json;
+    `kind` — имя гистограммы задержек, `stop_key` — ключ, после которого ответ можно не дочитывать.
+    С `limiter` вызов ждёт свободного места, а его задержка и исход подстраивают лимит.
+    """
+    async with (limiter.slot() if limiter is not None else contextlib.nullcontext({})) as outcome:
+        try:
+            result = await get_llm_client().complete_json(payload, kind, stop_key)
+            outcome["ok"] = True
+            return result
+
+        except asyncio.TimeoutError:
+            print(f"❌ LLM не ответила за {get_settings().llm_call_deadline} с")
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            print(f"❌ Ошибка запроса: {e!r}")
+        except json.JSONDecodeError:
+            # сервер ответил — для ограничителя это не перегрузка
+            outcome["ok"] = True
+            print("❌ Не удалось распарсить JSON из поля 'response'.")
 
     return {}
 
 
+async def _analyze_review_single(review_text: str) -> dict:
+    return await _generate_json(
+        _build_review_payload(review_text), "review", stop_key="review_analysis", limiter=get_analysis_limiter()
+    )
+
+
+async def analyze_reviews_batch(review_texts: List[str]) -> List[dict]:
+    """
+    Анализирует несколько отзывов одним запросом к LLM, чтобы системный промпт
+    обрабатывался один раз на пакет, а не на каждый отзыв.
+
+    Если модель вернула неразборчивый ответ (или пропустила часть отзывов),
+    недостающие результаты запрашиваются по одному.
+    """
+    if not review_texts:
+        return []
+    if len(review_texts) == 1:
+        return [await _analyze_review_single(review_texts[0])]
+
+    data = await _generate_json(
+        _build_review_batch_payload(review_texts), "review_batch", limiter=get_analysis_limiter()
+    )
+    results = _split_batch_response(data, len(review_texts))
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        logger.warning("Batch response incomplete (%d/%d missing), retrying one by one", len(missing), len(review_texts))
+        fallback = await asyncio.gather(*(_analyze_review_single(review_texts[i]) for i in missing))
+        for i, r in zip(missing, fallback):
+            results[i] = r
+    return results
+
+
+class _ReviewBatcher:
+    """
+    Собирает одиночные вызовы analyze_review в пакеты по `batch_size` отзывов.
+    Неполный пакет отправляется через `max_wait` секунд после первого отзыва в нём.
+    """
+
+    def __init__(self, batch_size: int, max_wait: float) -> None:
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # ссылки на запущенные пакеты: задачу без ссылки сборщик мусора может удалить на лету
+        self._tasks: set = set()
+
+    async def aclose(self) -> None:
+        """Отменить ожидающие и выполняющиеся пакеты (остановка процесса)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        for _, future in items:
+            future.cancel()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, review_text: str) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((review_text, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        if items:
+            task = asyncio.create_task(self._run(items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(items: list) -> None:
+        try:
+            results = await analyze_reviews_batch([text for text, _ in items])
+        except asyncio.CancelledError:
+            for _, future in items:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+
+_batcher: Optional[_ReviewBatcher] = None
+
+
+def _get_batcher(batch_size: int, max_wait: float) -> _ReviewBatcher:
+    global _batcher
+    if _batcher is None or _batcher.batch_size != batch_size:
+        _batcher = _ReviewBatcher(batch_size, max_wait)
+    return _batcher
+
+
+async def close_review_batcher() -> None:
+    global _batcher
+    if _batcher is not None:
+        batcher, _batcher = _batcher, None
+        await batcher.aclose()
+
+
 async def analyze_review(review_text: str) -> dict:
     """
-    Асинхронная обёртка над синхронным LLM-вызовом.
-    Сама функция не блокирует event loop.
+    Отправляет отзыв на анализ и возвращает JSON-объект результата.
+    Вызов полностью асинхронный: не занимает поток и переиспользует keep-alive соединения.
+
+    При LLM_BATCH_SIZE > 1 одновременные вызовы объединяются в пакетные запросы.
     """
-    return await asyncio.to_thread(_analyze_review_sync, review_text)
+    settings = get_settings()
+    if settings.llm_batch_size > 1:
+        return await _get_batcher(settings.llm_batch_size, settings.llm_batch_max_wait).submit(review_text)
+    return await _analyze_review_single(review_text)
 
 
 async def generate_feedback_recommendations(total_reviews: int, topics_dict: dict) -> dict:
     """
-    Асинхронная обёртка над синхронным LLM-вызовом.
+    Отправляет статистику негативных аспектов в LLM и получает рекомендации.
+    Возвращает JSON-ответ (словарь).
     """
-    return await asyncio.to_thread(
-        _generate_feedback_recommendations_sync,
-        total_reviews,
-        topics_dict,
+    return await _generate_json(
+        _build_feedback_recommendations_payload(total_reviews, topics_dict), "recommendations"
     )
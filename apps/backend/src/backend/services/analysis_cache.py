@@ -0,0 +1,142 @@
+"""
+Кэш результатов LLM-анализа отзывов.
+
+Двухуровневый: ограниченный in-memory LRU перед таблицей analysis_cache в Postgres.
+Ключ — хэш (нормализованный текст, модель, версия промпта).
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert
+
+from ..config import get_settings
+from ..core.db import get_session
+from ..models.db_models import AnalysisCacheEntry
+from .analysis import REVIEW_ANALYSIS_PROMPT_VERSION, analyze_review
+from .text_utils import normalize_for_hash, text_hash
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        # суммарное время LLM-вызовов на промахах — для оценки сэкономленного времени
+        self.llm_seconds = 0.0
+
+    def make_key(self, review_text: str, model_name: str, prompt_version: str) -> str:
+        return text_hash(normalize_for_hash(review_text), model_name, prompt_version)
+
+    def _remember(self, key: str, result: dict) -> None:
+        if self.max_size <= 0:
+            return
+        self._lru[key] = result
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        result = self._lru.get(key)
+        if result is not None:
+            self._lru.move_to_end(key)
+            self.memory_hits += 1
+            return result
+
+        try:
+            async with get_session()() as session:
+                entry = await session.get(AnalysisCacheEntry, key)
+        except RuntimeError:
+            # БД не инициализирована — работаем только с памятью
+            entry = None
+        except Exception as e:
+            logger.warning("Analysis cache lookup failed: %s", e)
+            entry = None
+
+        if entry is not None:
+            self.db_hits += 1
+            self._remember(key, entry.result)
+            return entry.result
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: dict, model_name: str, prompt_version: str) -> None:
+        self._remember(key, result)
+        self.stores += 1
+        try:
+            async with get_session()() as session:
+                await session.execute(
+                    insert(AnalysisCacheEntry)
+                    .values(key=key, model_name=model_name, prompt_version=prompt_version, result=result)
+                    .on_conflict_do_nothing(index_elements=["key"])
+                )
+                await session.commit()
+        except RuntimeError:
+            pass
+        except Exception as e:
+            logger.warning("Analysis cache store failed: %s", e)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        avg_llm_seconds = self.llm_seconds / self.misses if self.misses else 0.0
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._lru),
+            "max_size": self.max_size,
+            "llm_seconds": round(self.llm_seconds, 3),
+            "avg_llm_seconds_per_miss": round(avg_llm_seconds, 3),
+            "estimated_llm_seconds_saved": round(hits * avg_llm_seconds, 3),
+        }
+
+
+_cache: Optional[AnalysisCache] = None
+
+
+def get_analysis_cache() -> AnalysisCache:
+    global _cache
+    if _cache is None:
+        _cache = AnalysisCache(max_size=get_settings().analysis_cache_size)
+    return _cache
+
+
+def _is_complete(result: dict) -> bool:
+    return isinstance(result, dict) and isinstance(result.get("review_analysis"), dict)
+
+
+async def cached_analyze_review(review_text: str) -> dict:
+    """
+    То же, что analyze_review, но сначала ищет результат в кэше.
+    При попадании LLM не вызывается; в кэш попадают только успешно разобранные ответы.
+    """
+    settings = get_settings()
+    if not settings.analysis_cache_enabled:
+        return await analyze_review(review_text)
+
+    cache = get_analysis_cache()
+    model_name = settings.llm_model_name
+    key = cache.make_key(review_text, model_name, REVIEW_ANALYSIS_PROMPT_VERSION)
+
+    cached = await cache.get(key)
+    if cached is not None:
+        return cached
+
+    started = time.monotonic()
+    result = await analyze_review(review_text)
+    cache.llm_seconds += time.monotonic() - started
+
+    if _is_complete(result):
+        await cache.put(key, result, model_name, REVIEW_ANALYSIS_PROMPT_VERSION)
+    return result
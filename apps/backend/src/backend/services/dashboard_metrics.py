@@ -1,10 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict
 
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
+from ..models.db_models import REVIEWS_PARTITIONED
+from .theme_backfill import themes_denormalized
+
 class ThemeCount(BaseModel):
     topic: str
     count: int
@@ -14,76 +17,149 @@ class DayCount(BaseModel):
     date: str
     count: int
 
-async def get_total_reviews(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> int:
-    res_total = await db.execute(
+
+# Метрики читают целые сутки окна из суточных агрегатов (см. services/rollups.py),
+# а неполные сутки по краям окна — из reviews/review_themes. Границы суток
+# считаются в часовом поясе сессии БД (core/db.py задаёт UTC при подключении),
+# как и date_trunc в агрегатах.
+
+def _raw_edges(alias: str) -> str:
+    return f"""(
+    ({alias}.review_created_at >= :start AND {alias}.review_created_at < :lo)
+    OR ({alias}.review_created_at >= :hi AND {alias}.review_created_at < :end)
+)"""
+
+
+_RAW_EDGES = _raw_edges("r")
+
+# При секционировании темы отбираются ещё и по своей копии review_created_at,
+# чтобы в план попали только секции review_themes за окно
+_THEMES_RAW_FILTER = (
+    f"rt.review_created_at = r.review_created_at AND {_RAW_EDGES} AND {_raw_edges('rt')}"
+    if REVIEWS_PARTITIONED
+    else _RAW_EDGES
+)
+
+_ROLLUP_DAYS = "d.day >= :lo_day AND d.day < :hi_day"
+
+# Отзывы по дням: day, total, pos, neu, neg
+_DAILY_CTE = f"""
+daily AS (
+    SELECT (date_trunc('day', r.review_created_at))::date AS day,
+           COUNT(*) AS total,
+           COUNT(*) FILTER (WHERE r.overall_sentiment = 'положительная') AS pos,
+           COUNT(*) FILTER (WHERE r.overall_sentiment = 'нейтральная') AS neu,
+           COUNT(*) FILTER (WHERE r.overall_sentiment = 'отрицательная') AS neg
+    FROM reviews r
+    WHERE {_RAW_EDGES}
+    GROUP BY 1
+    UNION ALL
+    SELECT d.day, d.total_count, d.positive_count, d.neutral_count, d.negative_count
+    FROM review_daily_rollup d
+    WHERE {_ROLLUP_DAYS}
+)"""
+
+
+def _build_themes_cte(raw_source: str) -> str:
+    # Упоминания тем за окно: theme_id, sentiment, cnt. Группировка идёт по id темы,
+    # название из словаря themes подставляется только в итоговый top-N
+    return f"""
+theme_parts AS (
+    SELECT rt.theme_id, rt.sentiment, COUNT(*) AS cnt
+    {raw_source}
+    GROUP BY rt.theme_id, rt.sentiment
+    UNION ALL
+    SELECT d.theme_id, d.sentiment, SUM(d.review_count) AS cnt
+    FROM theme_daily_rollup d
+    WHERE {_ROLLUP_DAYS}
+    GROUP BY d.theme_id, d.sentiment
+),
+t AS (
+    SELECT theme_id, sentiment, SUM(cnt) AS cnt
+    FROM theme_parts
+    GROUP BY theme_id, sentiment
+)"""
+
+
+_THEMES_CTE_JOIN = _build_themes_cte(
+    f"""FROM review_themes rt
+    JOIN reviews r ON r.id = rt.review_id
+    WHERE {_THEMES_RAW_FILTER}"""
+)
+
+# После заполнения копии review_created_at в review_themes — одна таблица, без соединения
+_THEMES_CTE_DENORMALIZED = _build_themes_cte(
+    f"""FROM review_themes rt
+    WHERE {_raw_edges("rt")}"""
+)
+
+
+def _themes_cte() -> str:
+    return _THEMES_CTE_DENORMALIZED if themes_denormalized() else _THEMES_CTE_JOIN
+
+
+SENTIMENT_SCORES = {"положительная": 5, "нейтральная": 3, "отрицательная": 1}
+
+_DAILY_COLUMNS = {"положительная": "pos", "нейтральная": "neu", "отрицательная": "neg"}
+
+
+def _window_params(start_ts: datetime, end_excl: datetime) -> dict:
+    """
+    Делит окно [start, end) на целые сутки [lo, hi) для агрегатов и края для сырых таблиц.
+    Если целых суток нет (или даты не в UTC), всё окно считается по сырым таблицам: lo = hi = end.
+    """
+    lo = hi = end_excl
+    if all(ts.tzinfo is None or ts.utcoffset() == timedelta(0) for ts in (start_ts, end_excl)):
+        start_day = start_ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        day_lo = start_day if start_day == start_ts else start_day + timedelta(days=1)
+        day_hi = end_excl.replace(hour=0, minute=0, second=0, microsecond=0)
+        if day_lo < day_hi:
+            lo, hi = day_lo, day_hi
+    return {"start": start_ts, "end": end_excl, "lo": lo, "hi": hi, "lo_day": lo.date(), "hi_day": hi.date()}
+
+
+async def _sentiment_totals(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> tuple[int, Dict[str, int]]:
+    res = await db.execute(
         text(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM reviews r
-            WHERE r.review_created_at >= :start AND r.review_created_at < :end
+            f"""
+            WITH {_DAILY_CTE}
+            SELECT COALESCE(SUM(total), 0), COALESCE(SUM(pos), 0), COALESCE(SUM(neu), 0), COALESCE(SUM(neg), 0)
+            FROM daily
             """
         ),
-        {"start": start_ts, "end": end_excl},
+        _window_params(start_ts, end_excl),
     )
-    return int(res_total.scalar() or 0)
+    total, pos, neu, neg = res.fetchone()
+    return int(total), {"положительная": int(pos), "нейтральная": int(neu), "отрицательная": int(neg)}
+
+
+def _avg_score(distribution: Dict[str, int]) -> float:
+    scored = sum(distribution.values())
+    if not scored:
+        return 0.0
+    return float(sum(SENTIMENT_SCORES[s] * n for s, n in distribution.items()) / scored)
+
+
+async def get_total_reviews(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> int:
+    total, _ = await _sentiment_totals(db, start_ts, end_excl)
+    return total
 
 
 async def get_sentiment_distribution(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> Dict[str, int]:
-    res_dist = await db.execute(
-        text(
-            """
-            SELECT r.overall_sentiment AS s, COUNT(*) AS cnt
-            FROM reviews r
-            WHERE r.review_created_at >= :start AND r.review_created_at < :end
-            GROUP BY r.overall_sentiment
-            """
-        ),
-        {"start": start_ts, "end": end_excl},
-    )
-    dist_rows = res_dist.fetchall()
-    sentiment_distribution: Dict[str, int] = {
-        "положительная": 0,
-        "нейтральная": 0,
-        "отрицательная": 0,
-    }
-    for s, cnt in dist_rows:
-        if s in sentiment_distribution:
-            sentiment_distribution[s] = int(cnt or 0)
+    _, sentiment_distribution = await _sentiment_totals(db, start_ts, end_excl)
     return sentiment_distribution
 
 
 async def get_avg_sentiment_score(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> float:
-    res_avg = await db.execute(
-        text(
-            """
-            SELECT AVG(score)::float AS avg_score
-            FROM (
-                SELECT CASE r.overall_sentiment
-                    WHEN 'положительная' THEN 5
-                    WHEN 'нейтральная' THEN 3
-                    WHEN 'отрицательная' THEN 1
-                END AS score
-                FROM reviews r
-                WHERE r.review_created_at >= :start AND r.review_created_at < :end
-            ) x
-            """
-        ),
-        {"start": start_ts, "end": end_excl},
-    )
-    return float(res_avg.scalar() or 0.0)
+    # Оценки 5/3/1; отзывы без тональности в среднее не входят (как AVG по NULL)
+    _, sentiment_distribution = await _sentiment_totals(db, start_ts, end_excl)
+    return _avg_score(sentiment_distribution)
 
 
 async def get_total_themes(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> int:
     res_total_themes = await db.execute(
-        text(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM review_themes rt
-            JOIN reviews r ON r.id = rt.review_id
-            WHERE r.review_created_at >= :start AND r.review_created_at < :end
-            """
-        ),
-        {"start": start_ts, "end": end_excl},
+        text(f"WITH {_themes_cte()} SELECT COALESCE(SUM(cnt), 0) FROM t"),
+        _window_params(start_ts, end_excl),
     )
     return int(res_total_themes.scalar() or 0)
 
@@ -91,15 +167,13 @@ async def get_total_themes(db: AsyncSession, start_ts: datetime, end_excl: datet
 async def get_non_positive_themes(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> int: #TODO LIMIT?
     res_non_pos_themes = await db.execute(
         text(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM review_themes rt
-            JOIN reviews r ON r.id = rt.review_id
-            WHERE rt.sentiment IN ('нейтральная','отрицательная')
-              AND r.review_created_at >= :start AND r.review_created_at < :end
+            f"""
+            WITH {_themes_cte()}
+            SELECT COALESCE(SUM(cnt), 0) FROM t
+            WHERE t.sentiment IN ('нейтральная','отрицательная')
             """
         ),
-        {"start": start_ts, "end": end_excl},
+        _window_params(start_ts, end_excl),
     )
     return int(res_non_pos_themes.scalar() or 0)
 
@@ -113,18 +187,22 @@ async def get_top_themes(
 ) -> List[ThemeCount]:
     res = await db.execute(
         text(
-            """
-            SELECT rt.theme, COUNT(*) AS cnt
-            FROM review_themes rt
-            JOIN reviews r ON r.id = rt.review_id
-            WHERE rt.sentiment = :sentiment
-              AND r.review_created_at >= :start AND r.review_created_at < :end
-            GROUP BY rt.theme
-            ORDER BY cnt DESC, rt.theme
-            LIMIT :limit
+            f"""
+            WITH {_themes_cte()},
+            top AS (
+                SELECT t.theme_id, t.cnt
+                FROM t
+                WHERE t.sentiment = :sentiment
+                ORDER BY t.cnt DESC, t.theme_id
+                LIMIT :limit
+            )
+            SELECT th.name, top.cnt
+            FROM top
+            JOIN themes th ON th.id = top.theme_id
+            ORDER BY top.cnt DESC, top.theme_id
             """
         ),
-        {"start": start_ts, "end": end_excl, "sentiment": sentiment, "limit": limit},
+        {**_window_params(start_ts, end_excl), "sentiment": sentiment, "limit": limit},
     )
     rows = res.fetchall()
     return [ThemeCount(topic=row[0], count=int(row[1])) for row in rows]
@@ -136,18 +214,21 @@ async def get_daily_counts_by_sentiment(
     end_excl: datetime,
     sentiment: str,
 ) -> List[DayCount]:
+    column = _DAILY_COLUMNS.get(sentiment)
+    if column is None:
+        return []
     res_daily = await db.execute(
         text(
-            """
-            SELECT (date_trunc('day', r.review_created_at))::date AS day, COUNT(*) AS cnt
-            FROM reviews r
-            WHERE r.overall_sentiment = :sentiment
-              AND r.review_created_at >= :start AND r.review_created_at < :end
+            f"""
+            WITH {_DAILY_CTE}
+            SELECT day, SUM({column}) AS cnt
+            FROM daily
             GROUP BY day
+            HAVING SUM({column}) > 0
             ORDER BY day
             """
         ),
-        {"start": start_ts, "end": end_excl, "sentiment": sentiment},
+        _window_params(start_ts, end_excl),
     )
     return [DayCount(date=str(row[0]), count=int(row[1])) for row in res_daily.fetchall()]
 
@@ -165,20 +246,116 @@ async def get_all_daily_counts(
 
 
 async def get_count_reviews(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> tuple[int, int, int]:
-    res = await db.execute(
+    _, counts = await _sentiment_totals(db, start_ts, end_excl)
+    return (counts["положительная"], counts["отрицательная"], counts["нейтральная"])
+
+
+async def get_dashboard_review_summary(db: AsyncSession, start_ts: datetime, end_excl: datetime) -> dict:
+    """
+    Первая половина сводки (отзывы по дням): общее число, распределение по тональности
+    и дневные ряды суммируются из строк по дням; средняя оценка считается из распределения.
+    """
+    params = _window_params(start_ts, end_excl)
+    res_reviews = await db.execute(
         text(
+            f"""
+            WITH {_DAILY_CTE}
+            SELECT day, SUM(total), SUM(pos), SUM(neu), SUM(neg)
+            FROM daily
+            GROUP BY day
+            ORDER BY day
             """
-            SELECT r.overall_sentiment AS s, COUNT(*) AS cnt
-            FROM reviews r
-            WHERE r.review_created_at >= :start AND r.review_created_at < :end
-            GROUP BY r.overall_sentiment
+        ),
+        params,
+    )
+
+    total_reviews = 0
+    sentiment_distribution: Dict[str, int] = {s: 0 for s in _DAILY_COLUMNS}
+    daily_counts: Dict[str, List[DayCount]] = {s: [] for s in _DAILY_COLUMNS}
+    for day, total, *by_sentiment in res_reviews.fetchall():
+        total_reviews += int(total or 0)
+        for s, cnt in zip(_DAILY_COLUMNS, by_sentiment):
+            cnt = int(cnt or 0)
+            if cnt:
+                sentiment_distribution[s] += cnt
+                daily_counts[s].append(DayCount(date=str(day), count=cnt))
+
+    return {
+        "total_reviews": total_reviews,
+        "sentiment_distribution": sentiment_distribution,
+        "avg_sentiment_score": _avg_score(sentiment_distribution),
+        "daily_counts": daily_counts,
+    }
+
+
+async def get_dashboard_theme_summary(
+    db: AsyncSession,
+    start_ts: datetime,
+    end_excl: datetime,
+    top_limit: int = 5,
+) -> dict:
+    """
+    Вторая половина сводки (темы): агрегаты по (id темы, тональность), из которых
+    FILTER/ROW_NUMBER достают итоги и top-N по тональностям; названия — только для top-N.
+    """
+    res_themes = await db.execute(
+        text(
+            f"""
+            WITH {_themes_cte()},
+            ranked AS (
+                SELECT t.theme_id, t.sentiment, t.cnt,
+                       ROW_NUMBER() OVER (PARTITION BY t.sentiment ORDER BY t.cnt DESC, t.theme_id) AS rn
+                FROM t
+                WHERE t.sentiment IN ('отрицательная','положительная')
+            )
+            SELECT 'totals' AS kind, NULL AS theme, NULL AS sentiment,
+                   COALESCE(SUM(t.cnt), 0) AS cnt,
+                   COALESCE(SUM(t.cnt) FILTER (WHERE t.sentiment IN ('нейтральная','отрицательная')), 0) AS non_pos,
+                   0 AS rn
+            FROM t
+            UNION ALL
+            SELECT 'top', th.name, ranked.sentiment, ranked.cnt, 0, ranked.rn
+            FROM ranked
+            JOIN themes th ON th.id = ranked.theme_id
+            WHERE ranked.rn <= :limit
+            ORDER BY kind, sentiment, rn
             """
         ),
-        {"start": start_ts, "end": end_excl},
+        {**_window_params(start_ts, end_excl), "limit": top_limit},
     )
-    rows = res.fetchall()
-    counts = {"положительная": 0, "отрицательная": 0, "нейтральная": 0}
-    for s, cnt in rows:
-        if s in counts:
-            counts[s] = int(cnt or 0)
-    return (counts["положительная"], counts["отрицательная"], counts["нейтральная"])
\ No newline at end of file
+
+    total_themes = 0
+    non_positive_themes = 0
+    top: Dict[str, List[ThemeCount]] = {"отрицательная": [], "положительная": []}
+    for kind, theme, sentiment, cnt, non_pos, _rn in res_themes.fetchall():
+        if kind == "totals":
+            total_themes = int(cnt or 0)
+            non_positive_themes = int(non_pos or 0)
+        else:
+            top[sentiment].append(ThemeCount(topic=theme, count=int(cnt)))
+
+    return {
+        "total_themes": total_themes,
+        "non_positive_themes": non_positive_themes,
+        "top_negative_themes": top["отрицательная"],
+        "top_positive_themes": top["положительная"],
+    }
+
+
+async def get_dashboard_summary(
+    db: AsyncSession,
+    start_ts: datetime,
+    end_excl: datetime,
+    top_limit: int = 5,
+) -> dict:
+    """Вся сводка дашборда за два запроса вместо десятка.
+
+    Половины независимы: эндпоинт выполняет их параллельно на разных соединениях
+    (см. services/metrics_executor.py), здесь — последовательно в одной сессии.
+    Целые сутки берутся из суточных агрегатов, края окна — из сырых таблиц.
+    Возвращает словарь с теми же полями, что DashboardSummaryResponse.
+    """
+    return {
+        **await get_dashboard_review_summary(db, start_ts, end_excl),
+        **await get_dashboard_theme_summary(db, start_ts, end_excl, top_limit),
+    }
@@ -0,0 +1,191 @@
+"""
+Поиск дубликатов отзывов при импорте (флаг delete_dublicates).
+
+Точные дубликаты определяются по sha256 нормализованного текста (text_utils):
+внутри пакета — по множеству хэшей в памяти, среди ранее сохранённых отзывов —
+по таблице review_hashes, которую write_reviews пополняет в одной транзакции с отзывами.
+
+Почти-дубликаты (IMPORT_DEDUP_MODE=near) ищутся внутри пакета: MinHash по
+символьным 5-граммам и LSH по полосам сигнатуры, кандидаты из общей корзины
+проверяются оценкой сходства Жаккара по сигнатурам.
+
+Этап работает до обращения к LLM; пропущенные строки учитываются в прогрессе
+пакета (skipped_rows).
+"""
+
+import asyncio
+import logging
+import random
+import zlib
+from array import array
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Set, Union
+
+from sqlalchemy import text
+
+from ..config import get_settings
+from ..core.db import get_session
+from .ingest import ImportRow
+from .pipeline import iterate_blocks
+from .text_utils import normalize_for_hash, review_hash, text_hash
+
+logger = logging.getLogger(__name__)
+
+# сколько хэшей проверяется в review_hashes одним запросом
+_KNOWN_LOOKUP_BLOCK = 500
+
+_SHINGLE_SIZE = 5
+_NUM_PERM = 64
+_BANDS = 16
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+class DedupStats:
+    def __init__(self) -> None:
+        self.seen = 0
+        self.in_batch = 0
+        self.near = 0
+        self.known = 0
+
+    @property
+    def skipped(self) -> int:
+        return self.in_batch + self.near + self.known
+
+    def reasons(self) -> Dict[str, int]:
+        """Отброшенные строки по причинам (для import_progress.skip_reasons)."""
+        counts = {"duplicate": self.in_batch, "near_duplicate": self.near, "already_imported": self.known}
+        return {reason: n for reason, n in counts.items() if n}
+
+    def as_dict(self) -> dict:
+        return {
+            "seen": self.seen,
+            "skipped": self.skipped,
+            "duplicates_in_batch": self.in_batch,
+            "near_duplicates_in_batch": self.near,
+            "already_imported": self.known,
+        }
+
+
+class MinHashLSH:
+    """
+    Индекс почти-дубликатов внутри одного пакета.
+
+    Сигнатура — _NUM_PERM минимумов универсальных хэш-функций по 5-граммам текста,
+    разбитая на _BANDS полос; тексты с совпавшей полосой сравниваются по доле
+    совпавших позиций сигнатуры. После `max_docs` текстов индекс перестаёт
+    пополняться (ограничение памяти), но проверка продолжается.
+    """
+
+    def __init__(self, threshold: float, max_docs: int, seed: int = 1) -> None:
+        self.threshold = threshold
+        self.max_docs = max_docs
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(_NUM_PERM)
+        ]
+        self._rows = _NUM_PERM // _BANDS
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._signatures: List[array] = []
+
+    def signature(self, normalized: str) -> array:
+        if len(normalized) <= _SHINGLE_SIZE:
+            shingles = {normalized}
+        else:
+            shingles = {normalized[i:i + _SHINGLE_SIZE] for i in range(len(normalized) - _SHINGLE_SIZE + 1)}
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+        return array("Q", (min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms))
+
+    def _similarity(self, sig: array, other: array) -> float:
+        return sum(1 for x, y in zip(sig, other) if x == y) / _NUM_PERM
+
+    def add_if_new(self, normalized: str) -> bool:
+        """True, если текст не похож ни на один из уже добавленных (и тогда он добавляется)."""
+        sig = self.signature(normalized)
+        keys = [(band, tuple(sig[band * self._rows:(band + 1) * self._rows])) for band in range(_BANDS)]
+        checked: Set[int] = set()
+        for key in keys:
+            for doc in self._buckets.get(key, ()):
+                if doc in checked:
+                    continue
+                checked.add(doc)
+                if self._similarity(sig, self._signatures[doc]) >= self.threshold:
+                    return False
+        if len(self._signatures) < self.max_docs:
+            doc = len(self._signatures)
+            self._signatures.append(sig)
+            for key in keys:
+                self._buckets.setdefault(key, []).append(doc)
+        return True
+
+
+class BatchDeduplicator:
+    """Дубликаты внутри одного пакета импорта: точные и (near=True) почти-дубликаты."""
+
+    def __init__(self, stats: DedupStats, near: Optional[bool] = None) -> None:
+        settings = get_settings()
+        if near is None:
+            near = settings.import_dedup_mode == "near"
+        self.stats = stats
+        # 64-битного префикса sha256 достаточно для сравнения внутри пакета и вчетверо меньше по памяти
+        self._hashes: Set[int] = set()
+        self._lsh = (
+            MinHashLSH(settings.import_dedup_near_threshold, settings.import_dedup_near_max_docs) if near else None
+        )
+
+    def filter_block(self, rows: List[ImportRow]) -> List[ImportRow]:
+        """Строки блока, не повторяющие уже виденные (CPU-работа — вызывается в отдельном потоке)."""
+        return [row for row in rows if not self.is_duplicate(row.text)]
+
+    def is_duplicate(self, review_text: str) -> bool:
+        self.stats.seen += 1
+        normalized = normalize_for_hash(review_text)
+        key = int(text_hash(normalized)[:16], 16)
+        if key in self._hashes:
+            self.stats.in_batch += 1
+            return True
+        self._hashes.add(key)
+        if self._lsh is not None and not self._lsh.add_if_new(normalized):
+            self.stats.near += 1
+            return True
+        return False
+
+
+async def filter_known(rows: List[ImportRow], stats: DedupStats) -> List[ImportRow]:
+    """Убрать строки с текстами, уже сохранёнными ранее (по таблице review_hashes)."""
+    if not rows:
+        return rows
+    hashes = [review_hash(row.text) for row in rows]
+    async with get_session()() as session:
+        # хэш отзыва, удалённого вместе с пакетом или отсоединённой секцией, дубликатом не считается
+        res = await session.execute(
+            text(
+                """
+                SELECT h.hash FROM review_hashes h
+                WHERE h.hash = ANY(:hashes)
+                  AND EXISTS (SELECT 1 FROM reviews r WHERE r.id = h.review_id)
+                """
+            ),
+            {"hashes": sorted(set(hashes))},
+        )
+        known = {row[0] for row in res.fetchall()}
+    if not known:
+        return rows
+    kept = [row for row, h in zip(rows, hashes) if h not in known]
+    stats.known += len(rows) - len(kept)
+    return kept
+
+
+async def dedup_texts(
+    rows: Union[Iterable[ImportRow], AsyncIterable[ImportRow]],
+    stats: DedupStats,
+    near: Optional[bool] = None,
+) -> AsyncIterator[ImportRow]:
+    """
+    Отдаёт строки без дубликатов — внутри пакета и среди уже импортированных отзывов.
+    Хэши и MinHash блока считаются в отдельном потоке, не задерживая цикл событий.
+    """
+    batch = BatchDeduplicator(stats, near)
+    async for block in iterate_blocks(rows, _KNOWN_LOOKUP_BLOCK):
+        fresh = await asyncio.to_thread(batch.filter_block, block)
+        for kept in await filter_known(fresh, stats):
+            yield kept
+    logger.info("Deduplication: %s", stats.as_dict())
@@ -0,0 +1,175 @@
+"""
+LLM-отчёты с рекомендациями по отзывам за окно времени.
+
+Отчёт сохраняется в feedback_reports с ключом (окно, поколение данных, модель,
+версия промпта) и считается один раз на окно. Если для окна отчёта ещё нет,
+но вход LLM (число отзывов и топ негативных тем) совпадает с уже посчитанным,
+ответ переиспользуется без вызова LLM. Одновременные запросы с одинаковым
+входом в одном процессе ждут один общий вызов (single-flight).
+
+Окна «последние N дней» округляются до минуты, поэтому строки копятся
+непрерывно: при сохранении отчёта удаляются отчёты старше
+FEEDBACK_REPORT_RETENTION_DAYS.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..core.db import get_session
+from ..models.db_models import FeedbackReport
+from .analysis import FEEDBACK_RECOMMENDATIONS_PROMPT_VERSION, generate_feedback_recommendations
+from .dashboard_metrics import get_top_themes, get_total_reviews
+from .response_cache import get_data_generation
+from .text_utils import text_hash
+
+logger = logging.getLogger(__name__)
+
+_inflight: Dict[str, "asyncio.Task[Optional[dict]]"] = {}
+
+
+def _normalize_report(data: dict) -> dict:
+    # Приводим feedback_analysis к списку
+    fa = data.get("feedback_analysis")
+    if isinstance(fa, dict):
+        # если пришёл один объект — оборачиваем в список
+        data["feedback_analysis"] = [fa]
+    elif fa is None:
+        # если ничего нет — делаем пустой список
+        data["feedback_analysis"] = []
+
+    # Гарантируем поле overall_proposals
+    if "overall_proposals" not in data:
+        data["overall_proposals"] = []
+    return data
+
+
+class _ReportKey:
+    def __init__(self, start_dt: datetime, end_dt: datetime, generation: int) -> None:
+        settings = get_settings()
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.generation = generation
+        self.model_name = settings.llm_model_name
+        self.prompt_version = FEEDBACK_RECOMMENDATIONS_PROMPT_VERSION
+
+
+async def _find_by_window(db: AsyncSession, key: _ReportKey) -> Optional[dict]:
+    res = await db.execute(
+        select(FeedbackReport.result).where(
+            FeedbackReport.window_start == key.start_dt,
+            FeedbackReport.window_end == key.end_dt,
+            FeedbackReport.generation == key.generation,
+            FeedbackReport.model_name == key.model_name,
+            FeedbackReport.prompt_version == key.prompt_version,
+        )
+    )
+    return res.scalar()
+
+
+async def _find_by_inputs(db: AsyncSession, key: _ReportKey, inputs_hash: str) -> Optional[dict]:
+    res = await db.execute(
+        select(FeedbackReport.result)
+        .where(
+            FeedbackReport.inputs_hash == inputs_hash,
+            FeedbackReport.model_name == key.model_name,
+            FeedbackReport.prompt_version == key.prompt_version,
+        )
+        .order_by(FeedbackReport.id.desc())
+        .limit(1)
+    )
+    return res.scalar()
+
+
+async def _store(key: _ReportKey, inputs_hash: str, result: dict) -> None:
+    # отдельная сессия: общий вызов может пережить запрос, который его начал
+    try:
+        async with get_session()() as session:
+            async with session.begin():
+                await session.execute(
+                    insert(FeedbackReport)
+                    .values(
+                        window_start=key.start_dt,
+                        window_end=key.end_dt,
+                        generation=key.generation,
+                        model_name=key.model_name,
+                        prompt_version=key.prompt_version,
+                        inputs_hash=inputs_hash,
+                        result=result,
+                    )
+                    .on_conflict_do_nothing(constraint="uq_feedback_reports_window")
+                )
+                await session.execute(
+                    text("DELETE FROM feedback_reports WHERE created_at < now() - make_interval(secs => :ttl)"),
+                    {"ttl": get_settings().feedback_report_retention_days * 86400},
+                )
+    except Exception as e:
+        logger.warning("Feedback report store failed: %s", e)
+
+
+async def _single_flight(flight_key: str, factory: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+    task = _inflight.get(flight_key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        _inflight[flight_key] = task
+
+        def _forget(done: asyncio.Task) -> None:
+            if _inflight.get(flight_key) is done:
+                del _inflight[flight_key]
+
+        task.add_done_callback(_forget)
+    # shield: отмена одного запроса (клиент ушёл) не отменяет общий вызов
+    return await asyncio.shield(task)
+
+
+async def get_feedback_report(db: AsyncSession, start_dt: datetime, end_dt: datetime) -> dict:
+    """Отчёт за окно [start_dt, end_dt): из feedback_reports или через LLM (не чаще одного вызова на вход)."""
+    key = _ReportKey(start_dt, end_dt, await get_data_generation(db))
+    stored = await _find_by_window(db, key)
+    if stored is not None:
+        return stored
+
+    total_reviews = await get_total_reviews(db, start_dt, end_dt)
+    if total_reviews == 0:
+        # Пустая структура, соответствующая схеме
+        return {
+            "feedback_analysis": [],
+            "overall_proposals": [],
+        }
+
+    top_negative = await get_top_themes(db, start_dt, end_dt, sentiment="отрицательная")
+    topics_dict = {tc.topic: tc.count for tc in top_negative}
+    inputs_hash = text_hash(
+        str(total_reviews),
+        json.dumps(list(topics_dict.items()), ensure_ascii=False),
+        key.model_name,
+        key.prompt_version,
+    )
+
+    reused = await _find_by_inputs(db, key, inputs_hash)
+    if reused is not None:
+        await _store(key, inputs_hash, reused)
+        return reused
+
+    async def generate() -> Optional[dict]:
+        data = await generate_feedback_recommendations(total_reviews, topics_dict)
+        if not data:
+            # LLM недоступна или ответ не разобран — такой отчёт не сохраняем
+            return None
+        report = _normalize_report(data)
+        # сохраняем до снятия single-flight, чтобы следующие запросы нашли готовый отчёт в БД
+        await _store(key, inputs_hash, report)
+        return report
+
+    report = await _single_flight(inputs_hash, generate)
+    if report is None:
+        return _normalize_report({})
+    await _store(key, inputs_hash, report)
+    return report
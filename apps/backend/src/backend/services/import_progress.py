@@ -0,0 +1,176 @@
+"""
+Прогресс обработки пакетов импорта (таблица import_progress).
+
+Заменяет глобальный флаг is_analyzing: запись хранится в БД и видна всем
+процессам API и воркерам, а признак «идёт анализ» считается по активным пакетам.
+"""
+
+import json
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from ..models.db_models import ImportProgress
+from ..models.import_models import BatchProgress
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def _add_counters(column: str, param: str) -> str:
+    """SQL-выражение: JSONB-счётчики столбца плюс счётчики параметра (поключево)."""
+    return f"""
+        CASE WHEN CAST(:{param} AS jsonb) = CAST('{{}}' AS jsonb) THEN {column} ELSE (
+            SELECT jsonb_object_agg(u.key, u.cnt) FROM (
+                SELECT e.key, SUM(e.value::bigint) AS cnt
+                FROM (
+                    SELECT key, value FROM jsonb_each_text(COALESCE({column}, CAST('{{}}' AS jsonb)))
+                    UNION ALL
+                    SELECT key, value FROM jsonb_each_text(CAST(:{param} AS jsonb))
+                ) e
+                GROUP BY e.key
+            ) u
+        ) END
+    """
+
+
+async def create_batch_progress(db: AsyncSession, batch_id: int) -> None:
+    """Завести запись прогресса для нового пакета (статус queued). Коммитит транзакцию."""
+    db.add(ImportProgress(batch_id=batch_id, status="queued"))
+    await db.commit()
+
+
+async def update_batch_progress(
+    session: AsyncSession,
+    batch_id: int,
+    processed_delta: int = 0,
+    failed_delta: int = 0,
+    skipped: Optional[Dict[str, int]] = None,
+    tiers: Optional[Dict[str, int]] = None,
+    warnings: Optional[Dict[str, int]] = None,
+    total_rows: Optional[int] = None,
+    total_is_estimate: Optional[bool] = None,
+    status: Optional[str] = None,
+    error: Optional[str] = None,
+) -> None:
+    """
+    Обновить прогресс пакета в рамках транзакции `session` (без коммита).
+    Счётчики увеличиваются на delta, поэтому несколько воркеров могут обновлять один пакет.
+    `skipped` — строки, отброшенные до анализа, по причинам (дубликаты, мусор); прибавляются
+    к skipped_rows и к счётчикам причин в skip_reasons.
+    `tiers` — проанализированные строки по уровням анализа (локальная модель, LLM),
+    прибавляются к analysis_tiers.
+    `warnings` — сохранённые, но неполно разобранные строки (нераспознанная дата),
+    прибавляются к warnings. `error` — причина статуса failed.
+    """
+    skipped = {reason: n for reason, n in (skipped or {}).items() if n}
+    tiers = {tier: n for tier, n in (tiers or {}).items() if n}
+    warnings = {warning: n for warning, n in (warnings or {}).items() if n}
+    await session.execute(
+        text(
+            f"""
+            UPDATE import_progress
+            SET processed_rows = processed_rows + :processed,
+                failed_rows = failed_rows + :failed,
+                skipped_rows = skipped_rows + :skipped,
+                skip_reasons = {_add_counters("skip_reasons", "reasons")},
+                analysis_tiers = {_add_counters("analysis_tiers", "tiers")},
+                warnings = {_add_counters("warnings", "warnings")},
+                total_rows = COALESCE(:total, total_rows),
+                total_is_estimate = COALESCE(:estimate, total_is_estimate),
+                status = COALESCE(:status, status),
+                error = COALESCE(:error, error),
+                started_at = COALESCE(started_at, now()),
+                updated_at = now(),
+                finished_at = CASE WHEN :status IN ('done','failed') THEN now() ELSE finished_at END
+            WHERE batch_id = :batch
+            """
+        ),
+        {
+            "batch": batch_id,
+            "processed": processed_delta,
+            "failed": failed_delta,
+            "skipped": sum(skipped.values()),
+            "reasons": json.dumps(skipped),
+            "tiers": json.dumps(tiers),
+            "warnings": json.dumps(warnings),
+            "total": total_rows,
+            "estimate": total_is_estimate,
+            "status": status,
+            "error": error[:2000] if error else None,
+        },
+    )
+
+
+async def report_batch_progress(session_maker: sessionmaker, batch_id: int, **changes) -> None:
+    """То же, что update_batch_progress, но в собственной короткой транзакции."""
+    async with session_maker() as session:
+        async with session.begin():
+            await update_batch_progress(session, batch_id, **changes)
+
+
+def _to_model(row) -> BatchProgress:
+    elapsed = None
+    if row.started_at is not None:
+        end = row.finished_at or row.db_now
+        elapsed = (end - row.started_at).total_seconds()
+
+    done_rows = row.processed_rows + row.failed_rows + row.skipped_rows
+    rows_per_second = done_rows / elapsed if elapsed else 0.0
+
+    percent = None
+    eta_seconds = None
+    if row.total_rows:
+        percent = round(min(100.0, 100.0 * done_rows / row.total_rows), 2)
+        if row.status in ACTIVE_STATUSES and rows_per_second > 0:
+            eta_seconds = round(max(0, row.total_rows - done_rows) / rows_per_second, 1)
+
+    return BatchProgress(
+        batch_id=row.batch_id,
+        status=row.status,
+        total_rows=row.total_rows,
+        total_is_estimate=row.total_is_estimate,
+        processed_rows=row.processed_rows,
+        failed_rows=row.failed_rows,
+        skipped_rows=row.skipped_rows,
+        skip_reasons=row.skip_reasons or {},
+        analysis_tiers=row.analysis_tiers or {},
+        warnings=row.warnings or {},
+        error=row.error,
+        percent=percent,
+        rows_per_second=round(rows_per_second, 3),
+        eta_seconds=eta_seconds,
+        started_at=row.started_at,
+        updated_at=row.updated_at,
+        finished_at=row.finished_at,
+    )
+
+
+async def get_batch_progress(db: AsyncSession, batch_id: int) -> Optional[BatchProgress]:
+    res = await db.execute(
+        text("SELECT p.*, now() AS db_now FROM import_progress p WHERE p.batch_id = :batch"),
+        {"batch": batch_id},
+    )
+    row = res.fetchone()
+    return _to_model(row) if row else None
+
+
+async def get_active_progress(db: AsyncSession, stale_after_seconds: float) -> List[BatchProgress]:
+    """
+    Активные пакеты. Запись, не обновлявшаяся дольше stale_after_seconds,
+    считается брошенной (процесс упал) и в активные не попадает.
+    """
+    res = await db.execute(
+        text(
+            """
+            SELECT p.*, now() AS db_now
+            FROM import_progress p
+            WHERE p.status IN ('queued','running')
+              AND p.updated_at > now() - make_interval(secs => :stale)
+            ORDER BY p.batch_id
+            """
+        ),
+        {"stale": stale_after_seconds},
+    )
+    return [_to_model(row) for row in res.fetchall()]
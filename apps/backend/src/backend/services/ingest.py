@@ -0,0 +1,489 @@
+"""
+Потоковый приём файлов импорта.
+
+Загрузка копируется на диск кусками, а строки читаются генератором
+с инкрементальным декодированием — в памяти никогда не лежит весь файл.
+
+Форматы: CSV, .xlsx (openpyxl в режиме read-only — лист читается построчно
+из zip-архива, без загрузки в память) и JSON Lines / NDJSON.
+Сопоставление колонок (`columns`) задаёт, откуда брать текст отзыва, дату
+и язык: имя колонки из заголовка (первая строка CSV/xlsx, ключ объекта JSONL)
+или её номер с нуля. Дата и язык едут вместе с текстом в ImportRow.
+"""
+
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Union
+
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+_SPOOL_CHUNK_SIZE = 1 << 20  # 1 МиБ
+
+IMPORT_FORMATS = ("csv", "xlsx", "jsonl")
+# ImportBatch.source_type по формату файла и наоборот
+_SOURCE_FORMATS = {"csv": "csv", "excel": "xlsx", "api": "jsonl"}
+_FORMAT_SOURCES = {fmt: source for source, fmt in _SOURCE_FORMATS.items()}
+_EXTENSION_FORMATS = {".csv": "csv", ".xlsx": "xlsx", ".xlsm": "xlsx", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+_COLUMN_KEYS = ("text", "date", "language")
+_DATE_FORMATS = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y", "%Y/%m/%d")
+# числа в ячейке даты — unix-время (в .xlsx — порядковый номер дня Excel); вне этих лет
+# значение считается нераспознанным (45500 — не 1970-01-01, а 27.07.2024 в формате Excel)
+_NUMERIC_DATE_YEARS = (2000, 2100)
+# ДД/ММ/ГГГГ или ММ/ДД/ГГГГ (американский формат) — порядок понятен, только если одно из чисел больше 12
+_SLASH_DATE = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})")
+
+
+class ImportFormatError(ValueError):
+    """Файл или сопоставление колонок не подходят для импорта."""
+
+
+class ImportRow(NamedTuple):
+    """
+    Строка импорта: текст отзыва с датой и языком из сопоставленных колонок.
+    Проходит предфильтр, поиск дубликатов и анализ целиком; дату и язык в БД пишет review_writer.
+    """
+
+    text: str
+    review_date: Optional[datetime] = None
+    language: Optional[str] = None
+
+
+def row_to_json(row: ImportRow) -> Union[str, dict]:
+    """Строка для import_job_chunks.texts: без даты и языка — просто текст."""
+    if row.review_date is None and row.language is None:
+        return row.text
+    return {
+        "text": row.text,
+        "date": row.review_date.isoformat() if row.review_date else None,
+        "language": row.language,
+    }
+
+
+def row_from_json(value: Union[str, dict]) -> ImportRow:
+    if not isinstance(value, dict):
+        return ImportRow(value)
+    return ImportRow(value["text"], parse_review_date(value.get("date")), value.get("language"))
+
+
+def detect_import_format(source: Optional[str], filename: Optional[str]) -> str:
+    """Формат по расширению файла, а если оно не распознано — по полю source (excel, api — JSONL)."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    return _EXTENSION_FORMATS.get(ext) or _SOURCE_FORMATS.get(source or "csv", "csv")
+
+
+def format_source_type(fmt: str) -> str:
+    return _FORMAT_SOURCES[fmt]
+
+
+def parse_column_mapping(raw: Union[str, dict, None]) -> Dict[str, Union[str, int]]:
+    """
+    Разобрать сопоставление колонок: JSON-объект {"text": ..., "date": ..., "language": ...},
+    значения — имя колонки или номер с нуля. Неизвестные ключи — ошибка.
+    """
+    if raw is None or raw == "":
+        return {}
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f"column mapping is not valid JSON: {e}") from e
+    if not isinstance(raw, dict):
+        raise ImportFormatError("column mapping must be a JSON object")
+    unknown = sorted(set(raw) - set(_COLUMN_KEYS))
+    if unknown:
+        raise ImportFormatError(f"unknown column mapping keys: {unknown}")
+    columns = {}
+    for key, value in raw.items():
+        if value is None or value == "":
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int)) or (isinstance(value, int) and value < 0):
+            raise ImportFormatError(f"column for {key!r} must be a column name or a non-negative index")
+        columns[key] = value
+    return columns
+
+
+def parse_review_date(value: Any, excel_serial: bool = False) -> Optional[datetime]:
+    """
+    Дата отзыва из значения ячейки: datetime/date, ISO 8601, ДД.ММ.ГГГГ [ЧЧ:ММ[:СС]],
+    ГГГГ/ММ/ДД, ДД/ММ/ГГГГ и ММ/ДД/ГГГГ, или число: unix-время (секунды, миллисекунды),
+    а с `excel_serial` — порядковый номер дня Excel (дата в ячейке общего формата .xlsx).
+    Время без пояса считается UTC. Не разобралось — None, в том числе для дат через
+    косую черту, где и день, и месяц не больше 12 (03/04/2024 — 3 апреля или 4 марта),
+    и для чисел, дающих дату вне 2000–2099 годов.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime(value.year, value.month, value.day)
+    elif isinstance(value, (int, float)):
+        try:
+            if excel_serial:
+                from openpyxl.utils.datetime import from_excel
+
+                parsed = from_excel(value)
+                if not isinstance(parsed, datetime):
+                    return None
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            else:
+                seconds = value / 1000 if abs(value) >= 1e11 else value
+                parsed = datetime.fromtimestamp(seconds, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+        return parsed if _NUMERIC_DATE_YEARS[0] <= parsed.year < _NUMERIC_DATE_YEARS[1] else None
+    else:
+        raw = str(value).strip()
+        if not raw:
+            return None
+        try:
+            parsed = datetime.fromisoformat(raw[:-1] + "+00:00" if raw.endswith("Z") else raw)
+        except ValueError:
+            slash = _SLASH_DATE.fullmatch(raw)
+            if slash:
+                return _parse_slash_date(*map(int, slash.groups()))
+            for fmt in _DATE_FORMATS:
+                try:
+                    parsed = datetime.strptime(raw, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _parse_slash_date(first: int, second: int, year: int) -> Optional[datetime]:
+    if first == second or first > 12:
+        day, month = first, second
+    elif second > 12:
+        day, month = second, first
+    else:
+        return None
+    try:
+        return datetime(year, month, day, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def _normalize_language(value: Any) -> Optional[str]:
+    # reviews.language_code — VARCHAR(10)
+    if value is None:
+        return None
+    language = str(value).strip().lower()[:10]
+    return language or None
+
+
+async def spool_upload(file: UploadFile, spool_dir: Optional[str] = None, suffix: str = "") -> str:
+    """Сохраняет загруженный файл во временный файл на диске и возвращает путь к нему."""
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="import-", suffix=suffix, dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(_SPOOL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def remove_spooled_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _resolve_encoding(encoding: Optional[str]) -> str:
+    try:
+        return codecs.lookup(encoding or "utf-8").name
+    except LookupError:
+        return "utf-8"
+
+
+class ReadProgress:
+    """Сколько байт и строк файла уже прочитано — для оценки общего числа строк."""
+
+    def __init__(self, bytes_total: int) -> None:
+        self.bytes_total = bytes_total
+        self.bytes_read = 0
+        self.rows = 0
+        # строк по метаданным файла (размер листа xlsx), если известно
+        self.rows_hint: Optional[int] = None
+        # строки, которые не разобрались (битый JSON, нет колонки с текстом)
+        self.invalid = 0
+        # строки с непустой, но не распознанной датой: сохраняются с датой импорта
+        self.unparsed_dates = 0
+        self.finished = False
+
+    def estimated_total_rows(self) -> Optional[int]:
+        if self.finished:
+            return self.rows
+        if self.rows_hint is not None:
+            return max(self.rows, self.rows_hint)
+        if not self.bytes_read or not self.rows:
+            return None
+        # буфер чтения опережает разбор, поэтому оценка слегка занижена в начале
+        return max(self.rows, round(self.rows * self.bytes_total / self.bytes_read))
+
+    def reasons(self) -> Dict[str, int]:
+        """Отброшенные при чтении строки по причинам (для import_progress.skip_reasons)."""
+        return {"invalid_row": self.invalid} if self.invalid else {}
+
+    def warnings(self) -> Dict[str, int]:
+        """Сохранённые, но неполно разобранные строки (для import_progress.warnings)."""
+        return {"unparsed_date": self.unparsed_dates} if self.unparsed_dates else {}
+
+
+class _CountingReader(io.RawIOBase):
+    def __init__(self, raw, progress: ReadProgress) -> None:
+        self._raw = raw
+        self._progress = progress
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._raw.readinto(b) or 0
+        self._progress.bytes_read += n
+        return n
+
+    def close(self) -> None:
+        self._raw.close()
+        super().close()
+
+
+def _open_text(path: str, encoding: Optional[str], progress: Optional[ReadProgress]) -> io.TextIOWrapper:
+    raw = open(path, "rb", buffering=0)
+    if progress is not None:
+        raw = _CountingReader(raw, progress)
+    return io.TextIOWrapper(
+        io.BufferedReader(raw), encoding=_resolve_encoding(encoding), errors="replace", newline=""
+    )
+
+
+class _RowMapper:
+    """
+    Текст, дата и язык из строки таблицы (список значений) по сопоставлению колонок.
+    Без сопоставления текст — первая колонка. Если хоть одна колонка задана именем,
+    первая строка файла считается заголовком.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, Union[str, int]],
+        default_language: Optional[str],
+        progress: Optional[ReadProgress] = None,
+        excel_serial: bool = False,
+    ) -> None:
+        self.columns = columns
+        self.default_language = _normalize_language(default_language)
+        self.progress = progress
+        self.excel_serial = excel_serial
+        self.needs_header = any(isinstance(c, str) for c in columns.values())
+        self._index: Dict[str, int] = {k: c for k, c in columns.items() if isinstance(c, int)}
+
+    def set_header(self, header: List[Any]) -> None:
+        names = [str(h).strip() if h is not None else "" for h in header]
+        for key, column in self.columns.items():
+            if isinstance(column, str):
+                try:
+                    self._index[key] = names.index(column.strip())
+                except ValueError:
+                    raise ImportFormatError(f"column {column!r} ({key}) is not in the header: {names}") from None
+
+    def _get(self, values: List[Any], key: str) -> Any:
+        i = self._index.get(key, 0 if key == "text" else None)
+        if i is None or i >= len(values):
+            return None
+        return values[i]
+
+    def __call__(self, values: List[Any]) -> Optional[ImportRow]:
+        text = self._get(values, "text")
+        text = str(text).strip() if text is not None else ""
+        if not text:
+            return None
+        return ImportRow(
+            text,
+            _row_date(self._get(values, "date"), self.progress, self.excel_serial),
+            _normalize_language(self._get(values, "language")) or self.default_language,
+        )
+
+
+def _row_date(value: Any, progress: Optional[ReadProgress], excel_serial: bool = False) -> Optional[datetime]:
+    """Дата строки импорта; непустая нераспознанная дата считается в progress.unparsed_dates."""
+    parsed = parse_review_date(value, excel_serial)
+    if parsed is None and progress is not None and value is not None and str(value).strip():
+        progress.unparsed_dates += 1
+    return parsed
+
+
+def _iter_mapped(
+    rows: Iterator[List[Any]],
+    columns: Optional[Dict[str, Union[str, int]]],
+    default_language: Optional[str],
+    progress: Optional[ReadProgress],
+    excel_serial: bool = False,
+) -> Iterator[ImportRow]:
+    mapper = _RowMapper(columns or {}, default_language, progress, excel_serial)
+    for values in rows:
+        if not values:
+            continue
+        if mapper.needs_header:
+            mapper.set_header(list(values))
+            mapper.needs_header = False
+            continue
+        text = mapper(list(values))
+        if text is None:
+            continue
+        if progress is not None:
+            progress.rows += 1
+        yield text
+    if progress is not None:
+        progress.finished = True
+
+
+def iter_csv_texts(
+    path: str,
+    delimiter: str = ",",
+    encoding: Optional[str] = "utf-8",
+    progress: Optional[ReadProgress] = None,
+    columns: Optional[Dict[str, Union[str, int]]] = None,
+    default_language: Optional[str] = None,
+) -> Iterator[ImportRow]:
+    """
+    Построчно читает CSV и отдаёт строки с непустым текстом отзыва (первая колонка или из `columns`).
+    Нераспознанные байты заменяются, а не роняют весь импорт.
+    Если передан `progress`, в нём копится число прочитанных байт и строк.
+    """
+    with _open_text(path, encoding, progress) as f:
+        yield from _iter_mapped(csv.reader(f, delimiter=delimiter or ","), columns, default_language, progress)
+
+
+def iter_xlsx_texts(
+    path: str,
+    progress: Optional[ReadProgress] = None,
+    columns: Optional[Dict[str, Union[str, int]]] = None,
+    default_language: Optional[str] = None,
+) -> Iterator[ImportRow]:
+    """Построчно читает первый лист .xlsx в режиме read-only (память не зависит от размера листа)."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportFormatError("openpyxl is required to import .xlsx files") from e
+    try:
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFormatError(f"not a valid .xlsx file: {e}") from e
+    try:
+        sheet = workbook.active
+        if progress is not None and sheet.max_row:
+            progress.rows_hint = sheet.max_row
+        yield from _iter_mapped(
+            sheet.iter_rows(values_only=True), columns, default_language, progress, excel_serial=True
+        )
+    finally:
+        workbook.close()
+
+
+def iter_jsonl_texts(
+    path: str,
+    encoding: Optional[str] = "utf-8",
+    progress: Optional[ReadProgress] = None,
+    columns: Optional[Dict[str, Union[str, int]]] = None,
+    default_language: Optional[str] = None,
+) -> Iterator[ImportRow]:
+    """
+    Построчно читает JSON Lines / NDJSON. Строка — JSON-объект (текст по ключу "text"
+    или из `columns`), массив (колонки по номеру) или просто JSON-строка с текстом.
+    Неразобранные строки пропускаются и считаются в progress.invalid.
+    """
+    columns = columns or {}
+    default_language = _normalize_language(default_language)
+    text_key = columns.get("text", "text")
+    with _open_text(path, encoding, progress) as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                value = json.loads(line)
+            except json.JSONDecodeError:
+                value = None
+            if isinstance(value, str):
+                value = {"text": value} if text_key == "text" else None
+            if isinstance(value, list):
+                value = dict(enumerate(value))
+            if not isinstance(value, dict):
+                if progress is not None:
+                    progress.invalid += 1
+                logger.debug("JSONL line %d skipped: not an object", line_no)
+                continue
+            text = value.get(text_key)
+            text = str(text).strip() if text is not None and not isinstance(text, (dict, list)) else ""
+            if not text:
+                if progress is not None:
+                    progress.invalid += 1
+                continue
+            language = _normalize_language(value.get(columns["language"])) if "language" in columns else None
+            row = ImportRow(
+                text,
+                _row_date(value.get(columns["date"]), progress) if "date" in columns else None,
+                language or default_language,
+            )
+            if progress is not None:
+                progress.rows += 1
+            yield row
+    if progress is not None:
+        progress.finished = True
+
+
+def iter_import_texts(
+    path: str,
+    fmt: str = "csv",
+    delimiter: str = ",",
+    encoding: Optional[str] = "utf-8",
+    progress: Optional[ReadProgress] = None,
+    columns: Optional[Dict[str, Union[str, int]]] = None,
+    default_language: Optional[str] = None,
+) -> Iterator[ImportRow]:
+    """
+    Тексты отзывов файла импорта в формате `fmt` (csv, xlsx, jsonl).
+    Ошибки разбора файла (csv.Error, битый лист .xlsx, неверный разделитель...)
+    приходят как ImportFormatError — повтор чтения их не исправит.
+    """
+    if fmt == "xlsx":
+        rows = iter_xlsx_texts(path, progress, columns, default_language)
+    elif fmt == "jsonl":
+        rows = iter_jsonl_texts(path, encoding, progress, columns, default_language)
+    else:
+        rows = iter_csv_texts(path, delimiter, encoding, progress, columns, default_language)
+    return _format_errors(rows, fmt)
+
+
+def _format_errors(rows: Iterator[ImportRow], fmt: str) -> Iterator[ImportRow]:
+    try:
+        yield from rows
+    except (ImportFormatError, OSError):
+        # OSError — сбой чтения с диска (или файла уже нет), а не содержимое файла
+        raise
+    except Exception as e:
+        raise ImportFormatError(f"{fmt} file cannot be read: {e!r}") from e
+
+
+def file_read_progress(path: str) -> ReadProgress:
+    return ReadProgress(os.path.getsize(path))
@@ -0,0 +1,438 @@
+"""
+Очередь заданий импорта на Postgres.
+
+Одно задание (import_jobs) на пакет импорта. Воркер сначала режет спул-файл
+на чанки (import_job_chunks), затем воркеры параллельно забирают чанки через
+SELECT ... FOR UPDATE SKIP LOCKED. Результаты чанка и отметка о его завершении
+фиксируются одной транзакцией, поэтому после падения воркера уже обработанные
+чанки не повторяются, а брошенные возвращаются в работу по истечении аренды.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from ..models.db_models import ImportJob
+from .dedup import BatchDeduplicator, DedupStats
+from .import_progress import update_batch_progress
+from .ingest import (
+    ImportFormatError,
+    ImportRow,
+    file_read_progress,
+    iter_import_texts,
+    remove_spooled_file,
+    row_from_json,
+    row_to_json,
+)
+from .pipeline import iterate_blocks
+from .prefilter import PrefilterStats, prefilter_texts
+from .response_cache import bump_data_generation, bump_data_generation_after_write
+from .review_writer import PendingReview, write_reviews
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+class ClaimedJob:
+    def __init__(self, row) -> None:
+        self.id = row.id
+        self.batch_id = row.batch_id
+        self.source_path = row.source_path
+        self.delimiter = row.delimiter
+        self.encoding = row.encoding
+        self.chunk_size = row.chunk_size
+        self.options: dict = row.options or {}
+
+
+class ClaimedChunk:
+    def __init__(self, row) -> None:
+        self.id = row.id
+        self.job_id = row.job_id
+        self.batch_id = row.batch_id
+        self.chunk_index = row.chunk_index
+        # строки с датой/языком хранятся объектами (ingest.row_to_json)
+        self.texts: List[ImportRow] = [row_from_json(value) for value in row.texts or []]
+        self.options: dict = row.options or {}
+
+
+async def enqueue_import_job(
+    db: AsyncSession,
+    batch_id: int,
+    source_path: str,
+    delimiter: str,
+    encoding: str,
+    chunk_size: int,
+    options: Optional[dict] = None,
+) -> ImportJob:
+    job = ImportJob(
+        batch_id=batch_id,
+        source_path=source_path,
+        delimiter=delimiter or ",",
+        encoding=encoding or "utf-8",
+        chunk_size=chunk_size,
+        options=options,
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def claim_job_for_split(session_maker: sessionmaker, worker_id: str, lease_seconds: float) -> Optional[ClaimedJob]:
+    """Захватить новое задание (или брошенное на этапе нарезки) для нарезки на чанки."""
+    async with session_maker() as session:
+        async with session.begin():
+            res = await session.execute(
+                text(
+                    """
+                    UPDATE import_jobs j
+                    SET status = 'splitting', worker_id = :worker,
+                        locked_until = now() + make_interval(secs => :lease), updated_at = now()
+                    FROM (
+                        SELECT id FROM import_jobs
+                        WHERE status = 'pending'
+                           OR (status = 'splitting' AND locked_until < now())
+                        ORDER BY id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    ) picked
+                    WHERE j.id = picked.id
+                    RETURNING j.id, j.batch_id, j.source_path, j.delimiter, j.encoding, j.chunk_size, j.options
+                    """
+                ),
+                {"worker": worker_id, "lease": lease_seconds},
+            )
+            row = res.fetchone()
+    return ClaimedJob(row) if row else None
+
+
+async def split_job(session_maker: sessionmaker, job: ClaimedJob, worker_id: str, lease_seconds: float) -> int:
+    """
+    Нарезает файл задания на чанки. Идемпотентно: при повторе после падения
+    уже созданные чанки не дублируются (ON CONFLICT по (job_id, chunk_index)).
+    Предфильтр (delete_spam, normalize_text) и поиск дубликатов внутри пакета
+    (delete_duplicates) выполняются здесь же — они детерминированы, поэтому
+    повтор нарезки даёт те же чанки.
+    Возвращает количество чанков.
+    """
+    chunk_index = 0
+    total_rows = 0
+    read_skipped: Dict[str, int] = {}
+    read_warnings: Dict[str, int] = {}
+    prefilter_stats = PrefilterStats()
+    dedup_stats = DedupStats()
+    dedup = BatchDeduplicator(dedup_stats) if job.options.get("delete_duplicates") else None
+    if job.source_path:
+        chunk: List[ImportRow] = []
+        try:
+            read_progress = file_read_progress(job.source_path)
+            texts = iter_import_texts(
+                job.source_path,
+                job.options.get("format", "csv"),
+                job.delimiter,
+                job.encoding,
+                read_progress,
+                columns=job.options.get("columns"),
+                default_language=job.options.get("language"),
+            )
+            if job.options.get("delete_spam") or job.options.get("normalize_text"):
+                texts = prefilter_texts(
+                    texts,
+                    prefilter_stats,
+                    drop_spam=job.options.get("delete_spam"),
+                    normalize=job.options.get("normalize_text"),
+                )
+            # чтение файла, предфильтр и хэши дубликатов — в отдельном потоке, блоками
+            async for block in iterate_blocks(texts, job.chunk_size):
+                if dedup is not None:
+                    block = await asyncio.to_thread(dedup.filter_block, block)
+                for row in block:
+                    chunk.append(row)
+                    if len(chunk) >= job.chunk_size:
+                        await _insert_chunk(session_maker, job, chunk_index, chunk, worker_id, lease_seconds)
+                        chunk_index += 1
+                        chunk = []
+            if chunk:
+                await _insert_chunk(session_maker, job, chunk_index, chunk, worker_id, lease_seconds)
+                chunk_index += 1
+            # неразобранные строки файла тоже входят в итог пакета (как отброшенные)
+            total_rows = read_progress.rows + read_progress.invalid
+            read_skipped = read_progress.reasons()
+            read_warnings = read_progress.warnings()
+        except FileNotFoundError:
+            await _fail_job(session_maker, job.id, job.batch_id, f"Source file not found: {job.source_path}")
+            return 0
+        except ImportFormatError as e:
+            # файл не разбирается — повтор нарезки ничего не изменит
+            await _fail_job(session_maker, job.id, job.batch_id, str(e))
+            remove_spooled_file(job.source_path)
+            return 0
+        except (SQLAlchemyError, OSError):
+            # сбой БД или диска — задание вернётся в очередь по истечении аренды
+            raise
+        except Exception as e:
+            # прочие ошибки — от разбора файла: повтор нарезки упал бы так же у следующего воркера
+            logger.exception("Splitting job %s failed", job.id)
+            await _fail_job(session_maker, job.id, job.batch_id, repr(e))
+            remove_spooled_file(job.source_path)
+            return 0
+
+    async with session_maker() as session:
+        async with session.begin():
+            await session.execute(
+                text(
+                    """
+                    UPDATE import_jobs
+                    SET status = 'ready', total_chunks = :n, source_path = NULL,
+                        locked_until = NULL, updated_at = now()
+                    WHERE id = :job
+                    """
+                ),
+                {"job": job.id, "n": chunk_index},
+            )
+            await update_batch_progress(
+                session,
+                job.batch_id,
+                skipped={**read_skipped, **prefilter_stats.reasons(), **dedup_stats.reasons()},
+                warnings=read_warnings,
+                total_rows=total_rows,
+                total_is_estimate=False,
+            )
+    if job.source_path:
+        remove_spooled_file(job.source_path)
+    await finish_job_if_complete(session_maker, job.id)
+    return chunk_index
+
+
+async def _insert_chunk(
+    session_maker: sessionmaker,
+    job: ClaimedJob,
+    chunk_index: int,
+    texts: List[ImportRow],
+    worker_id: str,
+    lease_seconds: float,
+) -> None:
+    async with session_maker() as session:
+        async with session.begin():
+            await session.execute(
+                text(
+                    """
+                    INSERT INTO import_job_chunks (job_id, chunk_index, texts)
+                    VALUES (:job, :idx, CAST(:texts AS jsonb))
+                    ON CONFLICT (job_id, chunk_index) DO NOTHING
+                    """
+                ),
+                {
+                    "job": job.id,
+                    "idx": chunk_index,
+                    "texts": json.dumps([row_to_json(t) for t in texts], ensure_ascii=False),
+                },
+            )
+            # продлеваем аренду задания, пока идёт нарезка
+            await session.execute(
+                text(
+                    """
+                    UPDATE import_jobs SET locked_until = now() + make_interval(secs => :lease)
+                    WHERE id = :job AND worker_id = :worker
+                    """
+                ),
+                {"job": job.id, "worker": worker_id, "lease": lease_seconds},
+            )
+
+
+async def claim_chunk(
+    session_maker: sessionmaker,
+    worker_id: str,
+    lease_seconds: float,
+    max_attempts: int,
+) -> Optional[ClaimedChunk]:
+    """Захватить следующий необработанный (или брошенный) чанк."""
+    async with session_maker() as session:
+        async with session.begin():
+            # чанки, исчерпавшие попытки, больше не выдаём
+            reaped = await session.execute(
+                text(
+                    """
+                    UPDATE import_job_chunks c
+                    SET status = 'failed', error = COALESCE(c.error, 'lease expired'), updated_at = now()
+                    FROM import_jobs j
+                    WHERE j.id = c.job_id
+                      AND c.status = 'running' AND c.locked_until < now() AND c.attempts >= :max_attempts
+                    RETURNING c.job_id, j.batch_id, jsonb_array_length(COALESCE(c.texts, CAST('[]' AS jsonb))) AS n_rows
+                    """
+                ),
+                {"max_attempts": max_attempts},
+            )
+            reaped_jobs = set()
+            for r in reaped.fetchall():
+                reaped_jobs.add(r.job_id)
+                await update_batch_progress(session, r.batch_id, failed_delta=r.n_rows)
+            res = await session.execute(
+                text(
+                    """
+                    UPDATE import_job_chunks c
+                    SET status = 'running', worker_id = :worker, attempts = c.attempts + 1,
+                        locked_until = now() + make_interval(secs => :lease), updated_at = now()
+                    FROM (
+                        SELECT id FROM import_job_chunks
+                        WHERE status = 'pending'
+                           OR (status = 'running' AND locked_until < now())
+                        ORDER BY job_id, chunk_index
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    ) picked, import_jobs j
+                    WHERE c.id = picked.id AND j.id = c.job_id
+                    RETURNING c.id, c.job_id, j.batch_id, c.chunk_index, c.texts, j.options
+                    """
+                ),
+                {"worker": worker_id, "lease": lease_seconds},
+            )
+            row = res.fetchone()
+            if row is not None:
+                await update_batch_progress(session, row.batch_id, status="running")
+    for job_id in reaped_jobs:
+        await finish_job_if_complete(session_maker, job_id)
+    return ClaimedChunk(row) if row else None
+
+
+async def extend_chunk_lease(session_maker: sessionmaker, chunk_id: int, worker_id: str, lease_seconds: float) -> bool:
+    async with session_maker() as session:
+        async with session.begin():
+            res = await session.execute(
+                text(
+                    """
+                    UPDATE import_job_chunks
+                    SET locked_until = now() + make_interval(secs => :lease)
+                    WHERE id = :id AND worker_id = :worker AND status = 'running'
+                    """
+                ),
+                {"id": chunk_id, "worker": worker_id, "lease": lease_seconds},
+            )
+            return res.rowcount > 0
+
+
+async def complete_chunk(
+    session_maker: sessionmaker,
+    chunk: ClaimedChunk,
+    worker_id: str,
+    rows: List[PendingReview],
+    skipped: Optional[Dict[str, int]] = None,
+    tiers: Optional[Dict[str, int]] = None,
+) -> bool:
+    """
+    Атомарно записывает результаты чанка и помечает его выполненным.
+    `skipped` — строки чанка, отброшенные до анализа, по причинам (уже импортированные ранее),
+    `tiers` — проанализированные строки по уровням анализа.
+    Если аренду чанка уже перехватил другой воркер — ничего не пишет и возвращает False.
+    """
+    try:
+        async with session_maker() as session:
+            async with session.begin():
+                res = await session.execute(
+                    text(
+                        """
+                        UPDATE import_job_chunks
+                        SET status = 'done', texts = NULL, locked_until = NULL, error = NULL, updated_at = now()
+                        WHERE id = :id AND worker_id = :worker AND status = 'running'
+                        """
+                    ),
+                    {"id": chunk.id, "worker": worker_id},
+                )
+                if res.rowcount == 0:
+                    raise _LeaseLost()
+                await write_reviews(session, chunk.batch_id, rows)
+                await update_batch_progress(
+                    session, chunk.batch_id, processed_delta=len(rows), skipped=skipped, tiers=tiers
+                )
+    except _LeaseLost:
+        return False
+    if rows:
+        await bump_data_generation_after_write(session_maker)
+    await finish_job_if_complete(session_maker, chunk.job_id)
+    return True
+
+
+async def fail_chunk(
+    session_maker: sessionmaker,
+    chunk: ClaimedChunk,
+    worker_id: str,
+    error: str,
+    max_attempts: int,
+) -> None:
+    """Вернуть чанк в очередь или окончательно пометить неудачным после max_attempts попыток."""
+    async with session_maker() as session:
+        async with session.begin():
+            res = await session.execute(
+                text(
+                    """
+                    UPDATE import_job_chunks
+                    SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+                        locked_until = NULL, error = :error, updated_at = now()
+                    WHERE id = :id AND worker_id = :worker AND status = 'running'
+                    RETURNING status
+                    """
+                ),
+                {"id": chunk.id, "worker": worker_id, "error": error[:2000], "max_attempts": max_attempts},
+            )
+            if res.scalar() == "failed":
+                await update_batch_progress(session, chunk.batch_id, failed_delta=len(chunk.texts))
+    await finish_job_if_complete(session_maker, chunk.job_id)
+
+
+async def _fail_job(session_maker: sessionmaker, job_id: int, batch_id: int, error: str) -> None:
+    async with session_maker() as session:
+        async with session.begin():
+            await session.execute(
+                text(
+                    """
+                    UPDATE import_jobs
+                    SET status = 'failed', error = :error, locked_until = NULL, updated_at = now()
+                    WHERE id = :job
+                    """
+                ),
+                {"job": job_id, "error": error[:2000]},
+            )
+            await update_batch_progress(session, batch_id, status="failed", error=error)
+
+
+async def finish_job_if_complete(session_maker: sessionmaker, job_id: int) -> Optional[str]:
+    """Закрывает задание, если все его чанки обработаны. Возвращает итоговый статус или None."""
+    async with session_maker() as session:
+        async with session.begin():
+            res = await session.execute(
+                text(
+                    """
+                    UPDATE import_jobs j
+                    SET status = CASE
+                            WHEN EXISTS (SELECT 1 FROM import_job_chunks c WHERE c.job_id = j.id AND c.status = 'failed')
+                            THEN 'failed' ELSE 'done' END,
+                        updated_at = now()
+                    WHERE j.id = :job
+                      AND j.status = 'ready'
+                      AND NOT EXISTS (
+                          SELECT 1 FROM import_job_chunks c
+                          WHERE c.job_id = j.id AND c.status IN ('pending','running')
+                      )
+                    RETURNING j.status, j.batch_id
+                    """
+                ),
+                {"job": job_id},
+            )
+            row = res.fetchone()
+            status = row.status if row else None
+            if row is not None:
+                await update_batch_progress(session, row.batch_id, status=row.status)
+                # чанки увеличивают поколение не чаще интервала — в конце задания обязательно
+                await bump_data_generation(session)
+        if status is not None:
+            logger.info("Import job %s finished with status %s", job_id, status)
+    return status
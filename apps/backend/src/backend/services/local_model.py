@@ -0,0 +1,304 @@
+"""
+Локальная модель анализа отзывов — быстрый уровень перед LLM (см. tiered_analysis).
+
+Линейные модели по символьным n-граммам, хэшированным в `dim` признаков
+(crc32, как в предфильтре): softmax по трём тональностям и независимые
+логистические регрессии по темам из фиксированного списка REVIEW_THEMES.
+Пакет текстов считается одной разреженной операцией NumPy.
+
+Модель даёт только общую тональность; темам отзыва присваивается она же.
+Уверенность предсказания — минимум из вероятности выбранной тональности и
+max(p, 1 - p) по каждой теме, т.е. модель «уверена», только если уверена во всём.
+
+Обучение на уже проанализированных LLM отзывах:
+
+    python -m backend.services.local_model export --out reviews.jsonl --limit 200000
+    python -m backend.services.local_model train --data reviews.jsonl --out local_model.npz
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import zlib
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from .analysis import REVIEW_THEMES
+from .review_writer import SENTIMENTS
+from .themes import canonical_theme
+
+logger = logging.getLogger(__name__)
+
+
+class LocalPrediction:
+    def __init__(self, result: dict, confidence: float) -> None:
+        # тот же формат, что и ответ LLM: {"review_analysis": {...}}
+        self.result = result
+        self.confidence = confidence
+
+
+class LocalReviewModel:
+    def __init__(
+        self,
+        weights: np.ndarray,
+        bias: np.ndarray,
+        themes: List[str],
+        dim: int,
+        ngrams: List[int],
+        version: str = "untrained",
+    ) -> None:
+        # столбцы: сначала SENTIMENTS, затем темы
+        self.weights = weights.astype(np.float32, copy=False)
+        self.bias = bias.astype(np.float32, copy=False)
+        self.themes = themes
+        self.dim = dim
+        self.ngrams = ngrams
+        self.version = version
+
+    @property
+    def model_name(self) -> str:
+        """Имя модели в reviews.model_name: версия меняется с каждым переобучением."""
+        return f"local:{self.version}"
+
+    @classmethod
+    def load(cls, path: str) -> "LocalReviewModel":
+        with open(path, "rb") as f:
+            version = hashlib.sha256(f.read()).hexdigest()[:12]
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(
+                weights=data["weights"],
+                bias=data["bias"],
+                themes=list(meta["themes"]),
+                dim=int(meta["dim"]),
+                ngrams=[int(n) for n in meta["ngrams"]],
+                version=version,
+            )
+
+    def save(self, path: str) -> None:
+        meta = {"themes": self.themes, "dim": self.dim, "ngrams": self.ngrams}
+        with open(path, "wb") as f:
+            np.savez_compressed(f, weights=self.weights, bias=self.bias, meta=np.array(json.dumps(meta)))
+
+    def features(self, text: str) -> List[int]:
+        padded = f" {text.lower()} "
+        return sorted(
+            {
+                zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dim
+                for n in self.ngrams
+                for i in range(len(padded) - n + 1)
+            }
+        )
+
+    def _design(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Разреженная матрица признаков пакета: (номер строки, номер признака, вес) для ненулевых."""
+        per_text = [self.features(t) for t in texts]
+        counts = np.fromiter((len(f) for f in per_text), dtype=np.int64, count=len(per_text))
+        rows = np.repeat(np.arange(len(per_text)), counts)
+        cols = np.fromiter((f for fs in per_text for f in fs), dtype=np.int64, count=int(counts.sum()))
+        # бинарные признаки, нормированные по L2
+        scale = (1.0 / np.sqrt(np.maximum(counts, 1))).astype(np.float32)
+        return rows, cols, scale[rows]
+
+    def _scores(self, n: int, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> np.ndarray:
+        scores = np.zeros((n, self.weights.shape[1]), dtype=np.float32)
+        np.add.at(scores, rows, self.weights[cols] * values[:, None])
+        return scores + self.bias
+
+    @staticmethod
+    def _probabilities(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        k = len(SENTIMENTS)
+        sentiment = scores[:, :k] - scores[:, :k].max(axis=1, keepdims=True)
+        sentiment = np.exp(sentiment)
+        sentiment /= sentiment.sum(axis=1, keepdims=True)
+        themes = 1.0 / (1.0 + np.exp(-np.clip(scores[:, k:], -30.0, 30.0)))
+        return sentiment, themes
+
+    def predict_batch(self, texts: List[str]) -> List[LocalPrediction]:
+        if not texts:
+            return []
+        sentiment, themes = self._probabilities(self._scores(len(texts), *self._design(texts)))
+        chosen = sentiment.argmax(axis=1)
+        confidence = sentiment.max(axis=1)
+        if themes.shape[1]:
+            confidence = np.minimum(confidence, np.maximum(themes, 1.0 - themes).min(axis=1))
+
+        predictions = []
+        for i in range(len(texts)):
+            overall = SENTIMENTS[chosen[i]]
+            key_themes = [
+                {"theme": self.themes[j], "sentiment": overall} for j in np.flatnonzero(themes[i] >= 0.5)
+            ]
+            result = {
+                "review_analysis": {"overall_sentiment": overall, "key_themes": key_themes},
+                "model": self.model_name,
+            }
+            predictions.append(LocalPrediction(result, float(confidence[i])))
+        return predictions
+
+    @classmethod
+    def train(
+        cls,
+        samples: List[Tuple[str, str, List[str]]],
+        themes: Iterable[str] = REVIEW_THEMES,
+        dim: int = 1 << 16,
+        ngrams: Iterable[int] = (2, 3, 4),
+        epochs: int = 10,
+        lr: float = 2.0,
+        l2: float = 1e-6,
+        batch_size: int = 256,
+    ) -> "LocalReviewModel":
+        """
+        Мини-пакетный градиентный спуск по кросс-энтропии.
+        `samples` — (текст, общая тональность, темы); темы вне списка игнорируются.
+        """
+        themes = [canonical_theme(t) for t in themes]
+        theme_index = {t: j for j, t in enumerate(themes)}
+        k = len(SENTIMENTS)
+        model = cls(
+            np.zeros((dim, k + len(themes)), dtype=np.float32),
+            np.zeros(k + len(themes), dtype=np.float32),
+            themes,
+            dim,
+            list(ngrams),
+        )
+
+        texts = [text for text, _, _ in samples]
+        labels = np.zeros((len(samples), k + len(themes)), dtype=np.float32)
+        for i, (_, sentiment, sample_themes) in enumerate(samples):
+            labels[i, SENTIMENTS.index(sentiment)] = 1.0
+            for name in sample_themes:
+                j = theme_index.get(canonical_theme(name))
+                if j is not None:
+                    labels[i, k + j] = 1.0
+
+        rng = np.random.default_rng(0)
+        for epoch in range(epochs):
+            order = rng.permutation(len(samples))
+            loss = 0.0
+            for start in range(0, len(order), batch_size):
+                idx = order[start:start + batch_size]
+                rows, cols, values = model._design([texts[i] for i in idx])
+                sentiment, theme_p = model._probabilities(model._scores(len(idx), rows, cols, values))
+                probs = np.concatenate([sentiment, theme_p], axis=1)
+                y = labels[idx]
+                loss -= float(np.log(np.maximum((sentiment * y[:, :k]).sum(axis=1), 1e-12)).sum())
+                loss -= float(
+                    (y[:, k:] * np.log(np.maximum(theme_p, 1e-12))
+                     + (1 - y[:, k:]) * np.log(np.maximum(1 - theme_p, 1e-12))).sum()
+                )
+                # градиент кросс-энтропии и softmax, и сигмоид по логитам — (p - y)
+                grad = (probs - y) / len(idx)
+                touched = np.unique(cols)
+                model.weights[touched] *= 1.0 - lr * l2
+                np.add.at(model.weights, cols, -lr * grad[rows] * values[:, None])
+                model.bias -= lr * grad.sum(axis=0)
+            logger.info("Local model epoch %d: loss %.4f", epoch + 1, loss / max(1, len(samples)))
+        return model
+
+
+def _read_samples(path: str) -> List[Tuple[str, str, List[str]]]:
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get("sentiment") in SENTIMENTS and row.get("text"):
+                samples.append((row["text"], row["sentiment"], list(row.get("themes") or [])))
+    return samples
+
+
+async def _export_samples(path: str, limit: int) -> int:
+    """Выгрузить размеченные LLM отзывы (текст, тональность, темы) в JSONL."""
+    from sqlalchemy import text
+
+    from ..config import get_settings
+    from ..core.db import get_engine
+
+    engine = get_engine(get_settings().database_url)
+    written = 0
+    try:
+        async with engine.connect() as conn:
+            res = await conn.stream(
+                text(
+                    """
+                    SELECT r.raw_text, r.overall_sentiment,
+                           array_remove(array_agg(th.name), NULL) AS themes
+                    FROM (
+                        SELECT id, raw_text, overall_sentiment FROM reviews
+                        WHERE overall_sentiment IS NOT NULL
+                          -- только разметка LLM: на собственных предсказаниях модель не учится
+                          AND (model_name IS NULL OR model_name NOT LIKE 'local:%')
+                        ORDER BY id DESC
+                        LIMIT :limit
+                    ) r
+                    LEFT JOIN review_themes rt ON rt.review_id = r.id
+                    LEFT JOIN themes th ON th.id = rt.theme_id
+                    GROUP BY r.id, r.raw_text, r.overall_sentiment
+                    """
+                ),
+                {"limit": limit},
+            )
+            with open(path, "w", encoding="utf-8") as f:
+                async for row in res:
+                    f.write(json.dumps({"text": row[0], "sentiment": row[1], "themes": row[2]}, ensure_ascii=False))
+                    f.write("\n")
+                    written += 1
+    finally:
+        await engine.dispose()
+    return written
+
+
+def _evaluate(model: LocalReviewModel, samples: List[Tuple[str, str, List[str]]]) -> Dict[str, float]:
+    """Доля уверенных предсказаний и точность тональности среди них — по порогам."""
+    predictions = model.predict_batch([text for text, _, _ in samples])
+    report = {}
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.9, 0.95):
+        confident = [
+            (p, s) for p, (_, s, _) in zip(predictions, samples) if p.confidence >= threshold
+        ]
+        correct = sum(1 for p, s in confident if p.result["review_analysis"]["overall_sentiment"] == s)
+        report[f"{threshold:.2f}"] = {
+            "local_share": round(len(confident) / max(1, len(samples)), 4),
+            "sentiment_accuracy": round(correct / len(confident), 4) if confident else None,
+        }
+    return report
+
+
+def main() -> None:
+    from ..core.logging import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(prog="python -m backend.services.local_model")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="выгрузить размеченные LLM отзывы из БД в JSONL")
+    export.add_argument("--out", required=True)
+    export.add_argument("--limit", type=int, default=200_000)
+    train = sub.add_parser("train", help="обучить модель на JSONL {text, sentiment, themes}")
+    train.add_argument("--data", required=True)
+    train.add_argument("--out", required=True)
+    train.add_argument("--epochs", type=int, default=10)
+    train.add_argument("--lr", type=float, default=2.0)
+    train.add_argument("--holdout", type=float, default=0.1, help="доля выборки для оценки порогов")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        written = asyncio.run(_export_samples(args.out, args.limit))
+        print(f"exported {written} reviews to {args.out}")
+        return
+
+    samples = _read_samples(args.data)
+    holdout = int(len(samples) * args.holdout)
+    model = LocalReviewModel.train(samples[holdout:], epochs=args.epochs, lr=args.lr)
+    model.save(args.out)
+    print(f"saved model to {args.out}")
+    if holdout:
+        print(json.dumps(_evaluate(model, samples[:holdout]), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
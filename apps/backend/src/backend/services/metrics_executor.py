@@ -0,0 +1,47 @@
+"""
+Параллельное выполнение независимых запросов метрик.
+
+Одна AsyncSession выполняет запросы строго по очереди, поэтому каждая метрика
+получает собственную сессию (и соединение) из пула. Число одновременно занятых
+соединений на один запрос ограничено METRICS_MAX_CONCURRENCY, чтобы один
+эндпоинт не выбирал весь пул.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import get_settings
+from ..core.db import get_session
+
+MetricCall = Callable[[AsyncSession], Awaitable[Any]]
+
+
+async def gather_metrics(*calls: MetricCall, max_concurrency: Optional[int] = None) -> List[Any]:
+    """
+    Выполнить `calls` (функции от сессии) параллельно и вернуть результаты в том же порядке.
+    При ошибке в одной метрике остальные отменяются, а ошибка пробрасывается.
+    """
+    limit = max_concurrency or get_settings().metrics_max_concurrency
+    if limit <= 1 or len(calls) <= 1:
+        # параллелить нечего — не занимаем лишние соединения
+        async with get_session()() as session:
+            return [await call(session) for call in calls]
+
+    session_maker = get_session()
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(call: MetricCall) -> Any:
+        async with semaphore:
+            async with session_maker() as session:
+                return await call(session)
+
+    tasks = [asyncio.create_task(run(call)) for call in calls]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
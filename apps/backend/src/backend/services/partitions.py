@@ -0,0 +1,278 @@
+"""
+Помесячные секции reviews и review_themes (REVIEWS_PARTITIONED).
+
+Секции обеих таблиц создаются парами с одинаковыми границами (месяц по UTC),
+поэтому темы всегда лежат в том же месяце, что и их отзыв. Строки вне созданных
+секций попадают в секции DEFAULT и при следующем обслуживании переносятся
+в собственный месяц.
+
+Старые месяцы отсоединяются (DETACH) и при желании переносятся в отдельную схему:
+после этого их можно выгрузить pg_dump и удалить. Суточные агрегаты за
+отсоединённые дни удаляются в той же транзакции, чтобы метрики совпадали с таблицами,
+а с ними и хэши текстов (review_hashes) — иначе эти тексты не импортировались бы снова.
+
+    python -m backend.services.partitions ensure
+    python -m backend.services.partitions list
+    python -m backend.services.partitions detach --before 2024-01 --archive-schema archive
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from ..config import get_settings
+from .response_cache import bump_data_generation
+
+logger = logging.getLogger(__name__)
+
+# дочерние таблицы раньше родительских: review_themes ссылается на reviews
+_TABLES = ("review_themes", "reviews")
+_PARTITION_NAME = re.compile(r"^reviews_p(\d{4})(\d{2})$")
+
+
+def _month_start(value: datetime) -> datetime:
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    res = await conn.execute(
+        text(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table p
+                JOIN pg_class c ON c.oid = p.partrelid
+                WHERE c.relname = 'reviews' AND c.relnamespace = to_regnamespace(current_schema())
+            )
+            """
+        )
+    )
+    return bool(res.scalar())
+
+
+async def _exists(conn: AsyncConnection, name: str) -> bool:
+    res = await conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+    return bool(res.scalar())
+
+
+async def _months_in_default(conn: AsyncConnection) -> List[datetime]:
+    res = await conn.execute(
+        text(
+            """
+            SELECT DISTINCT date_trunc('month', review_created_at AT TIME ZONE 'UTC')
+            FROM reviews_default
+            """
+        )
+    )
+    return [row[0].replace(tzinfo=timezone.utc) for row in res.fetchall()]
+
+
+async def _create_month(conn: AsyncConnection, month: datetime) -> None:
+    """Создать секции месяца; если его строки уже лежат в DEFAULT — перенести их."""
+    lo, hi = month, _add_months(month, 1)
+    bounds = {"lo": lo, "hi": hi}
+    res = await conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM reviews_default WHERE review_created_at >= :lo AND review_created_at < :hi)"),
+        bounds,
+    )
+    in_default = bool(res.scalar())
+
+    for table in reversed(_TABLES):  # reviews раньше review_themes — из-за внешнего ключа при ATTACH
+        name = _partition_name(table, month)
+        if not in_default:
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+                )
+            )
+            continue
+        # Новая секция не создастся, пока DEFAULT содержит её строки: переносим их через отдельную таблицу
+        await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        await conn.execute(
+            text(
+                f"INSERT INTO {name} SELECT * FROM {table}_default "
+                "WHERE review_created_at >= :lo AND review_created_at < :hi"
+            ),
+            bounds,
+        )
+
+    if in_default:
+        for table in _TABLES:
+            await conn.execute(
+                text(f"DELETE FROM {table}_default WHERE review_created_at >= :lo AND review_created_at < :hi"),
+                bounds,
+            )
+        for table in reversed(_TABLES):
+            await conn.execute(
+                text(
+                    f"ALTER TABLE {table} ATTACH PARTITION {_partition_name(table, month)} "
+                    f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+                )
+            )
+        logger.info("Moved %s out of the default partitions", _partition_name("reviews", month))
+
+
+async def ensure_partitions(engine: AsyncEngine, months_ahead: Optional[int] = None) -> List[str]:
+    """
+    Создать секции DEFAULT, текущего месяца и `months_ahead` следующих, а также месяцев,
+    чьи строки попали в DEFAULT. Возвращает имена созданных секций reviews.
+    """
+    if months_ahead is None:
+        months_ahead = get_settings().partitions_months_ahead
+
+    async with engine.begin() as conn:
+        if not await is_partitioned(conn):
+            logger.warning("REVIEWS_PARTITIONED is set, but the reviews table is not partitioned; skipping")
+            return []
+        for table in reversed(_TABLES):
+            await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+        current = _month_start(datetime.now(timezone.utc))
+        months = {_add_months(current, n) for n in range(months_ahead + 1)}
+        months.update(await _months_in_default(conn))
+
+    created = []
+    for month in sorted(months):
+        # по транзакции на месяц: перенос из DEFAULT держит блокировки недолго
+        async with engine.begin() as conn:
+            if await _exists(conn, _partition_name("reviews", month)):
+                continue
+            await _create_month(conn, month)
+            created.append(_partition_name("reviews", month))
+    if created:
+        logger.info("Created partitions: %s", ", ".join(created))
+    return created
+
+
+async def list_partitions(engine: AsyncEngine) -> List[dict]:
+    async with engine.connect() as conn:
+        res = await conn.execute(
+            text(
+                """
+                SELECT c.relname AS name, p.relname AS parent,
+                       pg_get_expr(c.relpartbound, c.oid) AS bounds,
+                       c.reltuples::bigint AS estimated_rows,
+                       pg_total_relation_size(c.oid) AS total_bytes
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname IN ('reviews', 'review_themes')
+                  AND p.relnamespace = to_regnamespace(current_schema())
+                ORDER BY p.relname, c.relname
+                """
+            )
+        )
+        return [dict(row._mapping) for row in res.fetchall()]
+
+
+async def detach_partitions_before(
+    engine: AsyncEngine,
+    before: datetime,
+    archive_schema: Optional[str] = None,
+) -> List[str]:
+    """
+    Отсоединить месячные секции целиком раньше `before` (обе таблицы) и удалить
+    суточные агрегаты за эти дни. С `archive_schema` таблицы переносятся в эту схему.
+    Возвращает имена отсоединённых секций reviews.
+    """
+    before = _month_start(before)
+    async with engine.connect() as conn:
+        res = await conn.execute(
+            text(
+                """
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = 'reviews' AND p.relnamespace = to_regnamespace(current_schema())
+                """
+            )
+        )
+        months = []
+        for (name,) in res.fetchall():
+            match = _PARTITION_NAME.match(name)
+            if match:
+                month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+                if month < before:
+                    months.append(month)
+
+    detached = []
+    for month in sorted(months):
+        async with engine.begin() as conn:
+            if archive_schema:
+                await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+            for table in _TABLES:
+                name = _partition_name(table, month)
+                await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                if table == "reviews":
+                    # хэши отсоединённых отзывов больше не должны отсеивать их тексты как дубликаты
+                    await conn.execute(
+                        text(f"DELETE FROM review_hashes h USING {name} r WHERE h.review_id = r.id")
+                    )
+                if table == "review_themes":
+                    # отсоединённая секция сохраняет внешний ключ на reviews и не дала бы отсоединить отзывы
+                    res = await conn.execute(
+                        text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name) AND contype = 'f'"),
+                        {"name": name},
+                    )
+                    for (constraint,) in res.fetchall():
+                        await conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+                if archive_schema:
+                    await conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {archive_schema}"))
+            days = {"lo": month.date(), "hi": _add_months(month, 1).date()}
+            await conn.execute(text("DELETE FROM review_daily_rollup WHERE day >= :lo AND day < :hi"), days)
+            await conn.execute(text("DELETE FROM theme_daily_rollup WHERE day >= :lo AND day < :hi"), days)
+            await bump_data_generation(conn)
+        detached.append(_partition_name("reviews", month))
+        logger.info("Detached %s", _partition_name("reviews", month))
+    return detached
+
+
+def main() -> None:
+    from ..core.db import get_engine
+    from ..core.logging import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(prog="python -m backend.services.partitions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ensure = sub.add_parser("ensure", help="создать недостающие секции")
+    ensure.add_argument("--months-ahead", type=int, default=None)
+    sub.add_parser("list", help="показать секции")
+    detach = sub.add_parser("detach", help="отсоединить месяцы раньше --before")
+    detach.add_argument("--before", required=True, help="YYYY-MM")
+    detach.add_argument("--archive-schema", default=None)
+    args = parser.parse_args()
+
+    async def run() -> None:
+        engine = get_engine(get_settings().database_url)
+        try:
+            if args.command == "ensure":
+                print(await ensure_partitions(engine, args.months_ahead))
+            elif args.command == "list":
+                for row in await list_partitions(engine):
+                    print(row)
+            else:
+                before = datetime.strptime(args.before, "%Y-%m").replace(tzinfo=timezone.utc)
+                print(await detach_partitions_before(engine, before, args.archive_schema))
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Конвейер параллельного анализа отзывов.
+
+Несколько отзывов одновременно находятся в LLM, но результаты отдаются
+строго в порядке входных строк, поэтому запись в БД остаётся последовательной.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Set, Tuple, TypeVar, Union
+
+from ..config import get_settings
+from .analysis import get_analysis_limiter
+
+logger = logging.getLogger(__name__)
+
+# элемент входа: строка импорта (ingest.ImportRow) или текст отзыва
+T = TypeVar("T")
+
+
+class BatchThroughput:
+    """Счётчик пропускной способности для одного пакета импорта."""
+
+    def __init__(self, batch_id: Optional[int] = None) -> None:
+        self.batch_id = batch_id
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "batch_id": self.batch_id,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "elapsed_sec": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 3),
+        }
+
+
+# batch_id -> счётчик текущего/последнего прогона; хранятся последние _THROUGHPUT_KEEP пакетов
+_throughput: "OrderedDict[int, BatchThroughput]" = OrderedDict()
+_THROUGHPUT_KEEP = 100
+
+
+def get_batch_throughput(batch_id: int) -> Optional[BatchThroughput]:
+    return _throughput.get(batch_id)
+
+
+def register_batch_throughput(stats: BatchThroughput) -> BatchThroughput:
+    if stats.batch_id is not None:
+        _throughput.pop(stats.batch_id, None)
+        _throughput[stats.batch_id] = stats
+        # вытесняются самые старые пакеты (уже завершённые: одновременно идёт куда меньше)
+        while len(_throughput) > _THROUGHPUT_KEEP:
+            _throughput.popitem(last=False)
+    return stats
+
+
+def analysis_concurrency() -> int:
+    """
+    Сколько отзывов импорта держать в анализе одновременно: LLM_CONCURRENCY на каждый
+    сервер пула LLM_API_URL, в пакетном режиме — с запасом на полные пакеты.
+    С адаптивным лимитом окно рассчитано на его верхнюю границу, а реальное число
+    запросов к LLM регулирует сам ограничитель.
+    """
+    settings = get_settings()
+    limiter = get_analysis_limiter()
+    requests = limiter.max_limit if limiter is not None else (
+        settings.llm_concurrency * max(1, len(settings.llm_api_urls))
+    )
+    return requests * settings.llm_batch_size
+
+
+async def iterate_blocks(items: Union[Iterable[T], AsyncIterable[T]], size: int) -> AsyncIterator[List[T]]:
+    """
+    Вход блоками по `size` строк. Синхронный вход (чтение и разбор файла) читается
+    в отдельном потоке, чтобы не занимать цикл событий.
+    """
+    if isinstance(items, AsyncIterable):
+        block: List[T] = []
+        async for item in items:
+            block.append(item)
+            if len(block) >= size:
+                yield block
+                block = []
+        if block:
+            yield block
+        return
+    iterator = iter(items)
+    while True:
+        block = await asyncio.to_thread(lambda: list(itertools.islice(iterator, size)))
+        if not block:
+            return
+        yield block
+
+
+async def analyze_in_order(
+    texts: Union[Iterable[T], AsyncIterable[T]],
+    analyze: Callable[[T], Awaitable[dict]],
+    concurrency: int,
+    stats: Optional[BatchThroughput] = None,
+    log_every: int = 100,
+) -> AsyncIterator[Tuple[T, dict]]:
+    """Запускает `analyze` для текстов с ограничением параллелизма.
+
+    - Одновременно выполняется не более `concurrency` вызовов.
+    - Очередь готовых задач ограничена, поэтому чтение входа приостанавливается,
+      пока потребитель не заберёт результаты (backpressure).
+    - Результаты отдаются в порядке входа: (элемент, analysis); элемент (строка импорта
+      или текст) передаётся в `analyze` как есть.
+    - Ошибка анализа одного отзыва не прерывает пакет — вместо результата отдаётся {}.
+    - `texts` может быть и асинхронным итератором (например, после поиска дубликатов).
+    """
+    concurrency = max(1, concurrency)
+    stats = stats or BatchThroughput()
+    semaphore = asyncio.Semaphore(concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    # запущенные задачи, результат которых ещё не отдан потребителю
+    pending: Set["asyncio.Task[dict]"] = set()
+
+    async def run_one(text: T) -> dict:
+        try:
+            return await analyze(text)
+        except Exception as e:
+            stats.failed += 1
+            logger.warning("Review analysis failed: %s", e)
+            return {}
+        finally:
+            stats.in_flight -= 1
+            semaphore.release()
+
+    async def submit(text: T) -> None:
+        await semaphore.acquire()
+        stats.submitted += 1
+        stats.in_flight += 1
+        task = asyncio.create_task(run_one(text))
+        pending.add(task)
+        await queue.put((text, task))
+
+    async def producer() -> None:
+        # синхронный вход (чтение файла) читается блоками в отдельном потоке, как и в iterate_blocks
+        try:
+            async for block in iterate_blocks(texts, concurrency):
+                for text in block:
+                    await submit(text)
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    producer_task = asyncio.create_task(producer())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            text, task = item
+            analysis = await task
+            pending.discard(task)
+            stats.completed += 1
+            if log_every and stats.completed % log_every == 0:
+                logger.info("Batch throughput: %s", stats.as_dict())
+            yield text, analysis
+        # пробрасываем ошибку чтения входа, если она была
+        await producer_task
+    finally:
+        # если потребитель остановился раньше, отменяем чтение входа и ещё не забранные задачи
+        # и дожидаемся их, чтобы ни один вызов analyze не пережил конвейер
+        producer_task.cancel()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(producer_task, *pending, return_exceptions=True)
+        logger.info("Batch finished: %s", stats.as_dict())
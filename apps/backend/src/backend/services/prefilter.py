@@ -0,0 +1,287 @@
+"""
+Дешёвый предварительный фильтр отзывов до LLM-анализа (флаги delete_spam, normalize_text).
+
+Работает только на CPU, чанками строк:
+- нормализация (normalize_text): NFKC, без HTML-тегов, управляющих символов
+  и невидимых пробелов, серии одинаковых символов сокращаются до трёх;
+- эвристики (delete_spam): нет букв (эмодзи, цифры, пунктуация), слишком мало
+  букв, ссылочный спам, бессмыслица из согласных или одного-двух символов;
+- (delete_spam + PREFILTER_MODEL_PATH) логистическая регрессия по хэшированным
+  символьным n-граммам. Модель — JSON с весами, обучается командой
+
+    python -m backend.services.prefilter train --spam spam.txt --ham ham.txt --out prefilter.json
+
+Отброшенные строки учитываются в прогрессе пакета с причиной.
+"""
+
+import argparse
+import asyncio
+import html
+import json
+import logging
+import math
+import random
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Union
+
+from ..config import get_settings
+from .ingest import ImportRow
+from .pipeline import iterate_blocks
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 256
+
+_URL = re.compile(r"(?:https?://|www\.)\S+|\b[\w.-]+\.(?:ru|com|net|org|info|рф|su|io|me|biz|xyz|top|link|site|online)\b", re.I)
+_HTML_TAG = re.compile(r"<[^>]{1,200}>")
+_INVISIBLE = re.compile("[\u200b-\u200f\u2060-\u2064\ufeff\u00ad]")
+_CHAR_RUN = re.compile(r"(.)\1{3,}")
+_WORD = re.compile(r"[^\W\d_]+")
+_VOWELS = set("аеёиоуыэюяaeiouy")
+# правило гласных знает только кириллицу и латиницу: слова других письменностей
+# (греческий, иврит, тайский...) им не проверяются
+_VOWEL_CHECKED_WORD = re.compile(r"[a-zа-яё]+")
+
+
+def normalize_review_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", html.unescape(text))
+    text = _HTML_TAG.sub(" ", text)
+    text = _INVISIBLE.sub("", text)
+    text = "".join(c if unicodedata.category(c)[0] != "C" else " " for c in text)
+    text = _CHAR_RUN.sub(r"\1\1\1", text)
+    return " ".join(text.split())
+
+
+def junk_reason(text: str, min_letters: int) -> Optional[str]:
+    """Причина считать текст мусором по эвристикам или None."""
+    letters = [c for c in text if c.isalpha()]
+    if not letters:
+        return "no_letters"
+    if len(letters) < min_letters:
+        return "too_short"
+
+    urls = _URL.findall(text)
+    if len(urls) >= 2 or (urls and sum(map(len, urls)) * 2 > len(text)):
+        return "links"
+
+    distinct = len(set(c.lower() for c in letters))
+    if (distinct == 1 and len(letters) >= 3) or (distinct <= 2 and len(letters) >= 10):
+        return "gibberish"
+    words = [w.lower() for w in _WORD.findall(text) if len(w) >= 4]
+    words = [w for w in words if _VOWEL_CHECKED_WORD.fullmatch(w)]
+    if words:
+        no_vowels = sum(1 for w in words if not _VOWELS.intersection(w))
+        if no_vowels * 2 > len(words):
+            return "gibberish"
+    return None
+
+
+class SpamClassifier:
+    """
+    Логистическая регрессия по символьным n-граммам, хэшированным в `dim` признаков
+    (crc32 — одинаково во всех процессах). Признаки бинарные, нормированы по L2.
+    """
+
+    def __init__(self, weights: Dict[int, float], bias: float, dim: int, ngrams: List[int], threshold: float) -> None:
+        self.weights = weights
+        self.bias = bias
+        self.dim = dim
+        self.ngrams = ngrams
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, path: str) -> "SpamClassifier":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            weights={int(k): float(v) for k, v in data["weights"].items()},
+            bias=float(data["bias"]),
+            dim=int(data["dim"]),
+            ngrams=[int(n) for n in data["ngrams"]],
+            threshold=float(data.get("threshold", 0.9)),
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "ngrams": self.ngrams,
+                    "bias": self.bias,
+                    "threshold": self.threshold,
+                    "weights": {str(k): round(v, 6) for k, v in self.weights.items() if v},
+                },
+                f,
+            )
+
+    def features(self, text: str) -> List[int]:
+        padded = f" {text.lower()} "
+        return sorted(
+            {
+                zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dim
+                for n in self.ngrams
+                for i in range(len(padded) - n + 1)
+            }
+        )
+
+    def _margin(self, features: List[int]) -> float:
+        if not features:
+            return self.bias
+        scale = 1.0 / math.sqrt(len(features))
+        return self.bias + scale * sum(self.weights.get(f, 0.0) for f in features)
+
+    def spam_probability(self, text: str) -> float:
+        margin = self._margin(self.features(text))
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, margin))))
+
+    def is_spam(self, text: str) -> bool:
+        return self.spam_probability(text) >= self.threshold
+
+    @classmethod
+    def train(
+        cls,
+        spam: List[str],
+        ham: List[str],
+        dim: int = 1 << 18,
+        ngrams: Iterable[int] = (2, 3, 4),
+        epochs: int = 5,
+        lr: float = 0.5,
+        l2: float = 1e-6,
+        threshold: float = 0.9,
+    ) -> "SpamClassifier":
+        """SGD по логистической функции потерь."""
+        model = cls({}, 0.0, dim, list(ngrams), threshold)
+        samples = [(model.features(t), 1.0) for t in spam] + [(model.features(t), 0.0) for t in ham]
+        rng = random.Random(0)
+        for epoch in range(epochs):
+            rng.shuffle(samples)
+            loss = 0.0
+            for features, label in samples:
+                margin = max(-30.0, min(30.0, model._margin(features)))
+                p = 1.0 / (1.0 + math.exp(-margin))
+                loss -= math.log(max(1e-12, p if label else 1.0 - p))
+                grad = p - label
+                scale = 1.0 / math.sqrt(len(features)) if features else 0.0
+                model.bias -= lr * grad
+                for f in features:
+                    w = model.weights.get(f, 0.0)
+                    model.weights[f] = w - lr * (grad * scale + l2 * w)
+            logger.info("Prefilter epoch %d: log loss %.4f", epoch + 1, loss / max(1, len(samples)))
+        return model
+
+
+_classifier: Optional[SpamClassifier] = None
+_classifier_loaded = False
+
+
+def get_spam_classifier() -> Optional[SpamClassifier]:
+    """Модель из PREFILTER_MODEL_PATH (один раз на процесс); None, если не задана или не читается."""
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        _classifier_loaded = True
+        path = get_settings().prefilter_model_path
+        if path:
+            try:
+                _classifier = SpamClassifier.load(path)
+                logger.info("Prefilter model loaded from %s (%d weights)", path, len(_classifier.weights))
+            except Exception as e:
+                logger.warning("Prefilter model %s is not loaded: %s", path, e)
+    return _classifier
+
+
+class PrefilterStats:
+    def __init__(self) -> None:
+        self.seen = 0
+        self.normalized = 0
+        self.dropped: Counter = Counter()
+
+    def reasons(self) -> Dict[str, int]:
+        return dict(self.dropped)
+
+    def as_dict(self) -> dict:
+        return {"seen": self.seen, "normalized": self.normalized, "dropped": sum(self.dropped.values()), **self.dropped}
+
+
+def filter_chunk(rows: List[ImportRow], stats: PrefilterStats, drop_spam: bool, normalize: bool) -> List[ImportRow]:
+    """Нормализовать и/или отфильтровать чанк строк. Пустые после нормализации строки отбрасываются."""
+    min_letters = get_settings().prefilter_min_letters
+    classifier = get_spam_classifier() if drop_spam else None
+    kept = []
+    for row in rows:
+        stats.seen += 1
+        if normalize:
+            normalized = normalize_review_text(row.text)
+            if normalized != row.text:
+                stats.normalized += 1
+                row = row._replace(text=normalized)
+            if not row.text:
+                stats.dropped["empty"] += 1
+                continue
+        if drop_spam:
+            reason = junk_reason(row.text, min_letters)
+            if reason is None and classifier is not None and classifier.is_spam(row.text):
+                reason = "spam_classifier"
+            if reason is not None:
+                stats.dropped[reason] += 1
+                continue
+        kept.append(row)
+    return kept
+
+
+async def prefilter_texts(
+    rows: Union[Iterable[ImportRow], AsyncIterable[ImportRow]],
+    stats: PrefilterStats,
+    drop_spam: bool,
+    normalize: bool,
+) -> AsyncIterator[ImportRow]:
+    """
+    Потоковая обёртка над filter_chunk: читает вход чанками по _CHUNK_SIZE строк.
+    Фильтр чанка (регулярные выражения, классификатор) работает в отдельном потоке,
+    не задерживая цикл событий с запросами API и потоками ответов LLM.
+    """
+    async for chunk in iterate_blocks(rows, _CHUNK_SIZE):
+        for row in await asyncio.to_thread(filter_chunk, chunk, stats, drop_spam, normalize):
+            yield row
+    if stats.dropped or stats.normalized:
+        logger.info("Prefilter: %s", stats.as_dict())
+
+
+def _read_lines(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main() -> None:
+    from ..core.logging import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(prog="python -m backend.services.prefilter")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="обучить модель на файлах по одному тексту в строке")
+    train.add_argument("--spam", required=True)
+    train.add_argument("--ham", required=True)
+    train.add_argument("--out", required=True)
+    train.add_argument("--epochs", type=int, default=5)
+    train.add_argument("--threshold", type=float, default=0.9)
+    score = sub.add_parser("score", help="вероятность спама для строк файла")
+    score.add_argument("--model", required=True)
+    score.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        spam = [normalize_review_text(t) for t in _read_lines(args.spam)]
+        ham = [normalize_review_text(t) for t in _read_lines(args.ham)]
+        model = SpamClassifier.train(spam, ham, epochs=args.epochs, threshold=args.threshold)
+        model.save(args.out)
+        print(f"saved {len(model.weights)} weights to {args.out}")
+    else:
+        model = SpamClassifier.load(args.model)
+        for line in _read_lines(args.path):
+            print(f"{model.spam_probability(normalize_review_text(line)):.3f}\t{line}")
+
+
+if __name__ == "__main__":
+    main()
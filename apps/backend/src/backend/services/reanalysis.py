@@ -0,0 +1,530 @@
+"""
+Фоновый повторный анализ отзывов после смены модели или промпта.
+
+Каждый отзыв помнит, чем он проанализирован (reviews.model_name, prompt_version).
+Задание (reanalysis_jobs) фиксирует целевые версии на момент создания и проходит
+по устаревшим отзывам в порядке id небольшими шагами:
+
+- шаг берёт REANALYSIS_CHUNK_SIZE следующих после курсора устаревших отзывов,
+  анализирует их не более чем REANALYSIS_CONCURRENCY вызовами одновременно и одной
+  транзакцией пишет результаты в reanalysis_results и сдвигает курсор — после падения
+  процесса задание продолжается с места остановки, готовые результаты не теряются;
+- дашборд до конца задания видит прежние данные: когда устаревших отзывов не осталось,
+  все результаты одной транзакцией переносятся в reviews/review_themes вместе с
+  поправкой суточных агрегатов и сбросом кэша ответов.
+
+Воркер импорта (backend.worker) делает шаг, только когда нет работы по импорту,
+с паузой REANALYSIS_PAUSE между шагами. Без очереди импорта:
+
+    python -m backend.services.reanalysis start   # создать задание
+    python -m backend.services.reanalysis run     # выполнить его до конца
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from ..config import get_settings
+from .analysis import REVIEW_ANALYSIS_PROMPT_VERSION
+from .ingest import ImportRow
+from .pipeline import BatchThroughput, analyze_in_order
+from .response_cache import bump_data_generation
+from .review_writer import PendingReview, analysis_model, parse_review_analysis
+from .themes import get_theme_ids
+from .tiered_analysis import TierStats, analyze_row, get_local_model, make_tiered_analyzer
+
+logger = logging.getLogger(__name__)
+
+# произвольная константа для pg_advisory_xact_lock: одно активное задание на БД
+_CREATE_LOCK_KEY = 727_002
+
+# отзыв устарел, если проанализирован другим промптом, другой моделью или не проанализирован вовсе
+_STALE_CONDITION = """
+    (r.prompt_version IS DISTINCT FROM :prompt
+     OR r.model_name IS NULL
+     OR r.model_name NOT IN (:model, COALESCE(CAST(:local_model AS text), :model)))
+"""
+
+_JOB_COLUMNS = """
+    id, status, model_name, local_model_name, prompt_version, cursor_review_id,
+    staged_rows, failed_rows, applied_rows, error, created_at, updated_at, finished_at
+"""
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+class ClaimedReanalysis:
+    def __init__(self, row) -> None:
+        self.id = row.id
+        self.model_name = row.model_name
+        self.local_model_name = row.local_model_name
+        self.prompt_version = row.prompt_version
+        self.cursor_review_id = row.cursor_review_id
+
+    def versions(self) -> dict:
+        return {"model": self.model_name, "local_model": self.local_model_name, "prompt": self.prompt_version}
+
+
+def current_versions() -> dict:
+    """Актуальные модель LLM, локальная модель (если настроена) и версия промпта анализа."""
+    local = get_local_model()
+    return {
+        "model": get_settings().llm_model_name,
+        "local_model": local.model_name if local is not None else None,
+        "prompt": REVIEW_ANALYSIS_PROMPT_VERSION,
+    }
+
+
+async def count_stale_reviews(db: AsyncSession, versions: Optional[dict] = None) -> int:
+    res = await db.execute(
+        text(f"SELECT COUNT(*) FROM reviews r WHERE {_STALE_CONDITION}"),
+        versions or current_versions(),
+    )
+    return int(res.scalar() or 0)
+
+
+async def create_reanalysis_job(db: AsyncSession) -> Tuple[dict, bool]:
+    """
+    Создать задание на текущие версии. Если активное задание уже есть, возвращается оно.
+    Возвращает (задание, создано ли новое).
+    """
+    versions = current_versions()
+    async with db.begin():
+        await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _CREATE_LOCK_KEY})
+        res = await db.execute(
+            text(
+                f"""
+                SELECT {_JOB_COLUMNS} FROM reanalysis_jobs
+                WHERE status IN ('pending','running')
+                ORDER BY id
+                LIMIT 1
+                """
+            )
+        )
+        row = res.fetchone()
+        if row is not None:
+            return dict(row._mapping), False
+        res = await db.execute(
+            text(
+                f"""
+                INSERT INTO reanalysis_jobs (model_name, local_model_name, prompt_version)
+                VALUES (:model, :local_model, :prompt)
+                RETURNING {_JOB_COLUMNS}
+                """
+            ),
+            versions,
+        )
+        return dict(res.fetchone()._mapping), True
+
+
+async def get_reanalysis_job(db: AsyncSession, job_id: int) -> Optional[dict]:
+    res = await db.execute(text(f"SELECT {_JOB_COLUMNS} FROM reanalysis_jobs WHERE id = :id"), {"id": job_id})
+    row = res.fetchone()
+    return dict(row._mapping) if row else None
+
+
+async def cancel_reanalysis_job(db: AsyncSession, job_id: int) -> bool:
+    """Отменить незавершённое задание; накопленные результаты удаляются, данные отзывов не меняются."""
+    async with db.begin():
+        res = await db.execute(
+            text(
+                """
+                UPDATE reanalysis_jobs
+                SET status = 'cancelled', worker_id = NULL, locked_until = NULL,
+                    updated_at = now(), finished_at = now()
+                WHERE id = :id AND status IN ('pending','running')
+                """
+            ),
+            {"id": job_id},
+        )
+        if res.rowcount == 0:
+            return False
+        await db.execute(text("DELETE FROM reanalysis_results WHERE job_id = :id"), {"id": job_id})
+    return True
+
+
+async def claim_reanalysis_job(
+    session_maker: sessionmaker, worker_id: str, lease_seconds: float
+) -> Optional[ClaimedReanalysis]:
+    """Захватить (или продлить своё) активное задание; чужое — только по истечении аренды."""
+    async with session_maker() as session:
+        async with session.begin():
+            res = await session.execute(
+                text(
+                    """
+                    UPDATE reanalysis_jobs j
+                    SET status = 'running', worker_id = :worker,
+                        locked_until = now() + make_interval(secs => :lease), updated_at = now()
+                    FROM (
+                        SELECT id FROM reanalysis_jobs
+                        WHERE status = 'pending'
+                           OR (status = 'running' AND (locked_until < now() OR worker_id = :worker))
+                        ORDER BY id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    ) picked
+                    WHERE j.id = picked.id
+                    RETURNING j.id, j.model_name, j.local_model_name, j.prompt_version, j.cursor_review_id
+                    """
+                ),
+                {"worker": worker_id, "lease": lease_seconds},
+            )
+            row = res.fetchone()
+    return ClaimedReanalysis(row) if row else None
+
+
+async def _extend_lease(session, job: ClaimedReanalysis, worker_id: str, lease_seconds: float) -> bool:
+    res = await session.execute(
+        text(
+            """
+            UPDATE reanalysis_jobs
+            SET locked_until = now() + make_interval(secs => :lease), updated_at = now()
+            WHERE id = :id AND worker_id = :worker AND status = 'running'
+            """
+        ),
+        {"id": job.id, "worker": worker_id, "lease": lease_seconds},
+    )
+    return res.rowcount > 0
+
+
+async def _keep_lease(session_maker: sessionmaker, job: ClaimedReanalysis, worker_id: str, lease_seconds: float) -> None:
+    # продлеваем аренду, пока идёт анализ шага
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        async with session_maker() as session:
+            async with session.begin():
+                if not await _extend_lease(session, job, worker_id, lease_seconds):
+                    return
+
+
+async def _finish_job(
+    session_maker: sessionmaker, job: ClaimedReanalysis, worker_id: str, status: str, error: Optional[str] = None
+) -> None:
+    async with session_maker() as session:
+        async with session.begin():
+            await session.execute(
+                text(
+                    """
+                    UPDATE reanalysis_jobs
+                    SET status = :status, error = :error, locked_until = NULL,
+                        updated_at = now(), finished_at = now()
+                    WHERE id = :id AND worker_id = :worker AND status = 'running'
+                    """
+                ),
+                {"id": job.id, "worker": worker_id, "status": status, "error": error},
+            )
+            await session.execute(text("DELETE FROM reanalysis_results WHERE job_id = :id"), {"id": job.id})
+
+
+async def _next_stale(session_maker: sessionmaker, job: ClaimedReanalysis, limit: int) -> list:
+    async with session_maker() as session:
+        res = await session.execute(
+            text(
+                f"""
+                SELECT r.id, r.raw_text FROM reviews r
+                WHERE r.id > :cursor AND {_STALE_CONDITION}
+                ORDER BY r.id
+                LIMIT :limit
+                """
+            ),
+            {**job.versions(), "cursor": job.cursor_review_id, "limit": limit},
+        )
+        return res.fetchall()
+
+
+async def _analyze(texts: List[str], concurrency: int) -> List[PendingReview]:
+    source = [ImportRow(text) for text in texts]
+    analyze = analyze_row
+    tiered = make_tiered_analyzer(TierStats())
+    if tiered is not None:
+        source, analyze = tiered.stream(source), tiered
+    rows = []
+    async for row, analysis in analyze_in_order(source, analyze, concurrency=concurrency, stats=BatchThroughput()):
+        overall, themes = parse_review_analysis(analysis)
+        rows.append(PendingReview(row.text, overall, themes, analysis_model(analysis)))
+    return rows
+
+
+async def _stage_results(
+    session_maker: sessionmaker,
+    job: ClaimedReanalysis,
+    worker_id: str,
+    review_ids: List[int],
+    rows: List[PendingReview],
+) -> bool:
+    """Записать результаты шага и сдвинуть курсор одной транзакцией. False — аренда потеряна."""
+    analyzed = [(review_id, row) for review_id, row in zip(review_ids, rows) if row.overall_sentiment is not None]
+    try:
+        async with session_maker() as session:
+            async with session.begin():
+                res = await session.execute(
+                    text(
+                        """
+                        UPDATE reanalysis_jobs
+                        SET cursor_review_id = :cursor,
+                            staged_rows = staged_rows + :staged,
+                            failed_rows = failed_rows + :failed,
+                            updated_at = now()
+                        WHERE id = :id AND worker_id = :worker AND status = 'running'
+                        """
+                    ),
+                    {
+                        "id": job.id,
+                        "worker": worker_id,
+                        "cursor": review_ids[-1],
+                        "staged": len(analyzed),
+                        "failed": len(review_ids) - len(analyzed),
+                    },
+                )
+                if res.rowcount == 0:
+                    raise _LeaseLost()
+                if analyzed:
+                    # новые темы добавляются в этой же транзакции и откатываются вместе с ней
+                    theme_ids = await get_theme_ids(session, (t["theme"] for _, row in analyzed for t in row.themes))
+                    values = [
+                        {
+                            "job": job.id,
+                            "review_id": review_id,
+                            "overall": row.overall_sentiment,
+                            "themes": json.dumps(
+                                [{"theme_id": theme_ids[t["theme"]], "sentiment": t["sentiment"]} for t in row.themes]
+                            ),
+                            "model": row.model_name,
+                        }
+                        for review_id, row in analyzed
+                    ]
+                    await session.execute(
+                        text(
+                            """
+                            INSERT INTO reanalysis_results (job_id, review_id, overall_sentiment, themes, model_name)
+                            VALUES (:job, :review_id, :overall, CAST(:themes AS jsonb), :model)
+                            ON CONFLICT (job_id, review_id) DO UPDATE
+                            SET overall_sentiment = EXCLUDED.overall_sentiment,
+                                themes = EXCLUDED.themes,
+                                model_name = EXCLUDED.model_name
+                            """
+                        ),
+                        values,
+                    )
+    except _LeaseLost:
+        return False
+    return True
+
+
+async def apply_reanalysis(session_maker: sessionmaker, job: ClaimedReanalysis, worker_id: str) -> Optional[int]:
+    """
+    Перенести накопленные результаты в reviews/review_themes одной транзакцией.
+    Меняются только отзывы, всё ещё устаревшие относительно версий задания.
+    Возвращает число изменённых отзывов или None, если аренда потеряна.
+    """
+    async with session_maker() as session:
+        async with session.begin():
+            if not await _extend_lease(session, job, worker_id, get_settings().import_lease_seconds):
+                return None
+            params = {**job.versions(), "job": job.id}
+            # параметры в CREATE TABLE AS недопустимы, поэтому таблица создаётся отдельно
+            await session.execute(
+                text(
+                    """
+                    CREATE TEMP TABLE reanalysis_apply (
+                        review_id BIGINT PRIMARY KEY,
+                        review_created_at TIMESTAMPTZ NOT NULL,
+                        batch_id BIGINT,
+                        day DATE NOT NULL,
+                        old_sentiment TEXT,
+                        overall_sentiment TEXT NOT NULL,
+                        themes JSONB NOT NULL,
+                        model_name TEXT NOT NULL
+                    ) ON COMMIT DROP
+                    """
+                )
+            )
+            res = await session.execute(
+                text(
+                    f"""
+                    INSERT INTO reanalysis_apply
+                    SELECT s.review_id, r.review_created_at, r.batch_id,
+                           (date_trunc('day', r.review_created_at))::date AS day,
+                           r.overall_sentiment AS old_sentiment,
+                           s.overall_sentiment, s.themes, s.model_name
+                    FROM reanalysis_results s
+                    JOIN reviews r ON r.id = s.review_id
+                    WHERE s.job_id = :job AND {_STALE_CONDITION}
+                    """
+                ),
+                params,
+            )
+            applied = res.rowcount
+
+            # суточные агрегаты: число отзывов за день не меняется, сдвигаются только тональности
+            await session.execute(
+                text(
+                    """
+                    UPDATE review_daily_rollup d
+                    SET positive_count = d.positive_count + x.positive,
+                        neutral_count = d.neutral_count + x.neutral,
+                        negative_count = d.negative_count + x.negative
+                    FROM (
+                        SELECT day,
+                               COUNT(*) FILTER (WHERE overall_sentiment = 'положительная')
+                                 - COUNT(*) FILTER (WHERE old_sentiment = 'положительная') AS positive,
+                               COUNT(*) FILTER (WHERE overall_sentiment = 'нейтральная')
+                                 - COUNT(*) FILTER (WHERE old_sentiment = 'нейтральная') AS neutral,
+                               COUNT(*) FILTER (WHERE overall_sentiment = 'отрицательная')
+                                 - COUNT(*) FILTER (WHERE old_sentiment = 'отрицательная') AS negative
+                        FROM reanalysis_apply
+                        GROUP BY day
+                    ) x
+                    WHERE d.day = x.day
+                    """
+                )
+            )
+            # старые темы вычитаются из агрегатов и удаляются, новые — вставляются и прибавляются;
+            # ORDER BY фиксирует порядок блокировок строк агрегатов с параллельным импортом
+            await session.execute(
+                text(
+                    """
+                    UPDATE theme_daily_rollup d
+                    SET review_count = d.review_count - x.cnt
+                    FROM (
+                        SELECT a.day, rt.theme_id, rt.sentiment, COUNT(*) AS cnt
+                        FROM review_themes rt
+                        JOIN reanalysis_apply a ON a.review_id = rt.review_id
+                        GROUP BY 1, 2, 3
+                        ORDER BY 1, 2, 3
+                    ) x
+                    WHERE d.day = x.day AND d.theme_id = x.theme_id AND d.sentiment = x.sentiment
+                    """
+                )
+            )
+            await session.execute(
+                text("DELETE FROM review_themes rt USING reanalysis_apply a WHERE rt.review_id = a.review_id")
+            )
+            await session.execute(
+                text(
+                    """
+                    INSERT INTO review_themes (review_id, theme_id, sentiment, review_created_at, batch_id)
+                    SELECT a.review_id, CAST(t->>'theme_id' AS integer), t->>'sentiment', a.review_created_at, a.batch_id
+                    FROM reanalysis_apply a, jsonb_array_elements(a.themes) t
+                    """
+                )
+            )
+            await session.execute(
+                text(
+                    """
+                    INSERT INTO theme_daily_rollup AS d (day, theme_id, sentiment, review_count)
+                    SELECT a.day, CAST(t->>'theme_id' AS integer), t->>'sentiment', COUNT(*)
+                    FROM reanalysis_apply a, jsonb_array_elements(a.themes) t
+                    GROUP BY 1, 2, 3
+                    ORDER BY 1, 2, 3
+                    ON CONFLICT (day, theme_id, sentiment) DO UPDATE
+                    SET review_count = d.review_count + EXCLUDED.review_count
+                    """
+                )
+            )
+            await session.execute(
+                text(
+                    """
+                    UPDATE reviews r
+                    SET overall_sentiment = a.overall_sentiment,
+                        model_name = a.model_name,
+                        prompt_version = :prompt
+                    FROM reanalysis_apply a
+                    WHERE r.id = a.review_id AND r.review_created_at = a.review_created_at
+                    """
+                ),
+                {"prompt": job.prompt_version},
+            )
+            await session.execute(text("DELETE FROM reanalysis_results WHERE job_id = :job"), {"job": job.id})
+            await session.execute(
+                text(
+                    """
+                    UPDATE reanalysis_jobs
+                    SET status = 'done', applied_rows = :applied, locked_until = NULL,
+                        updated_at = now(), finished_at = now()
+                    WHERE id = :job
+                    """
+                ),
+                {"job": job.id, "applied": applied},
+            )
+            await bump_data_generation(session)
+    logger.info("Reanalysis job %s applied: %d reviews updated", job.id, applied)
+    return applied
+
+
+async def run_reanalysis_step(session_maker: sessionmaker, worker_id: str) -> bool:
+    """Один шаг активного задания. False — заданий нет (или активное занято другим процессом)."""
+    settings = get_settings()
+    job = await claim_reanalysis_job(session_maker, worker_id, settings.import_lease_seconds)
+    if job is None:
+        return False
+    if job.versions() != current_versions():
+        # процесс запущен с другой моделью/промптом, чем у задания: результаты были бы смешанными
+        await _finish_job(
+            session_maker, job, worker_id, "failed",
+            f"analysis versions changed since the job was created: {current_versions()}",
+        )
+        logger.warning("Reanalysis job %s failed: analysis versions changed", job.id)
+        return True
+
+    stale = await _next_stale(session_maker, job, settings.reanalysis_chunk_size)
+    if not stale:
+        await apply_reanalysis(session_maker, job, worker_id)
+        return True
+
+    heartbeat = asyncio.create_task(_keep_lease(session_maker, job, worker_id, settings.import_lease_seconds))
+    try:
+        rows = await _analyze([row.raw_text for row in stale], settings.reanalysis_concurrency)
+    finally:
+        heartbeat.cancel()
+    if not await _stage_results(session_maker, job, worker_id, [row.id for row in stale], rows):
+        logger.warning("Lease on reanalysis job %s was lost, results discarded", job.id)
+    return True
+
+
+async def _run(command: str) -> None:
+    from ..core.db import get_engine, get_session, init_db
+    from ..core.llm_client import close_llm_client
+
+    settings = get_settings()
+    engine = get_engine(settings.database_url)
+    await init_db(engine)
+    session_maker = get_session()
+    try:
+        if command == "start":
+            async with session_maker() as session:
+                job, created = await create_reanalysis_job(session)
+                stale = await count_stale_reviews(session)
+            print(f"{'created' if created else 'already active'}: job {job['id']}, {stale} stale reviews")
+            return
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        while await run_reanalysis_step(session_maker, worker_id):
+            await asyncio.sleep(settings.reanalysis_pause)
+    finally:
+        await close_llm_client()
+        await engine.dispose()
+
+
+def main() -> None:
+    from ..core.logging import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(prog="python -m backend.services.reanalysis")
+    parser.add_argument("command", choices=("start", "run"), help="создать задание или выполнить активное")
+    args = parser.parse_args()
+    asyncio.run(_run(args.command))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Кэш ответов дашборда и брифа.
+
+Ключ — (эндпоинт, нормализованное окно, поколение данных). Поколение хранится
+в таблице data_generation и увеличивается после записи отзывов (во время импорта —
+не чаще раза в DATA_GENERATION_BUMP_INTERVAL секунд и обязательно в конце пакета),
+поэтому после импорта старые записи просто перестают находиться. Уровни: in-memory TTL+LRU в процессе и (RESPONSE_CACHE_SHARED)
+общая для всех процессов UNLOGGED-таблица response_cache.
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from ..config import get_settings
+from ..core.db import get_session
+
+logger = logging.getLogger(__name__)
+
+# раз в столько записей из общего уровня вычищаются просроченные строки
+_SHARED_PURGE_EVERY = 100
+
+# время (monotonic) последнего увеличения поколения импортом в этом процессе
+_last_import_bump = 0.0
+
+
+async def get_data_generation(db: AsyncSession) -> int:
+    res = await db.execute(text("SELECT generation FROM data_generation WHERE id = 1"))
+    return int(res.scalar() or 0)
+
+
+async def bump_data_generation(session: Union[AsyncSession, AsyncConnection]) -> None:
+    """Увеличить поколение данных в рамках транзакции `session` (без коммита)."""
+    await session.execute(
+        text(
+            """
+            INSERT INTO data_generation AS g (id, generation) VALUES (1, 1)
+            ON CONFLICT (id) DO UPDATE SET generation = g.generation + 1, updated_at = now()
+            """
+        )
+    )
+
+
+async def bump_data_generation_after_write(session_maker: sessionmaker, force: bool = False) -> None:
+    """
+    Увеличить поколение после коммита чанка импорта — собственной короткой транзакцией
+    и не чаще раза в DATA_GENERATION_BUMP_INTERVAL секунд на процесс; `force` — в конце пакета.
+    Строка data_generation одна на всю БД: увеличение в транзакции каждого чанка
+    выстраивало параллельных писателей в очередь за её блокировкой до коммита.
+    """
+    global _last_import_bump
+    now = time.monotonic()
+    if not force and now - _last_import_bump < get_settings().data_generation_bump_interval:
+        return
+    _last_import_bump = now
+    async with session_maker() as session:
+        async with session.begin():
+            await bump_data_generation(session)
+
+
+class ResponseCache:
+    def __init__(self, max_size: int, ttl: float, shared: bool) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self._lru: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._puts = 0
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.by_endpoint: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(endpoint: str, generation: int, params: dict) -> str:
+        return f"{endpoint}|g{generation}|{json.dumps(params, sort_keys=True, default=str)}"
+
+    def _count(self, endpoint: str, hit: bool) -> None:
+        counters = self.by_endpoint.setdefault(endpoint, {"hits": 0, "misses": 0})
+        counters["hits" if hit else "misses"] += 1
+
+    def _remember(self, key: str, payload: Any) -> None:
+        if self.max_size <= 0:
+            return
+        self._lru[key] = (time.monotonic() + self.ttl, payload)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._lru.get(key)
+        if entry is not None:
+            expires, payload = entry
+            if expires > time.monotonic():
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return payload
+            del self._lru[key]
+
+        if self.shared:
+            try:
+                async with get_session()() as session:
+                    res = await session.execute(
+                        text("SELECT payload FROM response_cache WHERE key = :key AND expires_at > now()"),
+                        {"key": key},
+                    )
+                    payload = res.scalar()
+            except Exception as e:
+                logger.warning("Shared response cache lookup failed: %s", e)
+                payload = None
+            if payload is not None:
+                self.shared_hits += 1
+                self._remember(key, payload)
+                return payload
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, generation: int, payload: Any) -> None:
+        self._remember(key, payload)
+        if not self.shared:
+            return
+        self._puts += 1
+        try:
+            async with get_session()() as session:
+                async with session.begin():
+                    await session.execute(
+                        text(
+                            """
+                            INSERT INTO response_cache (key, generation, payload, expires_at)
+                            VALUES (:key, :generation, CAST(:payload AS jsonb), now() + make_interval(secs => :ttl))
+                            ON CONFLICT (key) DO UPDATE
+                            SET payload = EXCLUDED.payload, expires_at = EXCLUDED.expires_at
+                            """
+                        ),
+                        {
+                            "key": key,
+                            "generation": generation,
+                            "payload": json.dumps(payload, ensure_ascii=False),
+                            "ttl": self.ttl,
+                        },
+                    )
+                    if self._puts % _SHARED_PURGE_EVERY == 0:
+                        await session.execute(text("DELETE FROM response_cache WHERE expires_at <= now()"))
+        except Exception as e:
+            logger.warning("Shared response cache store failed: %s", e)
+
+    async def get_or_compute(
+        self,
+        db: AsyncSession,
+        endpoint: str,
+        params: dict,
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Вернуть закэшированный ответ или посчитать его через `compute`.
+        Ответ хранится в JSON-совместимом виде (jsonable_encoder), одинаковом для обоих уровней.
+        """
+        generation = await get_data_generation(db)
+        key = self.make_key(endpoint, generation, params)
+        cached = await self.get(key)
+        self._count(endpoint, cached is not None)
+        if cached is not None:
+            return cached
+        payload = jsonable_encoder(await compute())
+        await self.put(key, generation, payload)
+        return payload
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._lru),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "shared": self.shared,
+            "by_endpoint": {
+                name: {**c, "hit_ratio": round(c["hits"] / (c["hits"] + c["misses"]), 4)}
+                for name, c in self.by_endpoint.items()
+            },
+        }
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        settings = get_settings()
+        _cache = ResponseCache(
+            max_size=settings.response_cache_size,
+            ttl=settings.response_cache_ttl,
+            shared=settings.response_cache_shared,
+        )
+    return _cache
+
+
+async def cached_response(
+    db: AsyncSession,
+    endpoint: str,
+    params: dict,
+    compute: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Точка входа для эндпоинтов: при выключенном кэше просто вызывает `compute`."""
+    if not get_settings().response_cache_enabled:
+        return await compute()
+    return await get_response_cache().get_or_compute(db, endpoint, params, compute)
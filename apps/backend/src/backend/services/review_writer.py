@@ -0,0 +1,242 @@
+"""
+Буферизованная запись проанализированных отзывов пачками.
+
+Вместо flush на каждый отзыв и каждую тему отзывы копятся в буфере и пишутся
+чанками: один запрос за идентификаторами, один многострочный INSERT в reviews
+и один — в review_themes. Каждый чанк коммитится в своей транзакции
+вместе с приращением суточных агрегатов. Поколение данных (сброс кэша ответов)
+увеличивается после коммита, не чаще раза в DATA_GENERATION_BUMP_INTERVAL секунд
+(response_cache.bump_data_generation_after_write).
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from ..config import get_settings
+from ..models.db_models import Review, ReviewHash, ReviewTheme
+from .analysis import REVIEW_ANALYSIS_PROMPT_VERSION
+from .ingest import ImportRow
+from .response_cache import bump_data_generation_after_write
+from .rollups import apply_review_rollups
+from .text_utils import review_hash
+from .themes import canonical_theme, get_theme_ids
+
+logger = logging.getLogger(__name__)
+
+SENTIMENTS = ("отрицательная", "нейтральная", "положительная")
+
+# Postgres ограничивает число параметров запроса (32767), поэтому большие INSERT режутся
+_MAX_PARAMS_PER_QUERY = 32767
+
+
+def _insert_slices(values: List[dict]) -> Iterator[List[dict]]:
+    """Строки INSERT порциями, укладывающимися в лимит параметров (по числу колонок строки)."""
+    if not values:
+        return
+    step = _MAX_PARAMS_PER_QUERY // len(values[0])
+    for i in range(0, len(values), step):
+        yield values[i:i + step]
+
+
+class PendingReview:
+    def __init__(
+        self,
+        raw_text: str,
+        overall_sentiment: Optional[str],
+        themes: List[dict],
+        model_name: Optional[str] = None,
+        review_created_at: Optional[datetime] = None,
+        language: Optional[str] = None,
+    ) -> None:
+        self.raw_text = raw_text
+        # дата и язык из сопоставленных колонок файла (ingest.ImportRow); без даты — время записи
+        self.review_created_at = review_created_at
+        self.language = language
+        self.overall_sentiment = overall_sentiment if overall_sentiment in SENTIMENTS else None
+        self.themes = _clean_themes(themes)
+        # версия анализа пишется только для успешного анализа: неудачный остаётся «устаревшим»
+        self.model_name = model_name if self.overall_sentiment is not None else None
+
+
+def _clean_themes(themes: List[dict]) -> List[dict]:
+    """Отбрасывает темы, которые нарушили бы ограничения таблицы review_themes."""
+    cleaned = []
+    seen = set()
+    for t in themes:
+        if not isinstance(t, dict):
+            continue
+        theme_name = t.get("theme")
+        sentiment = t.get("sentiment")
+        if not isinstance(theme_name, str) or sentiment not in SENTIMENTS:
+            continue
+        theme_name = canonical_theme(theme_name)
+        # UNIQUE (review_id, theme_id): «Доставка» и «доставка » — одна тема
+        if not theme_name or theme_name in seen:
+            continue
+        seen.add(theme_name)
+        cleaned.append({"theme": theme_name, "sentiment": sentiment})
+    return cleaned
+
+
+class ReviewBulkWriter:
+    """
+    Копит отзывы одного пакета импорта и пишет их чанками по `chunk_size`.
+
+    Если чанк не удалось записать целиком, он повторяется построчно:
+    теряются только строки, которые не проходят сами по себе.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        batch_id: int,
+        chunk_size: int = 500,
+        on_flush: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> None:
+        self._session_maker = session_maker
+        self.batch_id = batch_id
+        self.chunk_size = max(1, chunk_size)
+        # вызывается после каждого чанка с (записано, отброшено) в этом чанке
+        self._on_flush = on_flush
+        self._buffer: List[PendingReview] = []
+        self.written = 0
+        self.failed = 0
+
+    async def add(
+        self,
+        row: ImportRow,
+        overall_sentiment: Optional[str],
+        themes: List[dict],
+        model_name: Optional[str] = None,
+    ) -> None:
+        self._buffer.append(
+            PendingReview(row.text, overall_sentiment, themes, model_name, row.review_date, row.language)
+        )
+        if len(self._buffer) >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        written_before, failed_before = self.written, self.failed
+        try:
+            await self._write_chunk(rows)
+            self.written += len(rows)
+        except Exception as e:
+            logger.warning("Chunk of %d reviews failed (%s), retrying row by row", len(rows), e)
+            for row in rows:
+                try:
+                    await self._write_chunk([row])
+                    self.written += 1
+                except Exception as row_error:
+                    self.failed += 1
+                    logger.warning("Review skipped: %s", row_error)
+        if self.written > written_before:
+            await bump_data_generation_after_write(self._session_maker)
+        if self._on_flush is not None:
+            await self._on_flush(self.written - written_before, self.failed - failed_before)
+
+    async def _write_chunk(self, rows: List[PendingReview]) -> None:
+        async with self._session_maker() as session:
+            async with session.begin():
+                await write_reviews(session, self.batch_id, rows)
+
+
+def parse_review_analysis(analysis) -> Tuple[Optional[str], List[dict]]:
+    """Достаёт (overall_sentiment, key_themes) из ответа LLM (dict или JSON-строка)."""
+    if isinstance(analysis, str):
+        try:
+            parsed = json.loads(analysis)
+        except Exception:
+            parsed = {}
+    else:
+        parsed = analysis or {}
+
+    ra = parsed.get("review_analysis", {}) if isinstance(parsed, dict) else {}
+    if not isinstance(ra, dict):
+        return None, []
+    return ra.get("overall_sentiment"), ra.get("key_themes", []) or []
+
+
+def analysis_model(analysis) -> str:
+    """Чем получен анализ: поле "model" результата (local:<версия> у локальной модели) или текущая LLM."""
+    model = analysis.get("model") if isinstance(analysis, dict) else None
+    return model if isinstance(model, str) and model else get_settings().llm_model_name
+
+
+async def write_reviews(session: AsyncSession, batch_id: int, rows: List[PendingReview]) -> None:
+    """Пишет отзывы с темами в рамках уже открытой транзакции `session`."""
+    if not rows:
+        return
+    # Идентификаторы берём заранее из последовательности, чтобы однозначно
+    # связать темы с отзывами, не полагаясь на порядок строк в RETURNING.
+    # now() — время начала транзакции, то же, что дал бы DEFAULT review_created_at, — пишется
+    # отзывам без даты из файла; время отзыва вместе с batch_id явно пишется и в темы
+    # (секционирование, агрегаты, метрики без соединения)
+    result = await session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('reviews', 'id')), now() FROM generate_series(1, :n)"),
+        {"n": len(rows)},
+    )
+    fetched = result.fetchall()
+    ids = [row[0] for row in fetched]
+    now = fetched[0][1]
+    theme_ids = await get_theme_ids(session, (t["theme"] for row in rows for t in row.themes))
+
+    review_values = []
+    theme_values = []
+    hash_values = {}
+    created_at_values = set()
+    for review_id, row in zip(ids, rows):
+        hash_values.setdefault(review_hash(row.raw_text), review_id)
+        created_at = row.review_created_at or now
+        created_at_values.add(created_at)
+        review_values.append(
+            {
+                "id": review_id,
+                "batch_id": batch_id,
+                "raw_text": row.raw_text,
+                "language_code": row.language,
+                "overall_sentiment": row.overall_sentiment,
+                "model_name": row.model_name,
+                "prompt_version": REVIEW_ANALYSIS_PROMPT_VERSION if row.model_name else None,
+                "review_created_at": created_at,
+            }
+        )
+        for t in row.themes:
+            theme_values.append(
+                {
+                    "review_id": review_id,
+                    "theme_id": theme_ids[t["theme"]],
+                    "sentiment": t["sentiment"],
+                    "review_created_at": created_at,
+                    "batch_id": batch_id,
+                }
+            )
+
+    for values in _insert_slices(review_values):
+        await session.execute(insert(Review.__table__).values(values))
+    for values in _insert_slices(theme_values):
+        await session.execute(insert(ReviewTheme.__table__).values(values))
+    # индекс текстов для поиска дубликатов при следующих импортах (services/dedup.py)
+    hash_rows = [{"hash": h, "review_id": review_id, "batch_id": batch_id} for h, review_id in sorted(hash_values.items())]
+    for values in _insert_slices(hash_rows):
+        stmt = pg_insert(ReviewHash.__table__).values(values)
+        # хэш, оставшийся от удалённого отзыва, переводится на новый
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["hash"],
+                set_={"review_id": stmt.excluded.review_id, "batch_id": stmt.excluded.batch_id, "created_at": text("now()")},
+                where=text("NOT EXISTS (SELECT 1 FROM reviews r WHERE r.id = review_hashes.review_id)"),
+            )
+        )
+    # суточные агрегаты коммитятся вместе с отзывами; поколение данных увеличивает вызывающий
+    # после коммита (bump_data_generation_after_write), чтобы не держать блокировку его строки
+    await apply_review_rollups(session, ids, sorted(created_at_values))
@@ -0,0 +1,122 @@
+"""
+Суточные агрегаты для метрик дашборда (review_daily_rollup, theme_daily_rollup).
+
+Агрегаты увеличиваются в той же транзакции, в которой пишутся отзывы, поэтому
+они всегда согласованы с закоммиченными данными. Сутки считаются так же, как в
+сырых запросах — date_trunc('day', review_created_at) в часовом поясе сессии БД,
+а он всегда UTC (core/db.py задаёт timezone при подключении).
+"""
+
+import logging
+from datetime import datetime
+from typing import List, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+async def apply_review_rollups(
+    session: AsyncSession, review_ids: List[int], created_at: Sequence[datetime]
+) -> None:
+    """
+    Добавить в агрегаты только что вставленные отзывы `review_ids` (без коммита).
+    `created_at` — все их значения review_created_at (обычно одно — время транзакции,
+    при импорте с колонкой даты — несколько): условие по ним оставляет в плане
+    только нужные секции при секционированных таблицах.
+    """
+    if not review_ids:
+        return
+    # ORDER BY фиксирует порядок блокировок строк агрегатов между параллельными воркерами
+    await session.execute(
+        text(
+            """
+            INSERT INTO review_daily_rollup AS d (day, total_count, positive_count, neutral_count, negative_count)
+            SELECT (date_trunc('day', r.review_created_at))::date AS day,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE r.overall_sentiment = 'положительная'),
+                   COUNT(*) FILTER (WHERE r.overall_sentiment = 'нейтральная'),
+                   COUNT(*) FILTER (WHERE r.overall_sentiment = 'отрицательная')
+            FROM reviews r
+            WHERE r.id = ANY(:ids) AND r.review_created_at = ANY(:created_at)
+            GROUP BY 1
+            ORDER BY 1
+            ON CONFLICT (day) DO UPDATE
+            SET total_count = d.total_count + EXCLUDED.total_count,
+                positive_count = d.positive_count + EXCLUDED.positive_count,
+                neutral_count = d.neutral_count + EXCLUDED.neutral_count,
+                negative_count = d.negative_count + EXCLUDED.negative_count
+            """
+        ),
+        {"ids": review_ids, "created_at": list(created_at)},
+    )
+    await session.execute(
+        text(
+            """
+            INSERT INTO theme_daily_rollup AS d (day, theme_id, sentiment, review_count)
+            SELECT (date_trunc('day', rt.review_created_at))::date AS day, rt.theme_id, rt.sentiment, COUNT(*)
+            FROM review_themes rt
+            WHERE rt.review_id = ANY(:ids) AND rt.review_created_at = ANY(:created_at)
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 2, 3
+            ON CONFLICT (day, theme_id, sentiment) DO UPDATE
+            SET review_count = d.review_count + EXCLUDED.review_count
+            """
+        ),
+        {"ids": review_ids, "created_at": list(created_at)},
+    )
+
+
+async def rebuild_rollups(session: AsyncSession) -> None:
+    """Пересчитать агрегаты целиком из reviews/review_themes (без коммита)."""
+    await session.execute(text("LOCK TABLE review_daily_rollup, theme_daily_rollup IN EXCLUSIVE MODE"))
+    await session.execute(text("DELETE FROM review_daily_rollup"))
+    await session.execute(text("DELETE FROM theme_daily_rollup"))
+    await session.execute(
+        text(
+            """
+            INSERT INTO review_daily_rollup (day, total_count, positive_count, neutral_count, negative_count)
+            SELECT (date_trunc('day', r.review_created_at))::date,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE r.overall_sentiment = 'положительная'),
+                   COUNT(*) FILTER (WHERE r.overall_sentiment = 'нейтральная'),
+                   COUNT(*) FILTER (WHERE r.overall_sentiment = 'отрицательная')
+            FROM reviews r
+            GROUP BY 1
+            """
+        )
+    )
+    await session.execute(
+        text(
+            """
+            INSERT INTO theme_daily_rollup (day, theme_id, sentiment, review_count)
+            SELECT (date_trunc('day', r.review_created_at))::date, rt.theme_id, rt.sentiment, COUNT(*)
+            FROM review_themes rt
+            JOIN reviews r ON r.id = rt.review_id
+            GROUP BY 1, 2, 3
+            """
+        )
+    )
+
+
+async def ensure_rollups_backfilled(engine: AsyncEngine) -> None:
+    """
+    Заполнить агрегаты по уже существующим отзывам, если таблицы агрегатов
+    пусты (например, сразу после их появления в схеме).
+    """
+    async with engine.begin() as conn:
+        res = await conn.execute(
+            text(
+                """
+                SELECT EXISTS (SELECT 1 FROM reviews)
+                   AND NOT EXISTS (SELECT 1 FROM review_daily_rollup)
+                """
+            )
+        )
+        if not res.scalar():
+            return
+    logger.info("Backfilling daily rollups from reviews")
+    async with AsyncSession(bind=engine) as session:
+        async with session.begin():
+            await rebuild_rollups(session)
@@ -0,0 +1,22 @@
+import hashlib
+import unicodedata
+
+
+def normalize_for_hash(text: str) -> str:
+    """Каноническая форма текста для сравнения: NFC, без учёта регистра, схлопнутые пробелы."""
+    return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+
+def text_hash(*parts: str) -> str:
+    """sha256 (hex) от частей, разделённых нулевым байтом."""
+    h = hashlib.sha256()
+    for i, part in enumerate(parts):
+        if i:
+            h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+
+def review_hash(text: str) -> str:
+    """Ключ текста отзыва для поиска дубликатов (review_hashes): sha256 нормализованного текста."""
+    return text_hash(normalize_for_hash(text))
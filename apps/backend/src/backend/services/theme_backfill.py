@@ -0,0 +1,93 @@
+"""
+Фоновое заполнение review_themes.review_created_at и batch_id для строк,
+записанных до появления этих столбцов.
+
+Заполнение идёт небольшими пачками (FOR UPDATE SKIP LOCKED — несколько процессов
+не мешают друг другу) с паузой между ними и возобновляется с места остановки:
+незаполненные строки находятся по частичному индексу idx_review_themes_backfill.
+Пока заполнение не закончено, метрики по темам соединяют review_themes с reviews.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from ..config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_denormalized = False
+
+
+def themes_denormalized() -> bool:
+    """
+    У всех тем заполнены review_created_at и batch_id — метрики могут не соединять таблицы.
+    Условие то же, что у цикла заполнения и idx_review_themes_backfill (batch_id IS NULL):
+    строки, где уже есть только review_created_at, тоже ещё не заполнены.
+    """
+    return _denormalized
+
+
+async def refresh_denormalized_state(session_maker: sessionmaker) -> bool:
+    global _denormalized
+    async with session_maker() as session:
+        res = await session.execute(
+            text(
+                """
+                SELECT NOT EXISTS (
+                    SELECT 1 FROM review_themes WHERE batch_id IS NULL
+                )
+                """
+            )
+        )
+        _denormalized = bool(res.scalar())
+    return _denormalized
+
+
+async def backfill_review_themes(
+    session_maker: sessionmaker,
+    batch_size: Optional[int] = None,
+    pause: Optional[float] = None,
+) -> int:
+    """Заполнить незаполненные строки пачками по `batch_size` с паузой `pause` сек. Возвращает число строк."""
+    settings = get_settings()
+    batch_size = batch_size or settings.theme_backfill_batch_size
+    pause = settings.theme_backfill_pause if pause is None else pause
+
+    total = 0
+    while True:
+        async with session_maker() as session:
+            async with session.begin():
+                res = await session.execute(
+                    text(
+                        """
+                        WITH todo AS (
+                            SELECT rt.id FROM review_themes rt
+                            WHERE rt.batch_id IS NULL
+                            ORDER BY rt.id
+                            LIMIT :limit
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        UPDATE review_themes rt
+                        SET review_created_at = r.review_created_at, batch_id = r.batch_id
+                        FROM todo, reviews r
+                        WHERE rt.id = todo.id AND r.id = rt.review_id
+                        """
+                    ),
+                    {"limit": batch_size},
+                )
+                updated = res.rowcount or 0
+        total += updated
+        if updated == batch_size:
+            await asyncio.sleep(pause)
+            continue
+        # неполная пачка: либо всё заполнено, либо остаток заблокирован другим процессом
+        if await refresh_denormalized_state(session_maker):
+            break
+        await asyncio.sleep(max(pause, 1.0))
+
+    logger.info("Review themes backfill finished (%d rows here), theme metrics no longer join reviews", total)
+    return total
@@ -0,0 +1,76 @@
+"""
+Словарь тем (таблица themes).
+
+Темы от модели приводятся к канонической форме (регистр, пробелы) и заменяются
+небольшими целочисленными id: в review_themes и суточных агрегатах хранится
+только id, название подставляется лишь в итоговые top-N метрик.
+
+Соответствие название -> id кэшируется в процессе. Новые темы вставляются
+в транзакции вызывающего вместе с отзывами, поэтому в кэш попадают только темы,
+уже закоммиченные другими транзакциями: откат записи не оставляет в кэше id
+несуществующей темы, а вставленные здесь темы кэшируются при следующем обращении.
+Строки словаря не удаляются.
+"""
+
+import logging
+from typing import Dict, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .text_utils import normalize_for_hash
+
+logger = logging.getLogger(__name__)
+
+# сверх этого кэш сбрасывается целиком (модель может выдавать и свободные формулировки)
+_MAX_CACHED_THEMES = 10_000
+
+_theme_ids: Dict[str, int] = {}
+
+
+def canonical_theme(name: str) -> str:
+    """Каноническое название темы: NFC, нижний регистр, схлопнутые пробелы."""
+    return normalize_for_hash(name)
+
+
+async def get_theme_ids(session: AsyncSession, names: Iterable[str]) -> Dict[str, int]:
+    """
+    id тем по каноническим названиям `names` в рамках уже открытой транзакции `session`;
+    недостающие темы добавляются в словарь.
+    """
+    names = set(names)
+    # результат собирается локально: общий кэш может быть сброшен во время await
+    # (здесь же или в параллельном вызове)
+    resolved = {n: _theme_ids[n] for n in names if n in _theme_ids}
+    missing = sorted(names - resolved.keys())
+    if missing:
+        # отсортированный список фиксирует порядок блокировок между параллельными воркерами
+        res = await session.execute(
+            text(
+                """
+                INSERT INTO themes (name)
+                SELECT unnest(CAST(:names AS text[]))
+                ON CONFLICT (name) DO NOTHING
+                RETURNING name, id
+                """
+            ),
+            {"names": missing},
+        )
+        inserted = {name: theme_id for name, theme_id in res.fetchall()}
+        # остальные темы вставлены и закоммичены другими транзакциями (ON CONFLICT
+        # дожидается их завершения) — их id можно кэшировать
+        committed = {}
+        existing = [n for n in missing if n not in inserted]
+        if existing:
+            res = await session.execute(
+                text("SELECT name, id FROM themes WHERE name = ANY(:names)"),
+                {"names": existing},
+            )
+            committed = {name: theme_id for name, theme_id in res.fetchall()}
+        resolved.update(inserted)
+        resolved.update(committed)
+        if len(_theme_ids) + len(committed) > _MAX_CACHED_THEMES:
+            _theme_ids.clear()
+        _theme_ids.update(committed)
+        logger.debug("Resolved %d new themes (%d inserted)", len(missing), len(inserted))
+    return resolved
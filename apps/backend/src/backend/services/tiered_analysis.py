@@ -0,0 +1,140 @@
+"""
+Двухуровневый анализ отзывов: локальная модель на CPU, LLM — только для неуверенных.
+
+Включается путём к модели в LOCAL_MODEL_PATH (нужен numpy). Строки импорта проходят
+через `stream` чанками: для чанка одной векторизованной операцией считаются
+предсказания локальной модели, и те, чья уверенность не ниже LOCAL_MODEL_THRESHOLD,
+отдаются без обращения к LLM. Остальные идут в cached_analyze_review.
+
+Счётчики уровней пишутся в прогресс пакета (analysis_tiers), а гистограмма
+уверенности всех предсказаний процесса — в /api/metrics/analysis-tiers:
+по ней видно, сколько отзывов ушло бы в LLM при другом пороге.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Union
+
+from ..config import get_settings
+from .analysis_cache import cached_analyze_review
+from .ingest import ImportRow
+from .pipeline import iterate_blocks
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 256
+_HISTOGRAM_BUCKETS = 20
+
+
+class TierStats:
+    def __init__(self) -> None:
+        self.local = 0
+        self.llm = 0
+        # уверенность локальной модели по корзинам шириной 1/_HISTOGRAM_BUCKETS
+        self.confidence: Counter = Counter()
+
+    def add_confidence(self, confidence: float) -> None:
+        self.confidence[min(_HISTOGRAM_BUCKETS - 1, int(confidence * _HISTOGRAM_BUCKETS))] += 1
+
+    def counts(self) -> Dict[str, int]:
+        """Отзывы по уровням анализа (для import_progress.analysis_tiers)."""
+        return {tier: n for tier, n in (("local", self.local), ("llm", self.llm)) if n}
+
+    def as_dict(self) -> dict:
+        total = self.local + self.llm
+        return {
+            "local": self.local,
+            "llm": self.llm,
+            "local_share": round(self.local / total, 4) if total else 0.0,
+            "confidence_histogram": {
+                f"{b / _HISTOGRAM_BUCKETS:.2f}": self.confidence[b] for b in range(_HISTOGRAM_BUCKETS)
+            },
+        }
+
+
+# сумма по всем пакетам процесса
+_totals = TierStats()
+
+
+def get_tier_totals() -> TierStats:
+    return _totals
+
+
+_model = None
+_model_loaded = False
+
+
+def get_local_model():
+    """Модель из LOCAL_MODEL_PATH (один раз на процесс); None, если не задана или не загружается."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        path = get_settings().local_model_path
+        if path:
+            try:
+                from .local_model import LocalReviewModel
+
+                _model = LocalReviewModel.load(path)
+                logger.info("Local analysis model %s loaded from %s", _model.version, path)
+            except Exception as e:
+                logger.warning("Local analysis model %s is not loaded: %s", path, e)
+    return _model
+
+
+class TieredAnalyzer:
+    """
+    Вызываемый объект для analyze_in_order вместо analyze_row.
+    Вход должен пройти через `stream` — там считаются предсказания локальной модели.
+    """
+
+    def __init__(self, model, threshold: float, stats: TierStats) -> None:
+        self.model = model
+        self.threshold = threshold
+        self.stats = stats
+        # текст -> [результат, сколько раз ещё будет запрошен]
+        self._ready: Dict[str, list] = {}
+
+    async def _prepare(self, rows: List[ImportRow]) -> None:
+        texts = [row.text for row in rows]
+        # векторные операции NumPy — в отдельном потоке; результаты разбираются в цикле событий,
+        # чтобы _ready не менялся параллельно с __call__
+        predictions = await asyncio.to_thread(self.model.predict_batch, texts)
+        for text, prediction in zip(texts, predictions):
+            self.stats.add_confidence(prediction.confidence)
+            _totals.add_confidence(prediction.confidence)
+            if prediction.confidence >= self.threshold:
+                entry = self._ready.setdefault(text, [prediction.result, 0])
+                entry[1] += 1
+
+    async def stream(self, rows: Union[Iterable[ImportRow], AsyncIterable[ImportRow]]) -> AsyncIterator[ImportRow]:
+        async for chunk in iterate_blocks(rows, _CHUNK_SIZE):
+            await self._prepare(chunk)
+            for row in chunk:
+                yield row
+
+    async def __call__(self, row: ImportRow) -> dict:
+        entry = self._ready.get(row.text)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._ready[row.text]
+            self.stats.local += 1
+            _totals.local += 1
+            return entry[0]
+        self.stats.llm += 1
+        _totals.llm += 1
+        return await cached_analyze_review(row.text)
+
+
+async def analyze_row(row: ImportRow) -> dict:
+    """Анализ строки без локального уровня (LOCAL_MODEL_PATH не задан)."""
+    return await cached_analyze_review(row.text)
+
+
+def make_tiered_analyzer(stats: TierStats) -> Optional[TieredAnalyzer]:
+    """Анализатор с локальным уровнем или None, если локальная модель не настроена."""
+    model = get_local_model()
+    if model is None:
+        return None
+    return TieredAnalyzer(model, get_settings().local_model_threshold, stats)
@@ -0,0 +1,187 @@
+"""
+Воркер очереди импорта.
+
+Запуск: `python -m backend.worker`. Процессов можно поднять сколько угодно —
+задания и чанки распределяются между ними через SELECT ... FOR UPDATE SKIP LOCKED.
+В простое воркер выполняет фоновый повторный анализ (services/reanalysis.py).
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+
+from .config import get_settings
+from .core.db import get_engine, get_session, init_db
+from .core.llm_client import close_llm_client
+from .core.logging import setup_logging
+from .services.analysis import close_review_batcher
+from .services.dedup import DedupStats, filter_known
+from .services.job_queue import (
+    ClaimedChunk,
+    claim_chunk,
+    claim_job_for_split,
+    complete_chunk,
+    extend_chunk_lease,
+    fail_chunk,
+    split_job,
+)
+from .services.partitions import ensure_partitions
+from .services.pipeline import (
+    BatchThroughput,
+    analysis_concurrency,
+    analyze_in_order,
+    get_batch_throughput,
+    register_batch_throughput,
+)
+from .services.reanalysis import run_reanalysis_step
+from .services.review_writer import PendingReview, analysis_model, parse_review_analysis
+from .services.tiered_analysis import TierStats, analyze_row, make_tiered_analyzer
+
+logger = logging.getLogger("backend.worker")
+
+# как часто воркер проверяет, что секции на ближайшие месяцы созданы
+_PARTITIONS_CHECK_INTERVAL = 24 * 3600
+
+
+async def _keep_lease(session_maker, chunk_id: int, worker_id: str, lease_seconds: float) -> None:
+    # продлеваем аренду, пока чанк обрабатывается
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        if not await extend_chunk_lease(session_maker, chunk_id, worker_id, lease_seconds):
+            return
+
+
+async def process_chunk(session_maker, chunk: ClaimedChunk, worker_id: str) -> None:
+    settings = get_settings()
+    stats = get_batch_throughput(chunk.batch_id) or register_batch_throughput(BatchThroughput(chunk.batch_id))
+    heartbeat = asyncio.create_task(
+        _keep_lease(session_maker, chunk.id, worker_id, settings.import_lease_seconds)
+    )
+    try:
+        texts = chunk.texts
+        dedup_stats = DedupStats()
+        if chunk.options.get("delete_duplicates"):
+            # дубликаты внутри пакета отброшены при нарезке, здесь — уже сохранённые ранее тексты
+            texts = await filter_known(texts, dedup_stats)
+        # уверенные предсказания локальной модели не доходят до LLM
+        tier_stats = TierStats()
+        source, analyze = texts, analyze_row
+        tiered = make_tiered_analyzer(tier_stats)
+        if tiered is not None:
+            source, analyze = tiered.stream(texts), tiered
+        rows = []
+        async for row, analysis in analyze_in_order(
+            source,
+            analyze,
+            concurrency=analysis_concurrency(),
+            stats=stats,
+        ):
+            overall, themes = parse_review_analysis(analysis)
+            rows.append(
+                PendingReview(row.text, overall, themes, analysis_model(analysis), row.review_date, row.language)
+            )
+
+        if not await complete_chunk(
+            session_maker, chunk, worker_id, rows, skipped=dedup_stats.reasons(), tiers=tier_stats.counts()
+        ):
+            logger.warning("Lease on chunk %s was lost, results discarded", chunk.id)
+    except Exception as e:
+        logger.exception("Chunk %s failed", chunk.id)
+        await fail_chunk(session_maker, chunk, worker_id, repr(e), settings.import_max_attempts)
+    finally:
+        heartbeat.cancel()
+
+
+async def _import_step(session_maker, worker_id: str) -> bool:
+    """Нарезать одно задание или обработать один чанк. False — работы по импорту нет."""
+    settings = get_settings()
+    job = await claim_job_for_split(session_maker, worker_id, settings.import_lease_seconds)
+    if job is not None:
+        chunks = await split_job(session_maker, job, worker_id, settings.import_lease_seconds)
+        logger.info("Job %s (batch %s) split into %d chunks", job.id, job.batch_id, chunks)
+        return True
+
+    chunk = await claim_chunk(session_maker, worker_id, settings.import_lease_seconds, settings.import_max_attempts)
+    if chunk is not None:
+        await process_chunk(session_maker, chunk, worker_id)
+        return True
+    return False
+
+
+async def _sleep_unless_stopped(stop: asyncio.Event, seconds: float) -> None:
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def run_worker(stop: asyncio.Event) -> None:
+    settings = get_settings()
+    engine = get_engine(settings.database_url)
+    await init_db(engine)
+    session_maker = get_session()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    logger.info("Import worker %s started", worker_id)
+    partitions_checked_at = None
+
+    try:
+        while not stop.is_set():
+            if settings.reviews_partitioned and (
+                partitions_checked_at is None
+                or time.monotonic() - partitions_checked_at > _PARTITIONS_CHECK_INTERVAL
+            ):
+                partitions_checked_at = time.monotonic()
+                try:
+                    await ensure_partitions(engine)
+                except Exception:
+                    logger.exception("Partition maintenance failed")
+
+            try:
+                if await _import_step(session_maker, worker_id):
+                    continue
+            except Exception:
+                # сбой БД или ошибка разбора не должны останавливать воркер: задание/чанк
+                # вернётся в очередь по истечении аренды
+                logger.exception("Import step failed")
+                await _sleep_unless_stopped(stop, settings.worker_poll_interval)
+                continue
+
+            # повторный анализ — только когда нет работы по импорту, и с паузой между шагами,
+            # чтобы новое задание импорта ждало не дольше одного шага
+            try:
+                reanalyzed = await run_reanalysis_step(session_maker, worker_id)
+            except Exception:
+                logger.exception("Reanalysis step failed")
+                reanalyzed = False
+            await _sleep_unless_stopped(
+                stop, settings.reanalysis_pause if reanalyzed else settings.worker_poll_interval
+            )
+    finally:
+        await close_review_batcher()
+        await close_llm_client()
+        await engine.dispose()
+        logger.info("Import worker %s stopped", worker_id)
+
+
+def main() -> None:
+    setup_logging()
+
+    async def runner() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        await run_worker(stop)
+
+    asyncio.run(runner())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# пакет backend лежит в src/ (в контейнере — /app/src), как и при запуске с PYTHONPATH=src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
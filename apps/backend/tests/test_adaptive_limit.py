@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from backend.core.adaptive_limit import AdaptiveLimiter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_additive_increase_only_when_limit_is_saturated():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=2, min_limit=1, max_limit=10)
+        await limiter.acquire()
+        limiter.release(0.1, True)
+        # занято одно место из двух — лимит не растёт
+        assert limiter.limit == 2.0
+
+        await limiter.acquire()
+        await limiter.acquire()
+        limiter.release(0.1, True)
+        assert limiter.limit == pytest.approx(2.5)
+        assert limiter.increases == 1
+
+    run(scenario())
+
+
+def test_increase_stops_at_max_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=3, min_limit=1, max_limit=3)
+        for _ in range(3):
+            await limiter.acquire()
+        limiter.release(0.1, True)
+        assert limiter.limit == 3.0
+
+    run(scenario())
+
+
+def test_multiplicative_decrease_once_per_overload():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=10, min_limit=2, max_limit=20, backoff=0.5)
+        for _ in range(3):
+            await limiter.acquire()
+        # три параллельных вызова упали в одну перегрузку — одно снижение
+        for _ in range(3):
+            limiter.release(5.0, False)
+        assert limiter.limit == 5.0
+        assert limiter.decreases == 1
+        assert limiter.errors == 3
+
+    run(scenario())
+
+
+def test_decrease_is_bounded_by_min_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=3, min_limit=2, max_limit=10, backoff=0.1)
+        await limiter.acquire()
+        limiter.release(0.0, False)
+        assert limiter.limit == 2.0
+
+    run(scenario())
+
+
+def test_latency_spike_after_warmup_decreases_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=8, backoff=0.5, tolerance=2.0, warmup=3)
+        for _ in range(5):
+            await limiter.acquire()
+            limiter.release(0.1, True)
+        assert limiter.limit == 8.0
+        await limiter.acquire()
+        limiter.release(10.0, True)
+        assert limiter.limit == 4.0
+        assert limiter.errors == 0
+
+    run(scenario())
+
+
+def test_waiters_are_woken_in_fifo_order():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+        await limiter.acquire()
+        order = []
+
+        async def waiter(name):
+            await limiter.acquire()
+            order.append(name)
+
+        tasks = [asyncio.create_task(waiter(n)) for n in ("a", "b")]
+        await asyncio.sleep(0)
+        assert limiter.queue_depth == 2
+        limiter.release(0.1, True)
+        await asyncio.sleep(0)
+        assert order == ["a"]
+        limiter.release(0.1, True)
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b"]
+        assert limiter.in_flight == 1
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+        await limiter.acquire()
+        task = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert limiter.queue_depth == 0
+        assert limiter.in_flight == 1
+        limiter.release(0.1, True)
+        assert limiter.in_flight == 0
+
+    run(scenario())
+
+
+def test_cancelled_after_grant_passes_the_slot_on():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # место выдано первому ожидающему, но его отменили раньше, чем он проснулся
+        limiter.release(0.1, True)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await second
+        assert limiter.in_flight == 1
+        assert limiter.queue_depth == 0
+
+    run(scenario())
+
+
+def test_cancelled_slot_does_not_change_the_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=8)
+
+        async def call():
+            async with limiter.slot() as outcome:
+                await asyncio.sleep(10)
+                outcome["ok"] = True
+
+        task = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert limiter.in_flight == 0
+        assert limiter.limit == 4.0
+        assert limiter.samples == 0
+        assert limiter.errors == 0
+
+    run(scenario())
+
+
+def test_failed_slot_counts_as_error():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=8, backoff=0.5)
+        with pytest.raises(RuntimeError):
+            async with limiter.slot():
+                raise RuntimeError("boom")
+        assert limiter.in_flight == 0
+        assert limiter.errors == 1
+        assert limiter.limit == 2.0
+
+    run(scenario())
@@ -0,0 +1,58 @@
+from backend.services.dedup import BatchDeduplicator, DedupStats, MinHashLSH
+from backend.services.ingest import ImportRow
+from backend.services.text_utils import normalize_for_hash
+
+REVIEW = "Доставка пришла на два дня позже обещанного, курьер не позвонил заранее, упаковка помята"
+NEAR = "Доставка пришла на два дня позже обещанного, курьер не позвонил заранее, упаковка помята!!"
+OTHER = "Отличный магазин: большой выбор, вежливые консультанты и удобный самовывоз рядом с домом"
+
+
+def test_signature_is_deterministic_for_the_same_seed():
+    text = normalize_for_hash(REVIEW)
+    assert MinHashLSH(0.8, 100, seed=7).signature(text) == MinHashLSH(0.8, 100, seed=7).signature(text)
+    assert MinHashLSH(0.8, 100, seed=7).signature(text) != MinHashLSH(0.8, 100, seed=8).signature(text)
+
+
+def test_near_duplicate_is_rejected_and_different_text_kept():
+    lsh = MinHashLSH(threshold=0.8, max_docs=100)
+    assert lsh.add_if_new(normalize_for_hash(REVIEW))
+    assert not lsh.add_if_new(normalize_for_hash(NEAR))
+    assert lsh.add_if_new(normalize_for_hash(OTHER))
+
+
+def test_short_texts_are_compared_as_a_single_shingle():
+    lsh = MinHashLSH(threshold=0.8, max_docs=100)
+    assert lsh.add_if_new("ок")
+    assert not lsh.add_if_new("ок")
+    assert lsh.add_if_new("да")
+
+
+def test_index_stops_growing_at_max_docs_but_keeps_checking():
+    lsh = MinHashLSH(threshold=0.8, max_docs=1)
+    assert lsh.add_if_new(normalize_for_hash(REVIEW))
+    assert lsh.add_if_new(normalize_for_hash(OTHER))
+    # OTHER в индекс не попал, а с REVIEW сравнение продолжается
+    assert lsh.add_if_new(normalize_for_hash(OTHER))
+    assert not lsh.add_if_new(normalize_for_hash(NEAR))
+
+
+def test_batch_deduplicator_counts_exact_and_near_duplicates():
+    stats = DedupStats()
+    dedup = BatchDeduplicator(stats, near=True)
+    kept = dedup.filter_block([ImportRow(t) for t in (REVIEW, REVIEW.upper(), NEAR, OTHER)])
+    assert [row.text for row in kept] == [REVIEW, OTHER]
+    assert stats.as_dict() == {
+        "seen": 4,
+        "skipped": 2,
+        "duplicates_in_batch": 1,
+        "near_duplicates_in_batch": 1,
+        "already_imported": 0,
+    }
+    assert stats.reasons() == {"duplicate": 1, "near_duplicate": 1}
+
+
+def test_batch_deduplicator_without_near_mode_keeps_near_duplicates():
+    stats = DedupStats()
+    kept = BatchDeduplicator(stats, near=False).filter_block([ImportRow(t) for t in (REVIEW, NEAR, REVIEW)])
+    assert [row.text for row in kept] == [REVIEW, NEAR]
+    assert stats.reasons() == {"duplicate": 1}
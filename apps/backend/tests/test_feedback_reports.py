@@ -0,0 +1,37 @@
+import asyncio
+from datetime import datetime, timezone
+
+from backend.services import feedback_reports
+
+
+class FakeSession:
+    def __init__(self):
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, stmt, params=None):
+        self.statements.append((str(stmt), params))
+
+
+def test_store_deletes_reports_past_retention(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(feedback_reports, "get_session", lambda: lambda: session)
+    monkeypatch.setattr(feedback_reports.get_settings(), "feedback_report_retention_days", 2.0)
+
+    key = feedback_reports._ReportKey(
+        datetime(2024, 3, 1, tzinfo=timezone.utc), datetime(2024, 3, 8, tzinfo=timezone.utc), 5
+    )
+    asyncio.run(feedback_reports._store(key, "hash", {"feedback_analysis": [], "overall_proposals": []}))
+
+    (insert_sql, _), (delete_sql, delete_params) = session.statements
+    assert insert_sql.startswith("INSERT INTO feedback_reports")
+    assert delete_sql.startswith("DELETE FROM feedback_reports WHERE created_at <")
+    assert delete_params == {"ttl": 2 * 86400}
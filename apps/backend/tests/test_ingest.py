@@ -0,0 +1,161 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from backend.services.ingest import (
+    ImportFormatError,
+    ImportRow,
+    ReadProgress,
+    iter_csv_texts,
+    iter_import_texts,
+    parse_column_mapping,
+    parse_review_date,
+    row_from_json,
+    row_to_json,
+)
+
+UTC = timezone.utc
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        (None, {}),
+        ("", {}),
+        ('{"text": "review", "date": 2}', {"text": "review", "date": 2}),
+        ({"text": 0, "language": "lang"}, {"text": 0, "language": "lang"}),
+        ('{"text": "review", "date": null, "language": ""}', {"text": "review"}),
+    ],
+)
+def test_parse_column_mapping(raw, expected):
+    assert parse_column_mapping(raw) == expected
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "{not json",
+        "[1, 2]",
+        '{"text": "review", "rating": "stars"}',
+        '{"text": -1}',
+        '{"text": true}',
+        '{"date": 1.5}',
+        '{"language": ["lang"]}',
+    ],
+)
+def test_parse_column_mapping_rejects_invalid(raw):
+    with pytest.raises(ImportFormatError):
+        parse_column_mapping(raw)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2024-03-05", datetime(2024, 3, 5, tzinfo=UTC)),
+        ("2024-03-05T10:20:30Z", datetime(2024, 3, 5, 10, 20, 30, tzinfo=UTC)),
+        ("2024-03-05T10:20:30+03:00", datetime(2024, 3, 5, 7, 20, 30, tzinfo=UTC)),
+        ("05.03.2024", datetime(2024, 3, 5, tzinfo=UTC)),
+        ("05.03.2024 10:20", datetime(2024, 3, 5, 10, 20, tzinfo=UTC)),
+        ("05.03.2024 10:20:30", datetime(2024, 3, 5, 10, 20, 30, tzinfo=UTC)),
+        ("2024/03/05", datetime(2024, 3, 5, tzinfo=UTC)),
+        ("25/12/2024", datetime(2024, 12, 25, tzinfo=UTC)),
+        ("12/25/2024", datetime(2024, 12, 25, tzinfo=UTC)),
+        ("07/07/2024", datetime(2024, 7, 7, tzinfo=UTC)),
+        (1700000000, datetime(2023, 11, 14, 22, 13, 20, tzinfo=UTC)),
+        (1700000000000, datetime(2023, 11, 14, 22, 13, 20, tzinfo=UTC)),
+        (date(2024, 3, 5), datetime(2024, 3, 5, tzinfo=UTC)),
+        (datetime(2024, 3, 5, 10, 0), datetime(2024, 3, 5, 10, 0, tzinfo=UTC)),
+    ],
+)
+def test_parse_review_date(value, expected):
+    assert parse_review_date(value) == expected
+
+
+def test_parse_review_date_keeps_the_given_time_zone():
+    parsed = parse_review_date("2024-03-05T10:00:00+03:00")
+    assert parsed.utcoffset() == timedelta(hours=3)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [None, "", "   ", True, "вчера", "03/04/2024", "31/02/2024", "13/13/2024", "2024-13-01", float("inf")],
+)
+def test_parse_review_date_returns_none_for_unparsed_or_ambiguous(value):
+    assert parse_review_date(value) is None
+
+
+def test_unparsed_dates_are_counted_as_warnings(tmp_path):
+    path = tmp_path / "reviews.csv"
+    path.write_text(
+        "text,date\nпервый,25/12/2024\nвторой,\nтретий,03/04/2024\nчетвёртый,когда-то\n", encoding="utf-8"
+    )
+    progress = ReadProgress(path.stat().st_size)
+    rows = list(iter_csv_texts(str(path), progress=progress, columns={"text": "text", "date": "date"}))
+    assert [row.text for row in rows] == ["первый", "второй", "третий", "четвёртый"]
+    assert [row.review_date for row in rows] == [datetime(2024, 12, 25, tzinfo=UTC), None, None, None]
+    # пустая дата — не предупреждение, нераспознанная и неоднозначная — предупреждение
+    assert progress.warnings() == {"unparsed_date": 2}
+    assert progress.reasons() == {}
+
+
+@pytest.mark.parametrize("value", [45500, 0, -5, 4102444800])
+def test_numbers_outside_plausible_unix_time_are_not_dates(value):
+    assert parse_review_date(value) is None
+
+
+def test_excel_serial_numbers_in_xlsx_cells():
+    pytest.importorskip("openpyxl")
+    assert parse_review_date(45500, excel_serial=True) == datetime(2024, 7, 27, tzinfo=UTC)
+    assert parse_review_date(45500.5, excel_serial=True) == datetime(2024, 7, 27, 12, tzinfo=UTC)
+    # доля суток — время без даты
+    assert parse_review_date(0.5, excel_serial=True) is None
+    assert parse_review_date(1, excel_serial=True) is None
+
+
+def test_xlsx_general_format_date_is_read_as_excel_serial(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = tmp_path / "reviews.xlsx"
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["text", "date"])
+    sheet.append(["первый", 45500])
+    sheet.append(["второй", datetime(2024, 7, 28)])
+    workbook.save(path)
+
+    progress = ReadProgress(path.stat().st_size)
+    rows = list(iter_import_texts(str(path), "xlsx", progress=progress, columns={"text": "text", "date": "date"}))
+    assert [row.review_date for row in rows] == [
+        datetime(2024, 7, 27, tzinfo=UTC),
+        datetime(2024, 7, 28, tzinfo=UTC),
+    ]
+    assert progress.warnings() == {}
+
+
+@pytest.mark.parametrize(
+    "content, fmt, delimiter",
+    [
+        ("text\nотзыв\n", "csv", ";;"),
+        ('text\n"' + "x" * (1 << 18) + '"\n', "csv", ","),
+        ("not a zip archive", "xlsx", ","),
+    ],
+)
+def test_reader_errors_become_import_format_errors(tmp_path, content, fmt, delimiter):
+    if fmt == "xlsx":
+        pytest.importorskip("openpyxl")
+    path = tmp_path / f"reviews.{fmt}"
+    path.write_text(content, encoding="utf-8")
+    with pytest.raises(ImportFormatError):
+        list(iter_import_texts(str(path), fmt, delimiter))
+
+
+def test_missing_file_is_not_a_format_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(iter_import_texts(str(tmp_path / "gone.csv")))
+
+
+def test_row_json_round_trip_keeps_date_and_language():
+    row = ImportRow("отзыв", datetime(2024, 3, 5, 10, 0, tzinfo=UTC), "ru")
+    assert row_from_json(row_to_json(row)) == row
+    # строка без даты и языка хранится в чанке просто текстом
+    assert row_to_json(ImportRow("отзыв")) == "отзыв"
+    assert row_from_json("отзыв") == ImportRow("отзыв")
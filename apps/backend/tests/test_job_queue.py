@@ -0,0 +1,59 @@
+import asyncio
+import csv
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from backend.services import job_queue
+from backend.services.job_queue import ClaimedJob, split_job
+
+
+def make_job(tmp_path):
+    path = tmp_path / "import.csv"
+    path.write_text("text\nотзыв\n", encoding="utf-8")
+    row = SimpleNamespace(
+        id=1, batch_id=10, source_path=str(path), delimiter=",", encoding="utf-8", chunk_size=100, options={}
+    )
+    return ClaimedJob(row)
+
+
+@pytest.fixture
+def failed_jobs(monkeypatch):
+    failed = []
+
+    async def fake_fail_job(session_maker, job_id, batch_id, error):
+        failed.append((job_id, batch_id, error))
+
+    monkeypatch.setattr(job_queue, "_fail_job", fake_fail_job)
+    return failed
+
+
+def raising_reader(error):
+    def reader(*args, **kwargs):
+        raise error
+        yield  # pragma: no cover
+
+    return reader
+
+
+def test_parse_error_fails_the_job_instead_of_crashing_the_worker(tmp_path, monkeypatch, failed_jobs):
+    job = make_job(tmp_path)
+    monkeypatch.setattr(job_queue, "iter_import_texts", raising_reader(csv.Error("line contains NUL")))
+
+    assert asyncio.run(split_job(None, job, "worker", 60)) == 0
+    assert failed_jobs == [(1, 10, "Error('line contains NUL')")]
+    # повтор нарезки ничего не изменит — файл удалён
+    assert not (tmp_path / "import.csv").exists()
+
+
+def test_database_error_is_left_to_the_lease(tmp_path, monkeypatch, failed_jobs):
+    job = make_job(tmp_path)
+    monkeypatch.setattr(
+        job_queue, "iter_import_texts", raising_reader(OperationalError("SELECT 1", {}, Exception("gone")))
+    )
+
+    with pytest.raises(OperationalError):
+        asyncio.run(split_job(None, job, "worker", 60))
+    assert failed_jobs == []
+    assert (tmp_path / "import.csv").exists()
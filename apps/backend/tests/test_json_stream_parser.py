@@ -0,0 +1,60 @@
+from backend.core.llm_client import JsonStreamParser
+
+
+def feed_all(parser: JsonStreamParser, chunks):
+    result = None
+    for chunk in chunks:
+        result = parser.feed(chunk)
+    return result
+
+
+def test_object_split_across_chunks():
+    parser = JsonStreamParser()
+    assert parser.feed('{"overall_sentiment": "пол') is None
+    assert parser.feed('ожительная", "key_themes": [') is None
+    assert parser.feed("]}") == {"overall_sentiment": "положительная", "key_themes": []}
+
+
+def test_escaped_quotes_and_braces_inside_strings():
+    parser = JsonStreamParser()
+    result = feed_all(parser, ['{"text": "он сказал \\"', '}{\\" и ушёл", "n": ', "1}"])
+    assert result == {"text": 'он сказал "}{" и ушёл', "n": 1}
+
+
+def test_escaped_backslash_before_closing_quote():
+    parser = JsonStreamParser()
+    assert parser.feed('{"path": "C:\\\\"}') == {"path": "C:\\"}
+
+
+def test_code_fence_around_object():
+    parser = JsonStreamParser()
+    result = feed_all(parser, ["```json\n", '{"a": {"b": [1, 2]}}', "\n```"])
+    assert result == {"a": {"b": [1, 2]}}
+
+
+def test_stop_key_finishes_before_the_rest_of_the_object():
+    parser = JsonStreamParser(stop_key="key_themes")
+    assert parser.feed('{"overall_sentiment": "нейтральная", "key_themes": [{"theme": "до') is None
+    result = parser.feed('ставка"}], "explanation": "длинный хвост')
+    assert result == {"overall_sentiment": "нейтральная", "key_themes": [{"theme": "доставка"}]}
+
+
+def test_stop_key_ignores_nested_keys_with_the_same_name():
+    parser = JsonStreamParser(stop_key="key_themes")
+    assert parser.feed('{"meta": {"key_themes": []}, ') is None
+    assert parser.feed('"key_themes": ["цена"]') == {"meta": {"key_themes": []}, "key_themes": ["цена"]}
+
+
+def test_invalid_candidate_waits_for_the_end_of_the_object():
+    parser = JsonStreamParser(stop_key="a")
+    # после закрытия значения "a" кандидат не разбирается — парсер ждёт весь объект
+    assert parser.feed('{"a": [1,], ') is None
+    assert parser.stop_key is None
+    assert parser.feed('"b": 2}') is None
+
+
+def test_result_is_kept_after_completion():
+    parser = JsonStreamParser()
+    result = parser.feed('{"a": 1} trailing')
+    assert result == {"a": 1}
+    assert parser.feed('{"b": 2}') is result
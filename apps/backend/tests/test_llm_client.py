@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from backend.core import llm_client
+from backend.core.llm_client import LLMClient
+from backend.core.llm_router import LLMRouter, LLMServerError
+
+
+def make_client(handler, failure_threshold=5):
+    client = LLMClient(
+        router=LLMRouter(["http://llm-a/"], failure_threshold, cooldown=60.0, health_interval=0, health_path=None),
+        timeout=httpx.Timeout(5.0),
+        limits=httpx.Limits(),
+    )
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def stream_body(*frames):
+    return "\n".join(json.dumps(frame, ensure_ascii=False) for frame in frames).encode()
+
+
+@pytest.fixture
+def stream_settings(monkeypatch):
+    settings = llm_client.get_settings()
+    monkeypatch.setattr(settings, "llm_stream", True)
+    monkeypatch.setattr(settings, "llm_max_retries", 1)
+    monkeypatch.setattr(settings, "llm_retry_backoff", 0.0)
+    monkeypatch.setattr(settings, "llm_call_deadline", 5.0)
+
+
+def test_error_frame_is_retried_and_counted_as_endpoint_failure(stream_settings):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        if len(calls) == 1:
+            return httpx.Response(200, content=stream_body({"error": "model failed to load"}))
+        return httpx.Response(200, content=stream_body({"response": '{"a": 1}', "done": True}))
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            assert await client.complete_json({"prompt": "p"}, kind="test") == {"a": 1}
+            endpoint = client.router.endpoints[0]
+            assert endpoint.failures == 1
+            # успешный повтор обнуляет серию ошибок
+            assert endpoint.consecutive_failures == 0
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_repeated_error_frames_open_the_breaker(stream_settings):
+    def handler(request):
+        return httpx.Response(200, content=stream_body({"error": "out of memory"}))
+
+    async def scenario():
+        client = make_client(handler, failure_threshold=2)
+        try:
+            with pytest.raises(LLMServerError):
+                await client.complete_json({"prompt": "p"}, kind="test")
+            assert client.router.endpoints[0].state == "open"
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
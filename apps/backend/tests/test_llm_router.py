@@ -0,0 +1,112 @@
+import asyncio
+import types
+
+import httpx
+import pytest
+
+from backend.core import llm_router
+from backend.core.llm_router import LLMRouter
+
+A, B, C = "http://llm-a/", "http://llm-b/", "http://llm-c/"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_router, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def make_router(*urls, failure_threshold=2, cooldown=30.0):
+    return LLMRouter(list(urls), failure_threshold, cooldown, health_interval=0, health_path=None)
+
+
+def _take(router, endpoint):
+    """Занять конкретный сервер, как это сделал бы acquire при его выборе."""
+    endpoint.outstanding += 1
+    endpoint.requests += 1
+    return endpoint
+
+
+def server_error():
+    request = httpx.Request("POST", A)
+    return httpx.HTTPStatusError("boom", request=request, response=httpx.Response(503, request=request))
+
+
+def test_least_outstanding_endpoint_is_chosen():
+    router = make_router(A, B, C)
+    first = [router.acquire() for _ in range(3)]
+    # по одному запросу на каждый сервер
+    assert sorted(e.url for e in first) == [A, B, C]
+    router.release(first[1])
+    assert router.acquire() is first[1]
+    assert [e.outstanding for e in router.endpoints] == [1, 1, 1]
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    router = make_router(A, B)
+    a, b = router.endpoints
+    for _ in range(2):
+        router.release(_take(router, a), server_error())
+    assert a.state == "open"
+    # пока пауза не кончилась, все запросы уходят на B
+    assert {router.acquire().url for _ in range(3)} == {B}
+    assert b.outstanding == 3
+
+
+def test_half_open_allows_one_probe_and_success_closes(clock):
+    router = make_router(A, failure_threshold=1)
+    (a,) = router.endpoints
+    router.release(router.acquire(), asyncio.TimeoutError())
+    assert a.state == "open"
+
+    clock.now += 31
+    probe = router.acquire()
+    assert a.state == "half_open"
+    assert not a.available(clock.now)
+    router.release(probe)
+    assert a.state == "closed"
+    assert a.consecutive_failures == 0
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    router = make_router(A, B, failure_threshold=3)
+    a, b = router.endpoints
+    for _ in range(3):
+        router.release(_take(router, a), httpx.ConnectError("refused"))
+    clock.now += 31
+    assert a.available(clock.now)
+    router.release(_take(router, a), httpx.ConnectError("refused"))
+    assert a.state == "open"
+    assert a.opened_until == clock.now + 30.0
+
+
+def test_client_errors_and_cancellation_do_not_count_as_failures(clock):
+    router = make_router(A, failure_threshold=1)
+    (a,) = router.endpoints
+    request = httpx.Request("POST", A)
+    client_error = httpx.HTTPStatusError("bad", request=request, response=httpx.Response(400, request=request))
+    router.release(router.acquire(), client_error)
+    router.release(router.acquire(), ValueError("unparsable JSON"))
+    router.release(router.acquire(), asyncio.CancelledError())
+    assert a.state == "closed"
+    assert a.failures == 0
+    assert a.outstanding == 0
+
+
+def test_all_open_routes_to_the_endpoint_that_reopens_first(clock):
+    router = make_router(A, B, failure_threshold=1)
+    a, b = router.endpoints
+    router.release(_take(router, b), server_error())
+    clock.now += 10
+    router.release(_take(router, a), server_error())
+    assert a.state == b.state == "open"
+    assert router.acquire() is b
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+
+from backend.services.pipeline import BatchThroughput, analyze_in_order
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_results_keep_input_order_and_failures_become_empty():
+    async def analyze(text):
+        # поздние отзывы готовы раньше ранних
+        await asyncio.sleep(0.01 * (5 - int(text)))
+        if text == "2":
+            raise ValueError("bad response")
+        return {"n": int(text)}
+
+    async def scenario():
+        stats = BatchThroughput()
+        results = [item async for item in analyze_in_order([str(i) for i in range(5)], analyze, 3, stats)]
+        assert results == [("0", {"n": 0}), ("1", {"n": 1}), ("2", {}), ("3", {"n": 3}), ("4", {"n": 4})]
+        assert (stats.completed, stats.failed, stats.in_flight) == (5, 1, 0)
+
+    run(scenario())
+
+
+def test_sync_input_is_read_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    reader_threads = set()
+
+    def rows():
+        for i in range(5):
+            reader_threads.add(threading.get_ident())
+            yield str(i)
+
+    async def analyze(text):
+        return {}
+
+    async def scenario():
+        return [text async for text, _ in analyze_in_order(rows(), analyze, 2)]
+
+    assert run(scenario()) == ["0", "1", "2", "3", "4"]
+    assert loop_thread not in reader_threads
+
+
+def test_input_error_reaches_the_consumer():
+    def rows():
+        yield from ("0", "1", "2")
+        raise OSError("disk read failed")
+
+    async def analyze(text):
+        return {}
+
+    async def scenario():
+        seen = []
+        with pytest.raises(OSError):
+            async for text, _ in analyze_in_order(rows(), analyze, 2):
+                seen.append(text)
+        # вход читается блоками: строки блока, в котором случилась ошибка, не отдаются
+        assert seen == ["0", "1"]
+
+    run(scenario())
+
+
+def test_early_stop_cancels_and_awaits_leftover_tasks():
+    started = []
+    finished = []
+
+    async def analyze(text):
+        started.append(text)
+        try:
+            await asyncio.sleep(0 if text == "0" else 10)
+        finally:
+            finished.append(text)
+        return {}
+
+    async def scenario():
+        results = analyze_in_order([str(i) for i in range(10)], analyze, 3)
+        async for text, _ in results:
+            assert text == "0"
+            break
+        await results.aclose()
+        # после закрытия конвейера ни один вызов analyze не остался висеть
+        assert started and sorted(started) == sorted(finished)
+
+    run(scenario())
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from backend.services import prefilter
+from backend.services.ingest import ImportRow
+from backend.services.prefilter import PrefilterStats, filter_chunk, junk_reason
+
+
+def test_normalization_keeps_date_and_language_of_the_row():
+    row = ImportRow("  <b>Хороший</b>   магазин​ ", datetime(2024, 3, 5, tzinfo=timezone.utc), "ru")
+    stats = PrefilterStats()
+    assert filter_chunk([row], stats, drop_spam=False, normalize=True) == [
+        ImportRow("Хороший магазин", row.review_date, "ru")
+    ]
+    assert stats.normalized == 1
+
+
+@pytest.mark.parametrize(
+    "text, reason",
+    [
+        ("12345 !!!", "no_letters"),
+        ("я", "too_short"),
+        ("смотри http://a.ru и www.b.com", "links"),
+        ("http://spam.example.com/very/long/path ok", "links"),
+        ("аааааа", "gibberish"),
+        ("ааббаабба ааббаабба", "gibberish"),
+        ("бвгджз клмнпр хорошо", "gibberish"),
+        ("qwrt bcdf xyzw", "gibberish"),
+        ("ок", None),
+        ("Хороший магазин, всё понравилось", None),
+        ("купите на shop.ru", None),
+        # слова других письменностей правилом гласных не проверяются
+        ("Καλό προϊόν πολύ καλό", None),
+    ],
+)
+def test_junk_reason(text, reason):
+    assert junk_reason(text, min_letters=2) == reason
+
+
+class FakeClassifier:
+    def is_spam(self, text):
+        return "скидки" in text
+
+
+def test_filter_chunk_counts_each_drop_reason(monkeypatch):
+    monkeypatch.setattr(prefilter, "get_spam_classifier", lambda: FakeClassifier())
+    rows = [ImportRow(t) for t in ("Хороший магазин", "<br>", "!!!", "qwrt bcdf xyzw", "Лучшие скидки тут", "Всё&nbsp;ок")]
+    stats = PrefilterStats()
+
+    kept = filter_chunk(rows, stats, drop_spam=True, normalize=True)
+
+    assert [row.text for row in kept] == ["Хороший магазин", "Всё ок"]
+    assert stats.reasons() == {"empty": 1, "no_letters": 1, "gibberish": 1, "spam_classifier": 1}
+    assert stats.as_dict() == {
+        "seen": 6,
+        "normalized": 2,
+        "dropped": 4,
+        "empty": 1,
+        "no_letters": 1,
+        "gibberish": 1,
+        "spam_classifier": 1,
+    }
+
+
+def test_filter_chunk_without_spam_filter_keeps_junk():
+    stats = PrefilterStats()
+    rows = [ImportRow(t) for t in ("!!!", "qwrt bcdf xyzw")]
+    assert filter_chunk(rows, stats, drop_spam=False, normalize=False) == rows
+    assert stats.as_dict() == {"seen": 2, "normalized": 0, "dropped": 0}
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from backend.core import db
+from backend.services import themes
+from backend.services.analysis import REVIEW_ANALYSIS_PROMPT_VERSION
+from backend.services.reanalysis import ClaimedReanalysis, _stage_results, apply_reanalysis
+from backend.services.review_writer import PendingReview, write_reviews
+from backend.services.rollups import rebuild_rollups
+
+UTC = timezone.utc
+
+# Тест переноса результатов очищает таблицы отзывов — только для отдельной тестовой БД
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+JOB = ClaimedReanalysis(
+    SimpleNamespace(id=3, model_name="new", local_model_name=None, prompt_version="p", cursor_review_id=0)
+)
+
+
+class Result:
+    def __init__(self, rows=(), rowcount=0):
+        self._rows = list(rows)
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self._rows
+
+
+class LeaseSession:
+    """Сессия, в которой UPDATE reanalysis_jobs находит задание, только если аренда за воркером."""
+
+    def __init__(self, lease_held):
+        self.lease_held = lease_held
+        self.statements = []
+        self.rolled_back = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *exc):
+        self.rolled_back = exc_type is not None
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, stmt, params=None):
+        sql = " ".join(str(stmt).split())
+        self.statements.append((sql, params))
+        if sql.startswith("UPDATE reanalysis_jobs"):
+            return Result(rowcount=1 if self.lease_held else 0)
+        if sql.startswith("INSERT INTO themes"):
+            return Result([(name, i) for i, name in enumerate(params["names"], start=10)])
+        return Result()
+
+
+def staged_rows():
+    return [
+        PendingReview("отзыв", "положительная", [{"theme": "цена", "sentiment": "положительная"}], "new"),
+        PendingReview("ошибка", None, [], None),
+    ]
+
+
+def test_stage_results_writes_results_and_cursor_in_one_transaction(monkeypatch):
+    monkeypatch.setattr(themes, "_theme_ids", {})
+    session = LeaseSession(lease_held=True)
+
+    assert asyncio.run(_stage_results(lambda: session, JOB, "w", [101, 102], staged_rows()))
+
+    (update_sql, update), (themes_sql, _), (insert_sql, values) = session.statements
+    assert update == {"id": 3, "worker": "w", "cursor": 102, "staged": 1, "failed": 1}
+    assert themes_sql.startswith("INSERT INTO themes")
+    assert insert_sql.startswith("INSERT INTO reanalysis_results")
+    assert [(v["review_id"], v["overall"], json.loads(v["themes"])) for v in values] == [
+        (101, "положительная", [{"theme_id": 10, "sentiment": "положительная"}])
+    ]
+
+
+def test_stage_results_after_lost_lease_writes_nothing(monkeypatch):
+    monkeypatch.setattr(themes, "_theme_ids", {})
+    session = LeaseSession(lease_held=False)
+
+    assert not asyncio.run(_stage_results(lambda: session, JOB, "w", [101, 102], staged_rows()))
+
+    ((sql, _),) = session.statements
+    assert sql.startswith("UPDATE reanalysis_jobs SET cursor_review_id")
+    assert session.rolled_back
+
+
+def test_apply_after_lost_lease_changes_nothing():
+    session = LeaseSession(lease_held=False)
+
+    assert asyncio.run(apply_reanalysis(lambda: session, JOB, "w")) is None
+
+    ((sql, params),) = session.statements
+    assert sql.startswith("UPDATE reanalysis_jobs SET locked_until")
+    assert params["worker"] == "w"
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_applied_rollup_deltas_match_a_full_rebuild(monkeypatch):
+    monkeypatch.setattr(db, "_engine", None)
+    monkeypatch.setattr(db, "_SessionLocal", None)
+    monkeypatch.setattr(themes, "_theme_ids", {})
+
+    def review(day, hour, sentiment, *theme_names):
+        return PendingReview(
+            f"отзыв {day} {hour}",
+            sentiment,
+            [{"theme": t, "sentiment": sentiment} for t in theme_names],
+            "old",
+            datetime(2024, 3, day, hour, tzinfo=UTC),
+        )
+
+    old = [
+        review(4, 10, "отрицательная", "доставка"),
+        review(4, 23, "нейтральная", "цена", "доставка"),
+        review(5, 1, "положительная", "качество"),
+        review(5, 12, "отрицательная"),
+    ]
+    new = [
+        PendingReview(r.raw_text, s, [{"theme": t, "sentiment": s} for t in names], "new")
+        for r, s, names in zip(
+            old,
+            ["положительная", "нейтральная", "отрицательная", None],
+            [["доставка"], ["цена"], ["качество", "доставка"], []],
+        )
+    ]
+
+    async def snapshot(session):
+        reviews_rollup = await session.execute(text("SELECT * FROM review_daily_rollup ORDER BY day"))
+        themes_rollup = await session.execute(
+            text(
+                "SELECT day, theme_id, sentiment, review_count FROM theme_daily_rollup "
+                "WHERE review_count <> 0 ORDER BY 1, 2, 3"
+            )
+        )
+        return reviews_rollup.fetchall(), themes_rollup.fetchall()
+
+    async def scenario():
+        engine = db.get_engine(TEST_DATABASE_URL)
+        try:
+            await db.init_db(engine)
+            session_maker = db.get_session()
+            async with session_maker() as session:
+                async with session.begin():
+                    await session.execute(
+                        text(
+                            "TRUNCATE import_batches, reviews, review_themes, review_hashes, themes, "
+                            "review_daily_rollup, theme_daily_rollup, reanalysis_jobs, reanalysis_results CASCADE"
+                        )
+                    )
+                    batch_id = (
+                        await session.execute(
+                            text("INSERT INTO import_batches (source_type) VALUES ('api') RETURNING id")
+                        )
+                    ).scalar()
+                    await write_reviews(session, batch_id, old)
+                    review_ids = [
+                        row[0] for row in (await session.execute(text("SELECT id FROM reviews ORDER BY id"))).fetchall()
+                    ]
+                    job = ClaimedReanalysis(
+                        (
+                            await session.execute(
+                                text(
+                                    """
+                                    INSERT INTO reanalysis_jobs (status, worker_id, model_name, prompt_version)
+                                    VALUES ('running', 'w', 'new', :prompt)
+                                    RETURNING id, model_name, local_model_name, prompt_version, cursor_review_id
+                                    """
+                                ),
+                                {"prompt": REVIEW_ANALYSIS_PROMPT_VERSION},
+                            )
+                        ).fetchone()
+                    )
+
+            assert await _stage_results(session_maker, job, "w", review_ids, new)
+            # неудачный анализ не переносится: отзыв остаётся прежним
+            assert await apply_reanalysis(session_maker, job, "w") == 3
+
+            async with session_maker() as session:
+                res = await session.execute(text("SELECT overall_sentiment, model_name FROM reviews ORDER BY id"))
+                assert res.fetchall() == [
+                    ("положительная", "new"),
+                    ("нейтральная", "new"),
+                    ("отрицательная", "new"),
+                    ("отрицательная", "old"),
+                ]
+                applied = await snapshot(session)
+            async with session_maker() as session:
+                async with session.begin():
+                    await rebuild_rollups(session)
+                assert await snapshot(session) == applied
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
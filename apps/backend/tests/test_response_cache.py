@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from backend.services import response_cache
+from backend.services.response_cache import ResponseCache, bump_data_generation, bump_data_generation_after_write
+
+
+class Result:
+    def __init__(self, value):
+        self._value = value
+
+    def scalar(self):
+        return self._value
+
+
+class GenerationDB:
+    """Строка data_generation: чтение и увеличение поколения."""
+
+    def __init__(self):
+        self.generation = 0
+        self.bumps = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, stmt, params=None):
+        sql = str(stmt)
+        if "SELECT generation" in sql:
+            return Result(self.generation)
+        if "INSERT INTO data_generation" in sql:
+            self.generation += 1
+            self.bumps += 1
+            return Result(None)
+        raise AssertionError(f"unexpected query: {sql}")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_compute(calls):
+    async def compute():
+        calls.append(1)
+        return {"total": len(calls)}
+
+    return compute
+
+
+def test_generation_bump_invalidates_cached_responses():
+    db = GenerationDB()
+    cache = ResponseCache(max_size=10, ttl=60.0, shared=False)
+    calls = []
+
+    async def scenario():
+        params = {"days": 7}
+        assert await cache.get_or_compute(db, "summary", params, make_compute(calls)) == {"total": 1}
+        assert await cache.get_or_compute(db, "summary", params, make_compute(calls)) == {"total": 1}
+        await bump_data_generation(db)
+        # после записи отзывов старый ключ больше не находится
+        assert await cache.get_or_compute(db, "summary", params, make_compute(calls)) == {"total": 2}
+
+    run(scenario())
+    assert len(calls) == 2
+    assert cache.stats()["by_endpoint"]["summary"] == {"hits": 1, "misses": 2, "hit_ratio": 0.3333}
+
+
+def test_keys_differ_by_endpoint_params_and_generation():
+    key = ResponseCache.make_key("summary", 3, {"b": 2, "a": 1})
+    assert key == ResponseCache.make_key("summary", 3, {"a": 1, "b": 2})
+    assert key != ResponseCache.make_key("summary", 4, {"a": 1, "b": 2})
+    assert key != ResponseCache.make_key("brief", 3, {"a": 1, "b": 2})
+
+
+def test_expired_and_evicted_entries_are_recomputed():
+    async def scenario():
+        expired = ResponseCache(max_size=10, ttl=0.0, shared=False)
+        await expired.put("k", 0, {"v": 1})
+        assert await expired.get("k") is None
+
+        small = ResponseCache(max_size=2, ttl=60.0, shared=False)
+        for key in ("a", "b"):
+            await small.put(key, 0, key)
+        assert await small.get("a") == "a"
+        # «b» использовался давнее всего и вытесняется
+        await small.put("c", 0, "c")
+        assert await small.get("b") is None
+        assert [await small.get(k) for k in ("a", "c")] == ["a", "c"]
+
+    run(scenario())
+
+
+@pytest.fixture
+def bump_interval(monkeypatch):
+    monkeypatch.setattr(response_cache, "_last_import_bump", float("-inf"))
+    monkeypatch.setattr(response_cache.get_settings(), "data_generation_bump_interval", 3600.0)
+
+
+def test_import_bumps_are_throttled_but_forced_at_the_end(bump_interval):
+    db = GenerationDB()
+
+    async def scenario():
+        await bump_data_generation_after_write(lambda: db)
+        await bump_data_generation_after_write(lambda: db)
+        assert db.bumps == 1
+        await bump_data_generation_after_write(lambda: db, force=True)
+        assert db.bumps == 2
+
+    run(scenario())
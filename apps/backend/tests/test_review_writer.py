@@ -0,0 +1,161 @@
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql
+
+from backend.services import review_writer, themes
+from backend.services.ingest import ImportRow
+from backend.services.review_writer import PendingReview, ReviewBulkWriter, write_reviews
+from backend.services.text_utils import review_hash
+
+NOW = datetime(2024, 3, 5, 12, tzinfo=timezone.utc)
+
+
+class Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeSession:
+    """Транзакция write_reviews: выдаёт id отзывов и тем, остальные запросы запоминает."""
+
+    def __init__(self, committed_themes=None):
+        self.themes = dict(committed_themes or {})
+        self.next_review_id = 100
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, stmt, params=None):
+        sql = str(stmt)
+        if "nextval" in sql:
+            ids = range(self.next_review_id, self.next_review_id + params["n"])
+            self.next_review_id += params["n"]
+            return Result([(i, NOW) for i in ids])
+        if "INSERT INTO themes" in sql:
+            new = [n for n in params["names"] if n not in self.themes]
+            for name in new:
+                self.themes[name] = len(self.themes) + 1
+            return Result([(n, self.themes[n]) for n in new])
+        if "FROM themes" in sql:
+            return Result([(n, self.themes[n]) for n in params["names"] if n in self.themes])
+        self.statements.append(stmt)
+        return Result([])
+
+    def inserts(self, table):
+        return [s for s in self.statements if getattr(getattr(s, "table", None), "name", None) == table]
+
+
+def inserted_rows(stmt):
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    rows = {}
+    for key, value in params.items():
+        column, _, index = key.rpartition("_m")
+        rows.setdefault(int(index), {})[column] = value
+    return [rows[i] for i in sorted(rows)]
+
+
+def test_duplicate_texts_in_a_chunk_index_the_first_review():
+    session = FakeSession()
+    rows = [
+        PendingReview("Курьер опоздал", "отрицательная", [], "m"),
+        PendingReview("курьер  ОПОЗДАЛ", "отрицательная", [], "m"),
+        PendingReview("Всё отлично", "положительная", [], "m"),
+    ]
+    asyncio.run(write_reviews(session, 7, rows))
+
+    assert [r["id"] for stmt in session.inserts("reviews") for r in inserted_rows(stmt)] == [100, 101, 102]
+    (hashes,) = session.inserts("review_hashes")
+    assert {r["hash"]: r["review_id"] for r in inserted_rows(hashes)} == {
+        review_hash("Курьер опоздал"): 100,
+        review_hash("Всё отлично"): 102,
+    }
+
+
+def test_large_chunk_is_split_into_inserts_under_the_parameter_limit(monkeypatch):
+    # у строки reviews 8 колонок: две строки на запрос
+    monkeypatch.setattr(review_writer, "_MAX_PARAMS_PER_QUERY", 16)
+    session = FakeSession()
+    rows = [PendingReview(f"отзыв {i}", "нейтральная", [], "m") for i in range(5)]
+    asyncio.run(write_reviews(session, 7, rows))
+
+    assert [len(inserted_rows(stmt)) for stmt in session.inserts("reviews")] == [2, 2, 1]
+
+
+def test_themes_are_resolved_in_the_writer_transaction(monkeypatch):
+    monkeypatch.setattr(themes, "_theme_ids", {})
+    session = FakeSession(committed_themes={"доставка": 1})
+    rows = [
+        PendingReview("отзыв", "отрицательная", [{"theme": "Доставка", "sentiment": "отрицательная"}], "m"),
+        PendingReview("другой", "положительная", [{"theme": "цена", "sentiment": "положительная"}], "m"),
+    ]
+    asyncio.run(write_reviews(session, 7, rows))
+
+    (theme_insert,) = session.inserts("review_themes")
+    assert [(r["review_id"], r["theme_id"]) for r in inserted_rows(theme_insert)] == [(100, 1), (101, 2)]
+    # тема, вставленная ещё не закоммиченной транзакцией, в кэш не попадает
+    assert themes._theme_ids == {"доставка": 1}
+
+
+def test_bulk_writer_flushes_full_chunks_and_the_tail(monkeypatch):
+    chunks = []
+    flushed = []
+
+    async def fake_write(session, batch_id, rows):
+        chunks.append([row.raw_text for row in rows])
+
+    async def on_flush(written, failed):
+        flushed.append((written, failed))
+
+    monkeypatch.setattr(review_writer, "write_reviews", fake_write)
+    monkeypatch.setattr(review_writer, "bump_data_generation_after_write", lambda session_maker: asyncio.sleep(0))
+
+    async def scenario():
+        writer = ReviewBulkWriter(FakeSession, 7, chunk_size=3, on_flush=on_flush)
+        for i in range(7):
+            await writer.add(ImportRow(str(i)), "нейтральная", [])
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert chunks == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+    assert flushed == [(3, 0), (3, 0), (1, 0)]
+    assert (writer.written, writer.failed) == (7, 0)
+
+
+def test_failed_chunk_is_retried_row_by_row(monkeypatch):
+    attempts = []
+    bumps = []
+
+    async def fake_write(session, batch_id, rows):
+        attempts.append([row.raw_text for row in rows])
+        if any(row.raw_text == "плохой" for row in rows):
+            raise ValueError("check constraint violated")
+
+    async def fake_bump(session_maker):
+        bumps.append(session_maker)
+
+    monkeypatch.setattr(review_writer, "write_reviews", fake_write)
+    monkeypatch.setattr(review_writer, "bump_data_generation_after_write", fake_bump)
+
+    async def scenario():
+        writer = ReviewBulkWriter(FakeSession, 7, chunk_size=10)
+        for text in ("первый", "плохой", "третий"):
+            await writer.add(ImportRow(text), "нейтральная", [])
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert attempts == [["первый", "плохой", "третий"], ["первый"], ["плохой"], ["третий"]]
+    assert (writer.written, writer.failed) == (2, 1)
+    assert len(bumps) == 1
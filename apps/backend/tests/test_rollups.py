@@ -0,0 +1,149 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+
+from backend.core import db
+from backend.services import themes
+from backend.services.dashboard_metrics import _sentiment_totals, _window_params, get_top_themes
+from backend.services.review_writer import PendingReview, write_reviews
+
+UTC = timezone.utc
+MSK = timezone(timedelta(hours=3))
+
+# Тест агрегатов против сырых таблиц очищает таблицы отзывов — только для отдельной тестовой БД
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+def test_window_params_splits_whole_utc_days():
+    params = _window_params(datetime(2024, 3, 4, 12, tzinfo=UTC), datetime(2024, 3, 7, 6, tzinfo=UTC))
+    assert params["lo"] == datetime(2024, 3, 5, tzinfo=UTC)
+    assert params["hi"] == datetime(2024, 3, 7, tzinfo=UTC)
+    assert (params["lo_day"], params["hi_day"]) == (datetime(2024, 3, 5).date(), datetime(2024, 3, 7).date())
+
+
+def test_window_params_starting_at_midnight_includes_the_first_day():
+    params = _window_params(datetime(2024, 3, 5), datetime(2024, 3, 6))
+    assert (params["lo"], params["hi"]) == (datetime(2024, 3, 5), datetime(2024, 3, 6))
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        # нет ни одних целых суток
+        (datetime(2024, 3, 4, 12, tzinfo=UTC), datetime(2024, 3, 5, 6, tzinfo=UTC)),
+        # сутки не в UTC не совпадают с сутками агрегатов
+        (datetime(2024, 3, 4, tzinfo=MSK), datetime(2024, 3, 7, tzinfo=MSK)),
+    ],
+)
+def test_window_params_without_whole_utc_days_reads_raw_rows_only(start, end):
+    params = _window_params(start, end)
+    assert params["lo"] == params["hi"] == end
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_rollups_match_raw_rows_on_a_server_with_another_time_zone(monkeypatch):
+    monkeypatch.setattr(db, "_engine", None)
+    monkeypatch.setattr(db, "_SessionLocal", None)
+    monkeypatch.setattr(themes, "_theme_ids", {})
+
+    reviews = [
+        (datetime(2024, 3, 4, 20, 30, tzinfo=UTC), "положительная", "доставка"),
+        (datetime(2024, 3, 4, 23, 30, tzinfo=UTC), "отрицательная", "доставка"),
+        (datetime(2024, 3, 5, 0, 10, tzinfo=UTC), "нейтральная", "цена"),
+        (datetime(2024, 3, 5, 12, 0, tzinfo=UTC), "положительная", "цена"),
+        (datetime(2024, 3, 5, 23, 59, 59, tzinfo=UTC), "отрицательная", "доставка"),
+        (datetime(2024, 3, 6, 0, 0, tzinfo=UTC), "положительная", "качество"),
+        (datetime(2024, 3, 7, 15, 0, tzinfo=UTC), "нейтральная", "качество"),
+    ]
+    windows = [
+        (datetime(2024, 3, 4, tzinfo=UTC), datetime(2024, 3, 8, tzinfo=UTC)),
+        (datetime(2024, 3, 4, 12, tzinfo=UTC), datetime(2024, 3, 7, tzinfo=UTC)),
+        (datetime(2024, 3, 5, tzinfo=UTC), datetime(2024, 3, 6, tzinfo=UTC)),
+        (datetime(2024, 3, 4, 23, tzinfo=UTC), datetime(2024, 3, 6, 6, tzinfo=UTC)),
+        (datetime(2024, 3, 5, tzinfo=MSK), datetime(2024, 3, 7, tzinfo=MSK)),
+    ]
+
+    async def raw_totals(session, start, end):
+        res = await session.execute(
+            text(
+                """
+                SELECT overall_sentiment, COUNT(*) FROM reviews
+                WHERE review_created_at >= :start AND review_created_at < :end
+                GROUP BY overall_sentiment
+                """
+            ),
+            {"start": start, "end": end},
+        )
+        counts = dict(res.fetchall())
+        distribution = {s: counts.get(s, 0) for s in ("положительная", "нейтральная", "отрицательная")}
+        return sum(counts.values()), distribution
+
+    async def raw_themes(session, start, end, sentiment):
+        res = await session.execute(
+            text(
+                """
+                SELECT t.name, COUNT(*) FROM review_themes rt JOIN themes t ON t.id = rt.theme_id
+                WHERE rt.review_created_at >= :start AND rt.review_created_at < :end
+                  AND rt.sentiment = :sentiment
+                GROUP BY t.name
+                """
+            ),
+            {"start": start, "end": end, "sentiment": sentiment},
+        )
+        return dict(res.fetchall())
+
+    async def scenario():
+        engine = db.get_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(
+                    text(
+                        "DO $$ BEGIN EXECUTE format('ALTER DATABASE %I SET timezone = %L', "
+                        "current_database(), 'Asia/Vladivostok'); END $$"
+                    )
+                )
+                await conn.commit()
+            # новые подключения получают TimeZone базы, если движок его не задаёт
+            await engine.dispose()
+            await db.init_db(engine)
+            async with db.get_session()() as session:
+                async with session.begin():
+                    assert (await session.execute(text("SHOW timezone"))).scalar() == "UTC"
+                    await session.execute(
+                        text(
+                            "TRUNCATE import_batches, reviews, review_themes, review_hashes, "
+                            "review_daily_rollup, theme_daily_rollup CASCADE"
+                        )
+                    )
+                    batch_id = (
+                        await session.execute(
+                            text("INSERT INTO import_batches (source_type) VALUES ('api') RETURNING id")
+                        )
+                    ).scalar()
+                    await write_reviews(
+                        session,
+                        batch_id,
+                        [
+                            PendingReview(f"отзыв {i}", sentiment, [{"theme": theme, "sentiment": sentiment}], "m", created_at)
+                            for i, (created_at, sentiment, theme) in enumerate(reviews)
+                        ],
+                    )
+
+            async with db.get_session()() as session:
+                for start, end in windows:
+                    assert await _sentiment_totals(session, start, end) == await raw_totals(session, start, end)
+                    for sentiment in ("положительная", "нейтральная", "отрицательная"):
+                        top = await get_top_themes(session, start, end, sentiment, limit=10)
+                        assert {t.topic: t.count for t in top} == await raw_themes(session, start, end, sentiment)
+        finally:
+            async with engine.connect() as conn:
+                await conn.execute(
+                    text("DO $$ BEGIN EXECUTE format('ALTER DATABASE %I RESET timezone', current_database()); END $$")
+                )
+                await conn.commit()
+            await engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services import tiered_analysis
+from backend.services.ingest import ImportRow
+from backend.services.pipeline import analyze_in_order
+from backend.services.tiered_analysis import TieredAnalyzer, TierStats
+
+LOCAL = {"review_analysis": {"overall_sentiment": "положительная", "key_themes": []}, "model": "local:test"}
+LLM = {"review_analysis": {"overall_sentiment": "нейтральная", "key_themes": []}}
+
+
+class FakeModel:
+    def __init__(self, confidence):
+        self.confidence = confidence
+
+    def predict_batch(self, texts):
+        return [SimpleNamespace(result=LOCAL, confidence=self.confidence[t]) for t in texts]
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    async def fake_llm(text):
+        calls.append(text)
+        return LLM
+
+    monkeypatch.setattr(tiered_analysis, "cached_analyze_review", fake_llm)
+    monkeypatch.setattr(tiered_analysis, "_totals", TierStats())
+    return calls
+
+
+def analyze_all(analyzer, texts):
+    async def scenario():
+        rows = analyzer.stream(ImportRow(t) for t in texts)
+        return [(row.text, analysis) async for row, analysis in analyze_in_order(rows, analyzer, 4)]
+
+    return asyncio.run(scenario())
+
+
+def test_confident_predictions_skip_the_llm(llm_calls):
+    stats = TierStats()
+    model = FakeModel({"уверенно": 0.95, "на пороге": 0.9, "сомнительно": 0.89})
+    results = analyze_all(TieredAnalyzer(model, 0.9, stats), ["уверенно", "сомнительно", "на пороге"])
+
+    assert results == [("уверенно", LOCAL), ("сомнительно", LLM), ("на пороге", LOCAL)]
+    assert llm_calls == ["сомнительно"]
+    assert stats.counts() == {"local": 2, "llm": 1}
+    histogram = stats.as_dict()["confidence_histogram"]
+    assert (histogram["0.85"], histogram["0.90"], histogram["0.95"]) == (1, 1, 1)
+
+
+def test_repeated_text_uses_the_local_result_for_every_copy(llm_calls):
+    stats = TierStats()
+    analyzer = TieredAnalyzer(FakeModel({"дубль": 0.99}), 0.9, stats)
+    assert analyze_all(analyzer, ["дубль", "дубль"]) == [("дубль", LOCAL), ("дубль", LOCAL)]
+    assert llm_calls == []
+    # результаты забраны — в памяти ничего не осталось
+    assert analyzer._ready == {}
+
+
+def test_threshold_above_one_sends_everything_to_the_llm(llm_calls):
+    stats = TierStats()
+    analyze_all(TieredAnalyzer(FakeModel({"a": 1.0, "b": 0.5}), 1.01, stats), ["a", "b"])
+    assert llm_calls == ["a", "b"]
+    assert stats.counts() == {"llm": 2}
+
+
+def test_uncertain_theme_lowers_local_confidence(llm_calls):
+    np = pytest.importorskip("numpy")
+    from backend.services.local_model import LocalReviewModel
+
+    def model(theme_bias):
+        # без признаков: предсказание задаётся смещениями (положительная — с большим отрывом)
+        return LocalReviewModel(
+            weights=np.zeros((8, 4), dtype=np.float32),
+            bias=np.array([0.0, 0.0, 5.0, theme_bias], dtype=np.float32),
+            themes=["доставка"],
+            dim=8,
+            ngrams=[2],
+        )
+
+    (sure,) = model(-5.0).predict_batch(["отзыв"])
+    (unsure,) = model(0.0).predict_batch(["отзыв"])
+    assert sure.confidence > 0.95
+    assert unsure.confidence == pytest.approx(0.5)
+
+    stats = TierStats()
+    analyzer = TieredAnalyzer(model(0.0), 0.9, stats)
+    assert analyze_all(analyzer, ["отзыв"]) == [("отзыв", LLM)]
+    assert stats.counts() == {"llm": 1}
@@ -0,0 +1,35 @@
+import asyncio
+
+from backend import worker
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def test_failed_import_step_does_not_stop_the_worker(monkeypatch):
+    class Engine:
+        async def dispose(self):
+            pass
+
+    calls = []
+    stop = asyncio.Event()
+
+    async def flaky_step(session_maker, worker_id):
+        calls.append(worker_id)
+        if len(calls) == 1:
+            raise ConnectionError("database is restarting")
+        stop.set()
+        return True
+
+    monkeypatch.setattr(worker, "get_engine", lambda url: Engine())
+    monkeypatch.setattr(worker, "init_db", _noop)
+    monkeypatch.setattr(worker, "get_session", lambda: None)
+    monkeypatch.setattr(worker, "_import_step", flaky_step)
+    monkeypatch.setattr(worker, "close_review_batcher", _noop)
+    monkeypatch.setattr(worker, "close_llm_client", _noop)
+    monkeypatch.setattr(worker.get_settings(), "worker_poll_interval", 0.01)
+    monkeypatch.setattr(worker.get_settings(), "reviews_partitioned", False)
+
+    asyncio.run(worker.run_worker(stop))
+    assert len(calls) == 2